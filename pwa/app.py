@@ -6,8 +6,10 @@ bloque l'accès aux pages protégées tant que la session Flask n'a pas de
 `user_id`. Les routes lisent leurs données via `core.data` qui reprend
 ce `user_id` dans `flask.g`.
 """
+import hashlib
 import logging
 import os
+import secrets
 from datetime import timedelta
 
 from flask import Flask, render_template, send_from_directory, session, g, redirect, url_for, request
@@ -29,6 +31,9 @@ from routes.premium import bp as premium_bp
 from routes.admin import bp as admin_bp
 
 from core import db as core_db
+from core import data as core_data
+from core import assets as core_assets
+from core.dates import today_paris_str, logical_today_paris_str
 
 # Logging structuré — remplace print() un peu partout dans le code.
 logging.basicConfig(
@@ -89,16 +94,17 @@ def _require_login():
     g.email = session.get("email", "")
 
     # Phase 5 : statut VIP disponible partout via g.is_vip. Lu depuis
-    # profiles.tier ∈ {'free','vip'}. Mis en cache session (invalidation
-    # explicite dans /admin/set-tier).
-    cached_vip = session.get("is_vip")
-    if cached_vip is None:
-        try:
-            profile = core_db.get_profile(user_id) or {}
-            cached_vip = (profile.get("tier") or "free").strip().lower() == "vip"
-        except Exception:
-            cached_vip = False
-        session["is_vip"] = cached_vip
+    # profiles.tier ∈ {'free','vip'} — le profil est en cache côté core.db
+    # (write-through sur set_user_tier), donc un changement de tier par
+    # l'admin est vu sans reconnexion. La session ne sert que de repli si
+    # Supabase est injoignable.
+    try:
+        profile = core_data.get_profile() or {}
+        cached_vip = (profile.get("tier") or "free").strip().lower() == "vip"
+        if session.get("is_vip") != cached_vip:
+            session["is_vip"] = cached_vip
+    except Exception:
+        cached_vip = session.get("is_vip") or False
     g.is_vip = bool(cached_vip)
 
     # Phase 4 : gate onboarding. Les routes /onboarding/* et /logout sont
@@ -108,7 +114,7 @@ def _require_login():
     # Cache le flag en session pour éviter un hit DB à chaque requête
     if not session.get("onboarded"):
         try:
-            onboarding = core_db.get_onboarding(user_id)
+            onboarding = core_data.get_onboarding()
         except Exception:
             onboarding = {}
         if not onboarding:
@@ -117,8 +123,8 @@ def _require_login():
             # il risque d'écraser ses données. On crée une row minimale et
             # on le laisse passer.
             try:
-                has_prog = bool(core_db.get_prog(user_id))
-                has_hist = bool(core_db.get_hist(user_id))
+                has_prog = bool(core_data.get_prog())
+                has_hist = bool(core_data.get_hist())
             except Exception:
                 has_prog = has_hist = False
             if has_prog or has_hist:
@@ -133,6 +139,128 @@ def _require_login():
     return None
 
 
+# ────────────────────────────────────────────────────────────────
+# Assets statiques : URLs à empreinte + compression
+# ────────────────────────────────────────────────────────────────
+# `url_for('static', filename=...)` → `/static/...?v=<empreinte du contenu>`.
+# Une URL versionnée est immuable (cache navigateur 1 an) ; l'ancienne
+# URL sans `v` reste servie avec la revalidation par défaut de Flask.
+assets = core_assets.StaticAssets(app.static_folder)
+_IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+@app.url_defaults
+def _static_version(endpoint, values):
+    if endpoint == "static" and "v" not in values:
+        version = assets.version(values.get("filename"))
+        if version:
+            values["v"] = version
+
+
+@app.after_request
+def _static_headers(response):
+    if request.endpoint != "static":
+        return response
+    filename = (request.view_args or {}).get("filename")
+    version = assets.version(filename)
+    if version and request.args.get("v") == version and response.status_code in (200, 304):
+        response.headers["Cache-Control"] = _IMMUTABLE
+    if response.status_code == 200 and "Content-Range" not in response.headers:
+        encoding = core_assets.negotiate(request.accept_encodings)
+        body = assets.compressed(filename, encoding) if encoding else None
+        if body is not None:
+            response.close()  # referme le fichier ouvert par send_file
+            response.direct_passthrough = False
+            response.set_data(body)
+            response.headers["Content-Encoding"] = encoding
+            response.headers.pop("Accept-Ranges", None)
+            etag, _weak = response.get_etag()
+            if etag:  # même ETag pour toutes les variantes → faible
+                response.set_etag(etag, weak=True)
+        if os.path.splitext(filename or "")[1] in core_assets.COMPRESSIBLE_EXTS:
+            response.vary.add("Accept-Encoding")
+    return response
+
+
+# ────────────────────────────────────────────────────────────────
+# Revalidation HTTP — ETag faible sur les pages de données
+# ────────────────────────────────────────────────────────────────
+# Le rendu ne dépend que de : l'user, la version de ses données (remplacée
+# par chaque write de core.db), l'URL complète, la date (calendaire et
+# « logique »), le tier et le code déployé. Si le navigateur (ou le service
+# worker, via le cache HTTP) renvoie le même ETag → 304 sans rendu.
+_ETAG_PATHS = {"/accueil", "/seance", "/progres", "/programme"}
+_ETAG_PREFIXES = ("/progres/section/",)
+_BUILD_ID = (os.getenv("RAILWAY_DEPLOYMENT_ID") or os.getenv("RAILWAY_GIT_COMMIT_SHA")
+             or secrets.token_hex(4))
+
+
+@app.before_request
+def _conditional_get():
+    if request.method != "GET" or not getattr(g, "user_id", None):
+        return None
+    path = request.path
+    if path not in _ETAG_PATHS and not path.startswith(_ETAG_PREFIXES):
+        return None
+    try:
+        version = core_db.data_version(g.user_id)
+    except Exception as e:
+        logger.error("data_version FAILED user=%s: %s", g.user_id, e)
+        return None
+    raw = "|".join((
+        g.user_id, version, request.full_path, today_paris_str(),
+        logical_today_paris_str(), "vip" if g.is_vip else "free", _BUILD_ID,
+    ))
+    g.etag = hashlib.sha1(raw.encode("utf-8")).hexdigest()[:24]
+    if request.if_none_match.contains_weak(g.etag):
+        response = app.response_class(status=304)
+        response.set_etag(g.etag, weak=True)
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
+    return None
+
+
+@app.after_request
+def _set_etag(response):
+    etag = getattr(g, "etag", None)
+    if etag and response.status_code == 200:
+        response.set_etag(etag, weak=True)
+        response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+@app.after_request
+def _compress(response):
+    """gzip/brotli à la volée des réponses dynamiques (HTML, JSON).
+
+    Les réponses streamées (SSE, exports) et les fichiers passent tels quels."""
+    if (request.endpoint == "static" or response.status_code != 200
+            or response.direct_passthrough or response.is_streamed
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in core_assets.COMPRESSIBLE_TYPES):
+        return response
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    if len(data) < core_assets.MIN_SIZE:
+        return response
+    encoding = core_assets.negotiate(request.accept_encodings)
+    if encoding is None:
+        return response
+    try:
+        response.set_data(core_assets.compress(data, encoding))
+    except Exception as e:
+        logger.error("compression %s FAILED path=%s: %s", encoding, request.path, e)
+        return response
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+@app.context_processor
+def _inject_assets():
+    # Sprite d'icônes : référencé des dizaines de fois par page.
+    return {"icons_svg": url_for("static", filename="img/icons.svg")}
+
+
 @app.context_processor
 def _inject_user():
     # is_premium : exposé à tous les templates pour gater des features (Coach
@@ -142,7 +270,12 @@ def _inject_user():
     uid = session.get("user_id")
     if uid:
         try:
-            profile = core_db.get_profile(uid) or {}
+            # Mémoïsé par requête (core.data) quand la route est protégée ;
+            # pages publiques : lecture directe.
+            if getattr(g, "user_id", None) == uid:
+                profile = core_data.get_profile() or {}
+            else:
+                profile = core_db.get_profile(uid) or {}
             premium = (profile.get("tier") or "free").strip().lower() == "vip"
         except Exception:
             premium = False
@@ -184,8 +317,12 @@ def manifest():
 
 @app.route("/service-worker.js")
 def service_worker():
-    response = send_from_directory("static", "service-worker.js", mimetype="application/javascript")
+    # Version des assets + URLs versionnées du shell injectées à la volée.
+    with open(os.path.join(app.static_folder, "service-worker.js"), encoding="utf-8") as f:
+        source = assets.service_worker(f.read())
+    response = app.response_class(source, mimetype="application/javascript")
     response.headers["Service-Worker-Allowed"] = "/"
+    response.headers["Cache-Control"] = "no-cache"
     return response
 
 
@@ -0,0 +1,479 @@
+"""Micro-benchmarks des chemins chauds (hors requête HTTP, sans Supabase).
+
+Usage :
+    cd pwa
+    python bench.py muscles [--n 50000]
+    python bench.py exercises [--n 50000]
+    python bench.py days [--sizes 1000,10000,50000] [--days 28]
+    python bench.py backup [--rows 20000] [--page 1000]
+    python bench.py replace --user <uuid> [--rows 50000]
+
+Chaque sous-commande compare l'implémentation actuelle à l'ancienne
+(reproduite ici) sur des données synthétiques déterministes, vérifie que
+les résultats sont identiques, puis affiche le débit.
+
+Exception : `replace` mesure la réécriture complète de l'historique
+(`_save_hist_legacy` contre la RPC `replace_history`) sur un vrai projet
+Supabase — SUPABASE_URL / SUPABASE_SERVICE_ROLE_KEY d'un projet de test,
+migration v28 appliquée, et un compte de test à l'historique vide (il est
+vidé à la fin).
+"""
+import argparse
+import random
+import sys
+import time
+
+
+def _timed(fn, items):
+    t0 = time.perf_counter()
+    out = [fn(x) for x in items]
+    return out, time.perf_counter() - t0
+
+
+def _report(label, n, seconds):
+    print(f"  {label:<28} {seconds * 1000:9.1f} ms   {n / seconds:12,.0f} /s")
+
+
+# ── auto_muscles ────────────────────────────────────────────────────────
+def _synthetic_exercise_names(n, seed=42):
+    """Noms réalistes : catalogue + variantes + mots-clés combinés + bruit."""
+    from core.exercises_data import EXERCISES_INFO
+    from core.muscu import _MUSCLE_RULES
+
+    rng = random.Random(seed)
+    catalog = list(EXERCISES_INFO)
+    keywords = [kw for kws, _ in _MUSCLE_RULES for kw in kws]
+    variants = ["", " (Barre)", " (Haltères)", " (Poulie)", " (Machine)", " (Lesté)"]
+    noise = ["unilatéral", "lent", "tempo 3-1-1", "prise large", "xyz", "pause"]
+    names = []
+    for _ in range(n):
+        r = rng.random()
+        if r < 0.5:
+            name = rng.choice(catalog) + rng.choice(variants)
+        elif r < 0.8:
+            name = " ".join(rng.sample(keywords, rng.randint(1, 3))).capitalize()
+        else:
+            name = f"{rng.choice(noise)} {rng.choice(noise)}"
+        names.append(name)
+    return names
+
+
+def _legacy_auto_muscles(name):
+    """Version d'origine : `any(kw in n)` groupe par groupe."""
+    from core.muscu import _MUSCLE_RULES
+
+    n = name.lower()
+    muscles = set()
+    for keywords, ms in _MUSCLE_RULES:
+        if any(kw in n for kw in keywords):
+            muscles.update(ms)
+    return ",".join(sorted(muscles)) if muscles else None
+
+
+def bench_muscles(args):
+    from core.muscu import auto_muscles
+
+    names = _synthetic_exercise_names(args.n)
+    print(f"auto_muscles — {len(names):,} noms ({len(set(names)):,} distincts)")
+    legacy, t_legacy = _timed(_legacy_auto_muscles, names)
+    compiled, t_compiled = _timed(auto_muscles.__wrapped__, names)
+    auto_muscles.cache_clear()
+    _, t_cold = _timed(auto_muscles, names)
+    _, t_warm = _timed(auto_muscles, names)
+    if legacy != compiled:
+        diffs = sum(1 for a, b in zip(legacy, compiled) if a != b)
+        print(f"  ÉCART : {diffs} résultats différents")
+        return 1
+    _report("mots-clés (ancien)", len(names), t_legacy)
+    _report("regex compilée", len(names), t_compiled)
+    _report("regex + LRU (froid)", len(names), t_cold)
+    _report("regex + LRU (chaud)", len(names), t_warm)
+    print(f"  gain regex seule : x{t_legacy / t_compiled:.1f}")
+    return 0
+
+
+# ── get_exercise_info ───────────────────────────────────────────────────
+def _legacy_exercise_info(name):
+    """Version d'origine : parcours linéaire du catalogue pour le préfixe."""
+    import re
+    from core.exercises_data import EXERCISES_INFO
+
+    if not name:
+        return None
+    if name in EXERCISES_INFO:
+        return EXERCISES_INFO[name]
+    clean = re.sub(r"\s*\(.*?\)", "", name).strip()
+    if clean in EXERCISES_INFO:
+        return EXERCISES_INFO[clean]
+    for suffix in ("haltères", "haltère", "barre", "poulie", "machine",
+                   "élastique", "élastiques", "sol"):
+        if clean.endswith(" " + suffix):
+            base = clean[: -(len(suffix) + 1)].strip()
+            if base in EXERCISES_INFO:
+                return EXERCISES_INFO[base]
+    name_lower = name.lower()
+    best_key = None
+    best_len = 0
+    for key in EXERCISES_INFO:
+        if name_lower.startswith(key.lower()) and len(key) > best_len:
+            best_key = key
+            best_len = len(key)
+    if best_key:
+        return EXERCISES_INFO[best_key]
+    return None
+
+
+def _catalog_exercise_names():
+    """Noms d'exos des programmes prédéfinis (core.catalog)."""
+    from core.catalog import CATALOG
+
+    names = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            if "name" in node and "sets" in node:
+                names.append(node["name"])
+            for v in node.values():
+                walk(v)
+        elif isinstance(node, list):
+            for v in node:
+                walk(v)
+
+    walk(CATALOG)
+    return sorted(set(names))
+
+
+def _exercise_lookup_names(catalog, rng):
+    """Chaque fiche et chaque exo des programmes, avec leurs dérivés (casse,
+    variantes, suffixes d'équipement, compléments libres, troncatures)."""
+    out = []
+    for key in catalog + _catalog_exercise_names():
+        out += [key, key.upper(), key.lower(), key + " (Barre)", key + " haltères",
+                key + " lent", key[: max(1, len(key) - 3)], f"{key} ({rng.choice(catalog)})"]
+    return out
+
+
+def bench_exercises(args):
+    from core.exercises_data import EXERCISES_INFO, get_exercise_info
+
+    rng = random.Random(7)
+    catalog = list(EXERCISES_INFO)
+    regression = _exercise_lookup_names(catalog, rng)
+    diffs = [n for n in regression if _legacy_exercise_info(n) is not get_exercise_info.__wrapped__(n)]
+    print(f"get_exercise_info — régression sur {len(regression):,} noms "
+          f"({len(catalog)} fiches) : {len(diffs)} écart(s)")
+    for n in diffs[:10]:
+        print(f"  ÉCART : {n!r}")
+    if diffs:
+        return 1
+
+    names = [rng.choice(regression) for _ in range(args.n)]
+    _, t_legacy = _timed(_legacy_exercise_info, names)
+    _, t_trie = _timed(get_exercise_info.__wrapped__, names)
+    get_exercise_info.cache_clear()
+    _, t_cold = _timed(get_exercise_info, names)
+    _, t_warm = _timed(get_exercise_info, names)
+    print(f"  {len(names):,} appels")
+    _report("parcours linéaire (ancien)", len(names), t_legacy)
+    _report("trie", len(names), t_trie)
+    _report("trie + LRU (froid)", len(names), t_cold)
+    _report("trie + LRU (chaud)", len(names), t_warm)
+    return 0
+
+
+# ── statut des journées (/accueil) ──────────────────────────────────────
+def _synthetic_history(n, today, seed=3):
+    """`n` séries réparties sur des semaines passées, 3 séances/semaine."""
+    from datetime import timedelta
+    from core.history import HistRow, HistSnapshot
+
+    rng = random.Random(seed)
+    seances = ["Push", "Pull", "Legs"]
+    exos = ["Développé couché", "Rowing barre", "Squat", "Curl", "CARDIO:Course"]
+    rows = []
+    day = 0
+    while len(rows) < n:
+        d = today - timedelta(days=day)
+        week = 1000 - day // 7
+        if d.weekday() in (0, 2, 4):
+            seance = seances[d.weekday() // 2]
+            for exo in rng.sample(exos, 3):
+                for serie in range(1, 5):
+                    rows.append(HistRow({
+                        "Semaine": week, "Séance": seance, "Exercice": exo, "Série": serie,
+                        "Reps": rng.randint(0, 12), "Poids": 0.0 if exo.startswith("CARDIO:") else 60.0,
+                        "Remarque": "", "Muscle": "", "Date": d.strftime("%Y-%m-%d"),
+                    }))
+        day += 1
+    rows = rows[:n]
+    return HistSnapshot(rows, range(1, len(rows) + 1))
+
+
+def _legacy_day_status(day_date, hist_rows, planning_map, today):
+    """Version d'origine : parcours complet de l'historique par journée."""
+    from datetime import timedelta
+    from routes.accueil import DAYS_FR, MAKEUP_WINDOW_DAYS, _is_cardio_row, _is_real_perf
+
+    d_str = day_date.strftime("%Y-%m-%d")
+    day_rows = [r for r in hist_rows if r.get("Date") == d_str]
+    day_name_fr = DAYS_FR[day_date.weekday()]
+    planned_seance = planning_map.get(day_name_fr, "")
+    real = [r for r in day_rows if _is_real_perf(r)]
+    if real:
+        non_cardio = [r for r in real if not _is_cardio_row(r)]
+        counts = {}
+        for r in non_cardio or real:
+            counts.setdefault(r["Séance"], set()).add(r["Exercice"])
+        return "done"
+    if day_name_fr in planning_map and not planned_seance:
+        return "rest"
+    if any(r["Exercice"] == "SESSION" and "MANQUÉE" in (r.get("Remarque") or "") for r in day_rows):
+        return "missed"
+    if day_date < today and planned_seance:
+        for off in range(1, MAKEUP_WINDOW_DAYS + 1):
+            d2 = day_date + timedelta(days=off)
+            if d2 > today:
+                break
+            if planning_map.get(DAYS_FR[d2.weekday()]) == planned_seance:
+                continue
+            d2_iso = d2.strftime("%Y-%m-%d")
+            if any(r.get("Date") == d2_iso and _is_real_perf(r)
+                   and r.get("Séance") == planned_seance for r in hist_rows):
+                return "done"
+    if day_date < today:
+        return "missed"
+    return "today" if day_date == today else "upcoming"
+
+
+def bench_days(args):
+    from datetime import date, timedelta
+    from routes.accueil import _day_status, _DayBuckets
+
+    today = date(2026, 1, 14)
+    planning_map = {"Lundi": "Push", "Mardi": "", "Mercredi": "Pull", "Jeudi": "",
+                    "Vendredi": "Legs", "Samedi": "", "Dimanche": ""}
+    dates = [today - timedelta(days=i) for i in range(args.days)]
+    print(f"statut des journées — {args.days} jours par rendu")
+    for n in (int(x) for x in args.sizes.split(",")):
+        hist = _synthetic_history(n, today)
+        legacy, t_legacy = _timed(lambda d: _legacy_day_status(d, hist, planning_map, today), dates)
+        t0 = time.perf_counter()
+        days = _DayBuckets(hist)  # inclut la construction de l'index
+        t_build = time.perf_counter() - t0
+        bucketed, t_cold = _timed(lambda d: _day_status(d, days, planning_map, today)["status"], dates)
+        # Rendu suivant sur le même snapshot : buckets déjà mémorisés sur l'index.
+        _, t_warm = _timed(lambda d: _day_status(d, _DayBuckets(hist), planning_map, today)["status"],
+                           dates)
+        if legacy != bucketed:
+            diffs = sum(1 for a, b in zip(legacy, bucketed) if a != b)
+            print(f"  ÉCART : {diffs} statuts différents pour {n:,} séries")
+            return 1
+        per_day = lambda t: t / len(dates) * 1e6
+        print(f"  {n:>7,} séries   ancien {per_day(t_legacy):9.1f} µs/jour   "
+              f"index {t_build * 1000:7.1f} ms (une fois)   "
+              f"buckets froid {per_day(t_cold):6.1f} µs/jour   chaud {per_day(t_warm):6.1f} µs/jour")
+    return 0
+
+
+# ── sauvegarde : aller-retour export → import ───────────────────────────
+def _tricky_backup(n, page_size, seed=11):
+    """Méta + lignes d'historique piégeuses : unicode, guillemets, retours
+    à la ligne, None, types mêlés côté méta ; côté séries, les types de
+    core.db._row_from_supabase avec poids extrêmes et dates non ISO."""
+    rng = random.Random(seed)
+    meta = {
+        "version": 1, "exported_at": "2026-01-14",
+        "programme": {
+            "Push": [{"name": "Développé couché", "sets": 4, "reps": "8-10", "rest": None}],
+            "_settings": {"auto_collapse": True, "show_previous_weeks": 2, "theme": "🌙"},
+            "_badges": ["first_session"], "_ratio": 0.1 + 0.2, "vide": {}, "liste": [],
+            "texte": "ligne 1\nligne 2 \"citée\" \\ 日本語",
+        },
+        "profil": {"pseudo": "Zoé", "tier": "free", "poids": 72.5, "taille": None, "age": 31},
+        "onboarding": {},
+    }
+    names = ["Développé couché", "Squat", "CARDIO:Course", "SESSION", "日本 \"q\" \\ \n", ""]
+    pages, page = [], []
+    for i in range(n):
+        page.append({
+            "Semaine": rng.choice([1, 2, 3, 7, 50, 1000 - i // 500]),
+            "Séance": rng.choice(["Push", "Pull", "", "Jambes ✓"]),
+            "Exercice": rng.choice(names + [f"ex_{i // 900}"]),
+            "Série": 1 + i % 6, "Reps": rng.randint(0, 20),
+            "Poids": rng.choice([0.0, 80.0, 82.5, 1e-7, 123456.789, -5.25, 0.1 + 0.2, 1e20]),
+            "Remarque": rng.choice(["", "SKIP", "MANQUÉE", f"note {i % 3}"]),
+            "Muscle": rng.choice(["", "Pecs", "Dos,Biceps"]),
+            "Date": rng.choice(["2025-01-01", "2024-12-31", "", "1999-02-28", "2025-1-5",
+                                "20250105", "0001-01-01", "9999-12-31"]),
+        })
+        if len(page) == page_size:
+            pages.append(page)
+            page = []
+    if page:
+        pages.append(page)
+    return meta, pages
+
+
+def _same(a, b):
+    """Égalité stricte : mêmes types (80 ≠ 80.0), même ordre des clés."""
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return list(a) == list(b) and all(_same(a[k], b[k]) for k in a)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def _split(data, rng):
+    """Morceaux de taille aléatoire : coupe les séquences UTF-8 et les
+    jetons JSON à cheval sur deux morceaux."""
+    i = 0
+    while i < len(data):
+        j = i + rng.randint(1, 997)
+        yield data[i:j]
+        i = j
+
+
+def _read_back(chunks):
+    from core import backup
+
+    meta, rows = {}, []
+    for event in backup.read(chunks):
+        if event[0] == "meta":
+            meta[event[1]] = event[2]
+        elif event[0] == "row":
+            rows.append(event[1])
+    meta.pop("format", None)
+    return meta, rows
+
+
+def bench_backup(args):
+    import gzip
+    import io
+    import json
+    from core import backup
+
+    meta, pages = _tricky_backup(args.rows, args.page)
+    rows = [r for page in pages for r in page]
+    # Document de l'export d'origine : un seul json.dumps, historique après le programme.
+    legacy = {k: meta[k] for k in ("version", "exported_at", "programme")}
+    legacy["historique"] = rows
+    legacy.update((k, meta[k]) for k in ("profil", "onboarding"))
+    legacy_doc = json.dumps(legacy, ensure_ascii=False, indent=2).encode()
+    print(f"sauvegarde — {len(rows):,} séries en pages de {args.page}, aller-retour par format")
+
+    status = 0
+    rng = random.Random(5)
+    for fmt in backup.FORMATS:
+        for gz in ((True,) if fmt == "compact" else (False, True)):
+            label = fmt + (" + gzip" if gz and fmt != "compact" else "")
+            t0 = time.perf_counter()
+            chunks = backup.stream(meta, iter(pages), fmt)
+            if gz and fmt != "compact":
+                chunks = backup.gzip_chunks(chunks)
+            data = b"".join(chunks)
+            t_export = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            got = _read_back(backup.file_chunks(io.BytesIO(data)))
+            t_import = time.perf_counter() - t0
+            plain = gzip.decompress(data) if gz else data
+            checks = {
+                "import": got,
+                "morceaux courts": _read_back(_split(plain, rng)),
+            }
+            if fmt == "json":
+                checks["document d'origine"] = (meta, rows) if plain == legacy_doc else None
+            for what, (got_meta, got_rows) in ((k, v or ({}, [])) for k, v in checks.items()):
+                if not (_same(got_meta, meta) and _same(got_rows, rows)):
+                    print(f"  ÉCART : {label}, {what}")
+                    status = 1
+            print(f"  {label:<16} {len(data) / 1e6:7.2f} Mo   export {t_export * 1000:7.1f} ms"
+                  f"   import {t_import * 1000:7.1f} ms")
+    return status
+
+
+# ── réécriture complète de l'historique (save_hist) ─────────────────────
+def _synthetic_sheet_rows(n, seed):
+    """Lignes au format Sheet (celui de save_hist), texte accentué, poids
+    décimaux, quelques dates absentes."""
+    rng = random.Random(seed)
+    return [{
+        "Semaine": 1 + i // 300, "Séance": rng.choice(["Push", "Pull", "Legs"]),
+        "Exercice": rng.choice(["Squat", "Développé couché", "Tractions", "CARDIO:Course"]),
+        "Série": 1 + i % 4, "Reps": rng.randint(0, 12), "Poids": rng.choice([0.0, 42.5, 80.0, 102.25]),
+        "Remarque": rng.choice(["", "RAS", "dur ✓"]), "Muscle": rng.choice(["", "Pecs", "Dos"]),
+        "Date": f"2025-{1 + (i // 3000) % 12:02d}-{1 + (i // 100) % 28:02d}" if i % 50 else "",
+    } for i in range(n)]
+
+
+def _stored_history(user_id):
+    """Historique relu en base (ordre d'id), colonnes comparables."""
+    from core import db
+
+    fields = ("Semaine", "Séance", "Exercice", "Série", "Reps", "Poids", "Remarque", "Muscle", "Date")
+    return [tuple(r.get(f) for f in fields) for page in db.iter_hist(user_id) for r in page]
+
+
+def bench_replace(args):
+    from core import db
+
+    uid = args.user
+    if _stored_history(uid):
+        print(f"  refusé : l'historique de {uid} n'est pas vide (compte de test requis)")
+        return 1
+    initial = [db._row_to_supabase(uid, r) for r in _synthetic_sheet_rows(args.rows, 1)]
+    new = [db._row_to_supabase(uid, r) for r in _synthetic_sheet_rows(args.rows, 2)]
+    rpc_rows = [{k: v for k, v in row.items() if k != "user_id"} for row in new]
+
+    def rpc():
+        db.get_client().rpc("replace_history", {"p_user_id": uid, "p_rows": rpc_rows}).execute()
+
+    print(f"save_hist — {args.rows:,} séries remplacées par {args.rows:,}")
+    status = 0
+    try:
+        db._save_hist_legacy(uid, new)
+        expected = _stored_history(uid)
+        for label, fn in (("paquets de 500 (ancien)", lambda: db._save_hist_legacy(uid, new)),
+                          ("RPC replace_history", rpc)):
+            db._save_hist_legacy(uid, initial)
+            t0 = time.perf_counter()
+            fn()
+            seconds = time.perf_counter() - t0
+            if _stored_history(uid) != expected:
+                print(f"  ÉCART : {label} n'écrit pas le même historique")
+                status = 1
+                continue
+            _report(label, args.rows, seconds)
+    finally:
+        db.get_client().table("history").delete().eq("user_id", uid).execute()
+    return status
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("muscles", help="core.muscu.auto_muscles")
+    p.add_argument("--n", type=int, default=50_000)
+    p.set_defaults(func=bench_muscles)
+    p = sub.add_parser("exercises", help="core.exercises_data.get_exercise_info")
+    p.add_argument("--n", type=int, default=50_000)
+    p.set_defaults(func=bench_exercises)
+    p = sub.add_parser("days", help="routes.accueil._day_status")
+    p.add_argument("--sizes", default="1000,10000,50000")
+    p.add_argument("--days", type=int, default=28)
+    p.set_defaults(func=bench_days)
+    p = sub.add_parser("backup", help="core.backup (export → import, tous formats)")
+    p.add_argument("--rows", type=int, default=20_000)
+    p.add_argument("--page", type=int, default=1000)
+    p.set_defaults(func=bench_backup)
+    p = sub.add_parser("replace", help="core.db.save_hist (ancien chemin / RPC v28)")
+    p.add_argument("--user", required=True, help="user_id d'un compte de test à l'historique vide")
+    p.add_argument("--rows", type=int, default=50_000)
+    p.set_defaults(func=bench_replace)
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""Empreintes et variantes compressées des fichiers de `static/`.
+
+Sans étape de build : au démarrage on lit chaque fichier de `static/` une
+fois pour en tirer une empreinte de contenu. `url_for('static', ...)`
+ajoute `?v=<empreinte>` (cf. `app._static_version`) ; une URL versionnée
+ne change jamais de contenu et part avec `Cache-Control: immutable`. Le
+cache-busting ne dépend donc plus d'un `CACHE_VERSION` bumpé à la main.
+
+Compression :
+  - fichiers statiques texte (CSS/JS/SVG/JSON) : gzip 9 / brotli 11,
+    calculés une fois au premier appel puis gardés en mémoire (quelques
+    centaines de Ko au total) ;
+  - réponses dynamiques (HTML, JSON) : gzip 6 / brotli 5 à la volée.
+brotli est optionnel : sans le paquet, seul gzip est proposé.
+"""
+import gzip
+import hashlib
+import logging
+import os
+import re
+
+try:
+    import brotli  # type: ignore
+except ImportError:  # dépendance optionnelle
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Types qui gagnent à être compressés (les PNG le sont déjà).
+COMPRESSIBLE_TYPES = {
+    "text/html", "text/css", "text/javascript", "text/plain",
+    "application/javascript", "application/json", "application/manifest+json",
+    "image/svg+xml",
+}
+COMPRESSIBLE_EXTS = {".css", ".js", ".svg", ".json", ".html", ".txt"}
+MIN_SIZE = 512  # en dessous, l'en-tête gzip mange le gain
+
+# Fichiers servis à URL fixe (scope du SW, manifest PWA) : jamais immuables.
+_UNVERSIONED = {"service-worker.js", "manifest.json"}
+
+_SW_ASSETS_VERSION = re.compile(r'const ASSETS_VERSION = "[^"]*";')
+_SW_STATIC_URL = re.compile(r'"/static/([^"?#]+)"')
+
+
+def encodings():
+    """Encodages proposés, par ordre de préférence."""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def compress(data: bytes, encoding: str, static: bool = False) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=11 if static else 5)
+    return gzip.compress(data, compresslevel=9 if static else 6, mtime=0)
+
+
+def negotiate(accept_encodings) -> str | None:
+    """Meilleur encodage accepté par le client (`request.accept_encodings`)."""
+    for enc in encodings():
+        if accept_encodings[enc] > 0:
+            return enc
+    return None
+
+
+class StaticAssets:
+    """Manifeste des fichiers de `static/` : empreinte + variantes compressées."""
+
+    def __init__(self, root):
+        self.root = root
+        self.hashes = {}
+        self._variants = {}
+        for dirpath, _dirs, files in os.walk(root):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                rel = os.path.relpath(path, root).replace(os.sep, "/")
+                try:
+                    with open(path, "rb") as f:
+                        self.hashes[rel] = hashlib.sha256(f.read()).hexdigest()[:12]
+                except OSError as e:
+                    logger.error("asset illisible %s: %s", rel, e)
+        listing = "\n".join(f"{k}:{v}" for k, v in sorted(self.hashes.items()))
+        self.digest = hashlib.sha256(listing.encode("utf-8")).hexdigest()[:12]
+        logger.info("assets: %d fichiers, digest=%s", len(self.hashes), self.digest)
+
+    def version(self, filename) -> str | None:
+        """Empreinte à mettre dans l'URL, None si le fichier n'est pas versionné."""
+        if filename in _UNVERSIONED:
+            return None
+        return self.hashes.get(filename)
+
+    def compressed(self, filename, encoding) -> bytes | None:
+        """Variante compressée d'un fichier statique (None si sans intérêt)."""
+        if filename not in self.hashes or os.path.splitext(filename)[1] not in COMPRESSIBLE_EXTS:
+            return None
+        key = (filename, encoding)
+        try:
+            return self._variants[key]
+        except KeyError:
+            pass
+        try:
+            with open(os.path.join(self.root, filename), "rb") as f:
+                data = f.read()
+        except OSError as e:
+            logger.error("asset illisible %s: %s", filename, e)
+            return None
+        out = compress(data, encoding, static=True) if len(data) >= MIN_SIZE else None
+        if out is not None and len(out) >= len(data):
+            out = None
+        self._variants[key] = out  # calcul idempotent : pas besoin de verrou
+        return out
+
+    def service_worker(self, source: str) -> str:
+        """Source du SW avec la version des assets et les URLs du shell versionnées.
+
+        Le SW change dès qu'un asset change → le navigateur installe la
+        nouvelle version et purge l'ancien cache, sans bump manuel."""
+        source = _SW_ASSETS_VERSION.sub(f'const ASSETS_VERSION = "{self.digest}";', source, count=1)
+
+        def versioned(m):
+            v = self.version(m.group(1))
+            return f'"/static/{m.group(1)}?v={v}"' if v else m.group(0)
+
+        return _SW_STATIC_URL.sub(versioned, source)
@@ -0,0 +1,400 @@
+"""Sauvegarde complète (export / import de /gestion) en flux.
+
+L'export construisait un seul `json.dumps(payload, indent=2)` : historique
+complet en liste + la chaîne JSON entière en mémoire, soit plusieurs copies
+de l'historique à la fois pour les gros comptes. Ici le document est écrit
+morceau par morceau : l'historique est lu par pages (keyset sur `id`, cf.
+`core.db.iter_hist`) et chaque page est sérialisée puis relâchée — la
+mémoire reste bornée par la taille d'une page, quelle que soit la longueur
+de l'historique.
+
+Formats :
+  - `json`   : même document qu'avant (mêmes clés, même ordre, indent=2),
+               octet pour octet ;
+  - `ndjson` : une ligne d'en-tête (`{"version", "format", "exported_at",
+               "programme", "profil", "onboarding"}`) puis une ligne par
+               série de l'historique.
+  - `compact`: colonnes plutôt que lignes, toujours gzippé (niveau 9) —
+               une ligne d'en-tête comme le NDJSON puis un bloc par page
+               d'historique (`_encode_block`). Chaînes (séance, exercice,
+               muscle, remarque) en dictionnaire partagé entre blocs,
+               semaines et dates en deltas, poids entiers sans « .0 ».
+               Sans perte : relu, il redonne exactement les lignes du JSON.
+`json` et `ndjson` peuvent être gzippés (`gzip_chunks`, flux zlib
+incrémental).
+
+Import : `read` parcourt un fichier (JSON, NDJSON, gzippé ou non) au fil
+de l'eau et émet des événements — clés de premier niveau, début de
+l'historique, puis une série à la fois. Seule la valeur en cours de
+décodage est en mémoire.
+"""
+import codecs
+import json
+import re
+import zlib
+from datetime import date
+
+FORMATS = ("json", "ndjson", "compact")
+EXPORT_VERSION = 1
+
+_FLUSH = 64 * 1024  # taille visée des morceaux envoyés au client
+_MAX_VALUE = 8 * 1024 * 1024  # plus grosse valeur isolée acceptée à l'import
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+class BackupFormatError(ValueError):
+    """Fichier de sauvegarde illisible (pas du JSON, structure inattendue)."""
+
+
+def _dumps(value, indent=None) -> str:
+    return json.dumps(value, ensure_ascii=False, indent=indent)
+
+
+def _indented(value, level: int) -> str:
+    """`json.dumps(indent=2)` d'une valeur imbriquée à `level` niveaux."""
+    return _dumps(value, 2).replace("\n", "\n" + "  " * level)
+
+
+def _buffered(parts):
+    """Regroupe les petits fragments en morceaux d'environ _FLUSH octets."""
+    buf, size = [], 0
+    for part in parts:
+        data = part.encode("utf-8")
+        buf.append(data)
+        size += len(data)
+        if size >= _FLUSH:
+            yield b"".join(buf)
+            buf, size = [], 0
+    if buf:
+        yield b"".join(buf)
+
+
+def _json_parts(meta: dict, pages):
+    yield "{"
+    first = True
+    for key, value in meta.items():
+        if key == "historique":
+            continue
+        yield ("\n" if first else ",\n") + f"  {_dumps(key)}: {_indented(value, 1)}"
+        first = False
+        if key == "programme":
+            # L'historique suit le programme, comme dans l'export d'origine.
+            yield from _json_hist_parts(pages, first)
+    yield "\n}"
+
+
+def _json_hist_parts(pages, first: bool):
+    yield ("\n" if first else ",\n") + '  "historique": '
+    empty = True
+    for page in pages:
+        for r in page:
+            yield ("[\n    " if empty else ",\n    ") + _indented(r, 2)
+            empty = False
+    yield "[]" if empty else "\n  ]"
+
+
+def _ndjson_parts(meta: dict, pages):
+    header = {"version": meta["version"], "format": "ndjson"}
+    header.update((k, v) for k, v in meta.items() if k not in header)
+    yield _dumps(header) + "\n"
+    for page in pages:
+        yield "".join(_dumps(r) + "\n" for r in page)
+
+
+# Colonnes en dictionnaire : (clé courte, champ). Chaque bloc déclare dans
+# `add` les valeurs nouvelles, ajoutées au dictionnaire dans l'ordre.
+_DICT_COLUMNS = (("s", "Séance"), ("e", "Exercice"), ("m", "Muscle"), ("r", "Remarque"))
+
+
+def _deltas(values) -> list:
+    out, prev = [], 0
+    for v in values:
+        out.append(v - prev)
+        prev = v
+    return out
+
+
+def _undeltas(values) -> list:
+    out, prev = [], 0
+    for v in values:
+        prev += v
+        out.append(prev)
+    return out
+
+
+def _encode_dates(values) -> list:
+    """Dates ISO en écarts de jours avec la précédente (la 1re en ordinal) ;
+    "" → null ; toute autre chaîne telle quelle (sans toucher à l'ancre)."""
+    out, prev = [], 0
+    for d in values:
+        if not d:
+            out.append(None)
+            continue
+        try:
+            day = date.fromisoformat(d)
+        except ValueError:
+            day = None
+        if day is None or day.isoformat() != d:
+            out.append(d)
+            continue
+        out.append(day.toordinal() - prev)
+        prev = day.toordinal()
+    return out
+
+
+def _decode_dates(values) -> list:
+    out, prev = [], 0
+    for v in values:
+        if v is None:
+            out.append("")
+        elif isinstance(v, str):
+            out.append(v)
+        else:
+            prev += v
+            out.append(date.fromordinal(prev).isoformat())
+    return out
+
+
+def _encode_block(rows, dicts: dict) -> dict:
+    """Bloc colonne d'une page de lignes. `dicts` : état partagé entre les
+    blocs d'un même fichier (colonne → {valeur: index})."""
+    block = {"n": len(rows)}
+    added = {}
+    for col, field in _DICT_COLUMNS:
+        index = dicts.setdefault(col, {})
+        out = []
+        for r in rows:
+            value = r[field]
+            i = index.get(value)
+            if i is None:
+                i = index[value] = len(index)
+                added.setdefault(col, []).append(value)
+            out.append(i)
+        block[col] = out
+    if added:
+        block["add"] = added
+    block["w"] = _deltas([r["Semaine"] for r in rows])
+    block["k"] = [r["Série"] for r in rows]
+    block["x"] = [r["Reps"] for r in rows]
+    block["p"] = [int(r["Poids"]) if float(r["Poids"]).is_integer() else r["Poids"] for r in rows]
+    block["d"] = _encode_dates([r["Date"] for r in rows])
+    return block
+
+
+def _decode_block(block, dicts: dict) -> list:
+    """Lignes (clés Semaine/Séance/…) d'un bloc `_encode_block`."""
+    try:
+        n = block["n"]
+        for col, values in (block.get("add") or {}).items():
+            dicts[col].extend(values)
+        columns = {field: [dicts[col][i] for i in block[col]] for col, field in _DICT_COLUMNS}
+        columns["Semaine"] = _undeltas(block["w"])
+        columns["Série"] = block["k"]
+        columns["Reps"] = block["x"]
+        columns["Poids"] = [float(p) for p in block["p"]]
+        columns["Date"] = _decode_dates(block["d"])
+        if any(len(values) != n for values in columns.values()):
+            raise ValueError("colonnes de longueurs différentes")
+    except (KeyError, IndexError, TypeError, ValueError, AttributeError, OverflowError):
+        raise BackupFormatError("bloc compact invalide") from None
+    return [
+        {"Semaine": columns["Semaine"][i], "Séance": columns["Séance"][i],
+         "Exercice": columns["Exercice"][i], "Série": columns["Série"][i],
+         "Reps": columns["Reps"][i], "Poids": columns["Poids"][i],
+         "Remarque": columns["Remarque"][i], "Muscle": columns["Muscle"][i],
+         "Date": columns["Date"][i]}
+        for i in range(n)
+    ]
+
+
+def _compact_parts(meta: dict, pages):
+    header = {"version": meta["version"], "format": "compact"}
+    header.update((k, v) for k, v in meta.items() if k not in header)
+    yield _dumps(header) + "\n"
+    dicts = {}
+    for page in pages:
+        if page:
+            yield json.dumps(_encode_block(page, dicts), ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def stream(meta: dict, pages, fmt: str = "json"):
+    """Morceaux (bytes) du document d'export.
+
+    `meta` : clés de premier niveau dans l'ordre du document (version,
+    exported_at, programme, profil, onboarding) ; `pages` : itérable de
+    listes de lignes d'historique (clés Semaine/Séance/…), consommé une
+    seule fois au fil de l'écriture."""
+    if fmt == "compact":
+        return gzip_chunks(_buffered(_compact_parts(meta, pages)), level=9)
+    parts = _ndjson_parts(meta, pages) if fmt == "ndjson" else _json_parts(meta, pages)
+    return _buffered(parts)
+
+
+def gzip_chunks(chunks, level: int = 6):
+    """Compression gzip incrémentale d'un flux de bytes."""
+    z = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31 = en-tête gzip
+    for chunk in chunks:
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
+
+
+# ────────────────────────────────────────────────────────────
+# Import
+# ────────────────────────────────────────────────────────────
+
+def file_chunks(stream, hasher=None):
+    """Morceaux (bytes) d'un fichier uploadé, décompressés s'il est gzippé.
+    `hasher` (hashlib) reçoit les octets bruts, avant décompression."""
+    def raw():
+        while True:
+            chunk = stream.read(_FLUSH)
+            if not chunk:
+                return
+            if hasher is not None:
+                hasher.update(chunk)
+            yield chunk
+
+    chunks = raw()
+    first = next(chunks, b"")
+    if not first.startswith(_GZIP_MAGIC):
+        if first:
+            yield first
+        yield from chunks
+        return
+    z = zlib.decompressobj(31)
+    for chunk in _chain(first, chunks):
+        data = chunk
+        while data and not z.eof:
+            out = z.decompress(data, _FLUSH)  # borné : pas de bombe en mémoire
+            if out:
+                yield out
+            data = z.unconsumed_tail
+    if not z.eof:
+        raise BackupFormatError("fichier gzip tronqué")
+
+
+def _chain(first, rest):
+    yield first
+    yield from rest
+
+
+_WS = re.compile(r"[ \t\n\r]*")
+_DECODER = json.JSONDecoder()
+
+
+class _Reader:
+    """Tampon texte au-dessus d'un flux de bytes UTF-8, pour décoder des
+    valeurs JSON une à une (`raw_decode`) sans tout charger."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder("utf-8-sig")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = next(self._chunks, None)
+        try:
+            text = self._utf8.decode(chunk or b"", final=chunk is None)
+        except UnicodeDecodeError:
+            raise BackupFormatError("fichier non UTF-8") from None
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+        self.eof = chunk is None
+        return True
+
+    def peek(self) -> str:
+        """Prochain caractère non blanc ("" en fin de fichier)."""
+        while True:
+            self.pos = _WS.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def take(self, expected: str):
+        if self.peek() != expected:
+            raise BackupFormatError(f"« {expected} » attendu")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buf, self.pos)
+                # Une valeur qui finit pile au bout du tampon (nombre…) peut
+                # continuer dans le morceau suivant : on ne conclut qu'après.
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise BackupFormatError(f"JSON invalide ({e.msg})") from None
+            if len(self.buf) - self.pos > _MAX_VALUE:
+                raise BackupFormatError("valeur trop volumineuse")
+            self._fill()
+
+
+def read(chunks):
+    """Événements d'un fichier de sauvegarde, au fil de la lecture :
+      - ("meta", clé, valeur) : clé de premier niveau (programme, profil…) ;
+      - ("hist",)             : début de l'historique ;
+      - ("row", ligne)        : une série de l'historique (non validée).
+    Accepte le JSON de l'export (`historique` à n'importe quelle position),
+    le NDJSON (en-tête `format: ndjson` puis une série par ligne) et le
+    format compact (en-tête `format: compact` puis un bloc par ligne).
+    Lève BackupFormatError si la structure est inattendue."""
+    rd = _Reader(chunks)
+    rd.take("{")
+    meta = {}
+    if rd.peek() == "}":
+        rd.pos += 1
+    else:
+        while True:
+            key = rd.value()
+            if not isinstance(key, str):
+                raise BackupFormatError("clé attendue")
+            rd.take(":")
+            if key == "historique" and rd.peek() == "[":
+                rd.pos += 1
+                yield ("hist",)
+                if rd.peek() == "]":
+                    rd.pos += 1
+                else:
+                    while True:
+                        yield ("row", rd.value())
+                        sep = rd.peek()
+                        rd.pos += 1
+                        if sep == "]":
+                            break
+                        if sep != ",":
+                            raise BackupFormatError("« , » ou « ] » attendu")
+            else:
+                meta[key] = rd.value()
+                yield ("meta", key, meta[key])
+            sep = rd.peek()
+            rd.pos += 1
+            if sep == "}":
+                break
+            if sep != ",":
+                raise BackupFormatError("« , » ou « } » attendu")
+    if meta.get("format") == "ndjson":
+        yield ("hist",)
+        while rd.peek():
+            yield ("row", rd.value())
+    elif meta.get("format") == "compact":
+        yield ("hist",)
+        dicts = {col: [] for col, _field in _DICT_COLUMNS}
+        while rd.peek():
+            block = rd.value()
+            if not isinstance(block, dict):
+                raise BackupFormatError("bloc compact invalide")
+            for row in _decode_block(block, dicts):
+                yield ("row", row)
+    elif rd.peek():
+        raise BackupFormatError("contenu inattendu après le document")
@@ -0,0 +1,229 @@
+"""Agrégats incrémentaux pour les badges de l'accueil.
+
+`_compute_badges` reparcourait tout l'historique à chaque visite de
+l'accueil (tonnage cumulé, séances distinctes, meilleur 1RM…). Ici les
+agrégats sont tenus à jour à partir des seules lignes nouvelles depuis
+le dernier calcul, et gardés en cache (`agg:badges:{user_id}`).
+
+Principe :
+  - L'état est découpé par partition (semaine, séance) — l'unité que
+    touchent les writes ciblés de core.db (replace/delete/mark_missed).
+    Chaque partition garde sa contribution (nb de lignes, tonnage, 1RM max,
+    dates de séance) ; les totaux sont maintenus par soustraction/ajout.
+  - `hwm` = plus grand id déjà intégré. Les ids Supabase étant croissants
+    (snapshot trié par id), les lignes nouvelles sont `ids[bisect(hwm):]`.
+    Leurs partitions sont recalculées sur leurs seules lignes.
+  - Une partition non touchée ne peut que perdre des lignes (toute ligne
+    insérée a un id > hwm). Si le total de lignes ne correspond pas à
+    (partitions non touchées + partitions recalculées), une suppression a
+    eu lieu ailleurs → recalcul complet, en un seul passage.
+  - Les writes ciblés (`core.db._hist_patch`) connaissent déjà les lignes
+    des partitions qu'ils touchent : `apply` y remplace leurs contributions
+    sans relire le snapshot, comme `core.streak.apply`. L'index complet du
+    snapshot (`HistoryIndex`) ne sert plus qu'au recalcul complet.
+
+L'état est un dict JSON-sérialisable. Il n'est plus persisté dans
+`programs.data` (ancienne clé `_badge_state`, retirée par la migration
+v30) : il grossissait avec semaines × séances et alourdissait chaque
+lecture / écriture du programme. S'il manque (cache froid, éviction), un
+recalcul complet en un passage le reconstruit ; seule la liste des
+badges obtenus (`prog._badges`) est persistée.
+"""
+import json
+from bisect import bisect_right
+
+from .history import HistoryIndex
+from .muscu import calc_1rm
+
+STATE_VERSION = 1
+
+
+def _part_key(semaine, seance) -> str:
+    return json.dumps([semaine, seance], ensure_ascii=False)
+
+
+def _is_cardio(r) -> bool:
+    return str(r.get("Exercice") or "").startswith("CARDIO:")
+
+
+def _partition_stats(semaine, seance, rows) -> dict:
+    """Contribution d'une partition (semaine, séance) aux badges."""
+    tonnage = 0.0
+    best_1rm = 0.0
+    muscu_real = cardio = False
+    dates = set()
+    for r in rows:
+        if _is_cardio(r):
+            if int(r.get("Reps") or 0) > 0:
+                cardio = True
+                if r.get("Date"):
+                    dates.add(r["Date"])
+        elif r.get("Exercice") != "SESSION" and r.get("Reps", 0) > 0 and r.get("Poids", 0) > 0:
+            muscu_real = True
+            tonnage += r["Poids"] * r["Reps"]
+            best_1rm = max(best_1rm, calc_1rm(r["Poids"], r["Reps"]))
+            if r.get("Date"):
+                dates.add(r["Date"])
+    return {"w": semaine, "s": seance, "n": len(rows), "ton": tonnage, "rm": best_1rm,
+            "mr": muscu_real, "real": muscu_real or cardio, "dates": sorted(dates)}
+
+
+def _empty_state() -> dict:
+    return {"v": STATE_VERSION, "hwm": 0, "n": 0, "parts": {},
+            "tonnage": 0.0, "max_1rm": 0.0, "sessions": {}, "real_parts": 0}
+
+
+def _add(state, key, stats, sign):
+    seance = stats["s"]
+    state["n"] += sign * stats["n"]
+    state["tonnage"] += sign * stats["ton"]
+    state["real_parts"] += sign * (1 if stats["real"] else 0)
+    sessions = state["sessions"]
+    for d in stats["dates"]:
+        skey = f"{d}|{seance}"
+        count = sessions.get(skey, 0) + sign
+        if count > 0:
+            sessions[skey] = count
+        else:
+            sessions.pop(skey, None)
+    if sign > 0:
+        state["parts"][key] = stats
+        state["max_1rm"] = max(state["max_1rm"], stats["rm"])
+    else:
+        state["parts"].pop(key, None)
+
+
+def _rebuild(hist, hwm) -> dict:
+    state = _empty_state()
+    for (semaine, seance), rows in HistoryIndex.of(hist).by_week_seance.items():
+        _add(state, _part_key(semaine, seance), _partition_stats(semaine, seance, rows), +1)
+    state["hwm"] = hwm
+    return state
+
+
+def _hwm(hist):
+    """Plus grand id du snapshot, None s'il ne porte pas (tous) ses ids."""
+    ids = getattr(hist, "ids", None)
+    if not ids or len(ids) != len(hist) or ids[-1] is None:
+        return None
+    return ids[-1]
+
+
+def _replace_parts(state, parts):
+    """Remplace (sur place) la contribution des partitions `parts`
+    ({(semaine, séance): lignes actuelles}) ; une partition vide disparaît."""
+    lost_max = False
+    for (semaine, seance), rows in parts.items():
+        key = _part_key(semaine, seance)
+        old = state["parts"].get(key)
+        if old is not None:
+            lost_max = lost_max or old["rm"] >= state["max_1rm"]
+            _add(state, key, old, -1)
+        if rows:
+            _add(state, key, _partition_stats(semaine, seance, rows), +1)
+    if lost_max:
+        # Le 1RM max ne se soustrait pas : recalcul sur les partitions
+        # (quelques centaines d'entrées, pas les lignes).
+        state["max_1rm"] = max((p["rm"] for p in state["parts"].values()), default=0.0)
+
+
+def _part_rows(hist, touched) -> dict:
+    """Lignes des partitions `touched` : depuis l'index s'il est déjà
+    mémorisé sur le snapshot, sinon un parcours filtré — sans construire
+    l'index complet."""
+    idx = getattr(hist, "_index", None)
+    if idx is not None:
+        return {k: idx.by_week_seance.get(k, ()) for k in touched}
+    parts = {k: [] for k in touched}
+    for r in hist:
+        rows = parts.get((r["Semaine"], r["Séance"]))
+        if rows is not None:
+            rows.append(r)
+    return parts
+
+
+def is_valid(state, hist) -> bool:
+    """L'état couvre exactement `hist` (rien de nouveau, rien de supprimé)."""
+    hwm = _hwm(hist)
+    return (bool(state) and state.get("v") == STATE_VERSION and hwm is not None
+            and state.get("n") == len(hist) and state.get("hwm", 0) >= hwm)
+
+
+def apply(state, parts, after):
+    """Nouvel état après un write ciblé (l'original n'est pas modifié).
+
+    `parts` = {(semaine, séance): lignes de la partition dans `after`} pour
+    chaque partition touchée. None si le résultat ne couvre pas `after` :
+    l'appelant jette l'état, reconstruit à la prochaine lecture."""
+    hwm_now = _hwm(after)
+    if hwm_now is None:
+        return None
+    state = json.loads(json.dumps(state))
+    _replace_parts(state, parts)
+    if state["n"] != len(after):
+        return None
+    state["hwm"] = max(state["hwm"], hwm_now)
+    return state
+
+
+def refresh(state, hist) -> tuple[dict, bool]:
+    """Met l'état à jour pour le snapshot `hist`. Retourne (état, modifié).
+
+    `hist` doit porter ses ids (HistSnapshot) ; sinon recalcul complet."""
+    hwm_now = _hwm(hist)
+    if hwm_now is None:
+        return _rebuild(hist, 0), True
+
+    if not state or state.get("v") != STATE_VERSION:
+        return _rebuild(hist, hwm_now), True
+
+    ids = hist.ids
+    start = bisect_right(ids, state["hwm"])
+    if start == len(ids) and state["n"] == len(hist):
+        return state, False  # rien de nouveau, rien de supprimé
+
+    state = json.loads(json.dumps(state))  # copie : l'appelant peut partager l'original
+    touched = {(r["Semaine"], r["Séance"]) for r in hist[start:]}
+    _replace_parts(state, _part_rows(hist, touched))
+
+    if state["n"] != len(hist):
+        # Lignes supprimées hors des partitions touchées.
+        return _rebuild(hist, hwm_now), True
+
+    state["hwm"] = max(state["hwm"], hwm_now)
+    return state, True
+
+
+def current_week_seances(state) -> set:
+    """Séances faites (muscu réelle) pendant la dernière semaine qui en a."""
+    weeks = {}
+    for stats in state["parts"].values():
+        if stats["mr"]:
+            weeks.setdefault(stats["w"], set()).add(stats["s"])
+    if not weeks:
+        return set()
+    return weeks[max(weeks)]
+
+
+def unlocked(state, planning_map, streak, poids_corps) -> set:
+    """Badges débloqués d'après les agrégats (mêmes règles qu'avant)."""
+    out = set()
+    if state["real_parts"] > 0:
+        out.add("first_session")
+    if len(state["sessions"]) >= 100:
+        out.add("centurion")
+    tonnage = int(round(state["tonnage"], 6))  # dérive flottante des +/-
+    if tonnage >= 10_000:
+        out.add("tonnage_10k")
+    if tonnage >= 50_000:
+        out.add("tonnage_50k")
+    if tonnage >= 100_000:
+        out.add("tonnage_100k")
+    if streak >= 4:
+        out.add("regulier")
+    planned_set = {s for s in planning_map.values() if s}
+    if planned_set and planned_set.issubset(current_week_seances(state)):
+        out.add("full_week")
+    if poids_corps > 0 and state["max_1rm"] > poids_corps:
+        out.add("costaud")
+    return out
@@ -0,0 +1,565 @@
+"""Backends de cache pour core.db (historique, programme).
+
+Avant : un dict module-level dans core/db.py → chaque worker gunicorn avait
+sa propre copie, re-téléchargeait l'historique du même user, et un
+`clear_user_cache` dans un worker n'atteignait jamais les autres.
+
+Le backend est choisi au démarrage via la variable d'env CACHE_BACKEND :
+  - "memory" (défaut) : LRU process-local, aucun partage entre workers
+  - "file"            : répertoire partagé (CACHE_DIR) — visible par tous
+                        les workers d'une même machine
+  - "redis"           : serveur parlant le protocole Redis (REDIS_URL) —
+                        partagé entre machines. Client RESP minimal intégré,
+                        aucune dépendance supplémentaire.
+
+Pour les backends partagés, un L1 mémoire local évite de re-désérialiser
+l'entrée à chaque lecture. Chaque clé porte un numéro de génération stocké
+dans le backend partagé : une écriture ou une invalidation incrémente la
+génération, ce qui invalide les L1 de *tous* les workers (broadcast) au
+prochain accès, pour le prix d'un GET d'un entier.
+"""
+import fcntl
+import hashlib
+import itertools
+import logging
+import os
+import pickle
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+# ────────────────────────────────────────────────────────────
+# Backends bruts : get / set / delete / incr
+# ────────────────────────────────────────────────────────────
+
+def approx_size(value, _depth: int = 0) -> int:
+    """Estimation (en octets) de l'empreinte mémoire d'une valeur en cache.
+    Récursive sur list/tuple/set/dict et sur les attributs des objets
+    (`__slots__` ou `__dict__`) ; au-delà de 64 éléments on extrapole à
+    partir d'un échantillon pour rester O(1) sur un historique de 20k lignes.
+    Une valeur qui expose `attached_size()` (HistSnapshot : ids, index et
+    dérivés mémorisés dessus) y ajoute ce qu'elle porte en plus."""
+    size = sys.getsizeof(value)
+    attached = getattr(value, "attached_size", None)
+    if attached is not None:
+        size += attached()
+    if _depth > 5:
+        return size
+    if isinstance(value, dict):
+        items = list(itertools.islice(value.items(), 64))
+        if items:
+            sample = sum(approx_size(k, _depth + 1) + approx_size(v, _depth + 1) for k, v in items)
+            size += sample * len(value) // len(items)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        items = list(itertools.islice(value, 64))
+        if items:
+            sample = sum(approx_size(v, _depth + 1) for v in items)
+            size += sample * len(value) // len(items)
+    elif isinstance(value, (str, bytes, int, float, bool, type(None))):
+        pass
+    elif hasattr(value, "__dict__"):
+        size += approx_size(vars(value), _depth + 1)
+    else:
+        for slot in getattr(type(value), "__slots__", ()):
+            size += approx_size(getattr(value, slot, None), _depth + 1)
+    return size
+
+
+def _attached_size(value, _depth: int = 0) -> Optional[int]:
+    """`attached_size()` d'une valeur ou des tuples qui l'enveloppent
+    (`hist:` = (snapshot, synced_at), puis (génération, …) dans le L1 d'un
+    backend partagé). None s'il n'y a rien à suivre."""
+    attached = getattr(value, "attached_size", None)
+    if attached is not None:
+        return attached()
+    if _depth < 2 and type(value) is tuple:
+        sizes = [s for s in (_attached_size(v, _depth + 1) for v in value) if s is not None]
+        if sizes:
+            return sum(sizes)
+    return None
+
+
+class MemoryBackend:
+    """LRU process-local, thread-safe et borné : nombre d'entrées max ET
+    budget mémoire approximatif (octets). Les entrées expirées sont purgées
+    à la lecture et par un balayage périodique, pour que la RSS d'un worker
+    qui a vu des milliers d'users reste plate."""
+
+    def __init__(self, max_entries: int = 512, max_bytes: int = 64 * 1024 * 1024,
+                 sweep_interval: float = 30.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._data: OrderedDict = OrderedDict()  # clé -> (valeur, expiration, taille)
+        self._attached: dict = {}  # clé -> attached_size() compté dans la taille
+        self._bytes = 0
+        self._next_sweep = time.time() + sweep_interval
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _drop(self, key: str):
+        _value, _expires, size = self._data.pop(key)
+        self._attached.pop(key, None)
+        self._bytes -= size
+
+    def _evict(self):
+        """Évince les plus anciennes entrées jusqu'à repasser sous les
+        bornes (appelé sous verrou)."""
+        while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._data))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def _sweep(self, now: float):
+        """Purge toutes les entrées expirées (appelé sous verrou)."""
+        expired = [k for k, (_v, exp, _s) in self._data.items() if exp is not None and exp < now]
+        for k in expired:
+            self._drop(k)
+        self.expirations += len(expired)
+        self._next_sweep = now + self.sweep_interval
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires, _size = entry
+            if expires is not None and expires < now:
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+        attached = _attached_size(value)
+        if attached is not None and attached != self._attached.get(key):
+            self._regrow(key, value, attached)
+        return value
+
+    def _regrow(self, key: str, value, attached: int):
+        """Un snapshot gardé par référence grossit après le set (index,
+        `derived`… mémorisés dessus) : mesuré hors verrou à la lecture, on
+        reporte l'écart sur sa taille et on évince si le budget est dépassé."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] is not value:
+                return
+            delta = attached - self._attached.get(key, 0)
+            if delta:
+                self._data[key] = (value, entry[1], entry[2] + delta)
+                self._attached[key] = attached
+                self._bytes += delta
+                self._evict()
+
+    def set(self, key: str, value, ttl: Optional[float] = None):
+        now = time.time()
+        expires = now + ttl if ttl else None
+        size = approx_size(value)
+        attached = _attached_size(value)
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            if size > self.max_bytes:
+                return  # ne tiendra jamais : inutile de vider tout le cache
+            self._data[key] = (value, expires, size)
+            if attached is not None:
+                self._attached[key] = attached
+            self._bytes += size
+            self._evict()
+            if now >= self._next_sweep:
+                self._sweep(now)
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+
+    def incr(self, key: str, ttl: Optional[float] = None) -> int:
+        with self._lock:
+            value, expires, size = self._data.get(key, (0, None, 0))
+            value = int(value) + 1
+            if ttl:
+                expires = time.time() + ttl
+            self._data[key] = (value, expires, size)
+            self._data.move_to_end(key)
+            return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+# Entrées du backend fichier écrites sans TTL : purgées au balayage après
+# ce délai.
+_FILE_MAX_AGE = 30 * 24 * 3600.0
+
+
+def _unlink(path: str) -> int:
+    try:
+        os.unlink(path)
+        return 1
+    except OSError:
+        return 0
+
+
+class FileBackend:
+    """Un fichier pickle par clé dans un répertoire partagé. Écritures
+    atomiques (tmp + os.replace) ; `incr` sérialisé par un verrou fcntl.
+
+    Le mtime de chaque fichier porte son échéance (écriture + 30 jours si
+    pas de TTL) : toutes les `sweep_interval` secondes, un `set` balaie le
+    répertoire sur un simple stat — fichiers échus supprimés, puis les plus
+    proches de l'échéance tant que `max_entries` / `max_bytes` sont
+    dépassés. Un seul worker balaie à la fois (verrou non bloquant)."""
+
+    def __init__(self, directory: str, max_entries: int = 5000,
+                 max_bytes: int = 512 * 1024 * 1024, sweep_interval: float = 300.0):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        os.makedirs(directory, exist_ok=True)
+        self._lock_path = os.path.join(directory, ".lock")
+        self._sweep_lock_path = os.path.join(directory, ".sweep")
+        self._next_sweep = time.time() + sweep_interval
+
+    def _path(self, key: str) -> str:
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest + ".pkl")
+
+    def get(self, key: str):
+        try:
+            with open(self._path(key), "rb") as fh:
+                value, expires = pickle.load(fh)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            return None
+        if expires is not None and expires < time.time():
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key: str, value, ttl: Optional[float] = None):
+        now = time.time()
+        expires = now + ttl if ttl else None
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                pickle.dump((value, expires), fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.utime(tmp, (now, expires or now + _FILE_MAX_AGE))
+            os.replace(tmp, self._path(key))
+        except OSError as e:
+            logger.error("FileBackend.set FAILED key=%s: %s", key, e)
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+        if now >= self._next_sweep:
+            self._next_sweep = now + self.sweep_interval
+            self._sweep(now)
+
+    def _sweep(self, now: float):
+        with open(self._sweep_lock_path, "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return  # un autre worker balaie déjà
+            try:
+                expired, evicted = self._sweep_locked(now)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        if expired or evicted:
+            logger.info("FileBackend sweep: %d échus, %d évincés", expired, evicted)
+
+    def _sweep_locked(self, now: float):
+        live, total, expired = [], 0, 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                name = entry.name
+                if not name.endswith((".pkl", ".tmp")):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                # .tmp d'une écriture interrompue : mtime = date de création
+                stale = now - 3600 if name.endswith(".tmp") else now
+                if st.st_mtime < stale:
+                    expired += _unlink(entry.path)
+                elif name.endswith(".pkl"):
+                    live.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+        evicted = 0
+        excess = len(live) - self.max_entries
+        live.sort()
+        for _mtime, size, path in live:
+            if excess <= 0 and total <= self.max_bytes:
+                break
+            evicted += _unlink(path)
+            excess -= 1
+            total -= size
+        return expired, evicted
+
+    def delete(self, key: str):
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+    def incr(self, key: str, ttl: Optional[float] = None) -> int:
+        with open(self._lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # Compteur perdu (échu ou balayé) : repartir d'une base
+                # horaire et non de 0, pour ne jamais reprendre une
+                # génération encore présente dans un L1.
+                current = self.get(key)
+                value = (int(current) if current is not None else int(time.time() * 1000)) + 1
+                self.set(key, value, ttl)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        return value
+
+
+class RedisBackend:
+    """Client RESP minimal (GET/SET EX/DEL/INCR) — une connexion par thread.
+    Compatible avec Redis, Valkey, KeyDB ou tout stand-in local qui parle
+    le protocole."""
+
+    def __init__(self, url: str, timeout: float = 2.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int((parsed.path or "/0").lstrip("/") or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    # ── Protocole ──
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            conn = (sock, sock.makefile("rb"))
+            self._local.conn = conn
+            if self.password:
+                self._command("AUTH", self.password)
+            if self.db:
+                self._command("SELECT", str(self.db))
+        return conn
+
+    def _reset(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn:
+            try:
+                conn[1].close()
+                conn[0].close()
+            except OSError:
+                pass
+
+    def _read_reply(self, fh):
+        line = fh.readline()
+        if not line:
+            raise ConnectionError("connexion redis fermée")
+        prefix, rest = line[:1], line[1:-2]
+        if prefix == b"+":
+            return rest.decode()
+        if prefix == b"-":
+            raise RuntimeError(rest.decode())
+        if prefix == b":":
+            return int(rest)
+        if prefix == b"$":
+            n = int(rest)
+            if n < 0:
+                return None
+            data = fh.read(n + 2)
+            return data[:-2]
+        if prefix == b"*":
+            n = int(rest)
+            return None if n < 0 else [self._read_reply(fh) for _ in range(n)]
+        raise RuntimeError(f"réponse redis inattendue : {line!r}")
+
+    def _command(self, *args):
+        sock, fh = self._conn()
+        parts = [b"*%d\r\n" % len(args)]
+        for a in args:
+            b = a if isinstance(a, bytes) else str(a).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(b), b))
+        try:
+            sock.sendall(b"".join(parts))
+            return self._read_reply(fh)
+        except (OSError, ConnectionError):
+            self._reset()
+            raise
+
+    # ── API backend ──
+    def get(self, key: str):
+        raw = self._command("GET", key)
+        if raw is None:
+            return None
+        if raw.isdigit():
+            return int(raw)  # compteur INCR, stocké en texte par Redis
+        try:
+            return pickle.loads(raw)
+        except (pickle.UnpicklingError, EOFError, ValueError):
+            return None
+
+    def set(self, key: str, value, ttl: Optional[float] = None):
+        raw = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if ttl:
+            self._command("SET", key, raw, "PX", str(int(ttl * 1000)))
+        else:
+            self._command("SET", key, raw)
+
+    def delete(self, key: str):
+        self._command("DEL", key)
+
+    def incr(self, key: str, ttl: Optional[float] = None) -> int:
+        value = int(self._command("INCR", key))
+        if ttl:
+            self._command("PEXPIRE", key, str(int(ttl * 1000)))
+        return value
+
+
+# ────────────────────────────────────────────────────────────
+# Façade : L1 local + backend partagé avec génération par clé
+# ────────────────────────────────────────────────────────────
+
+class Cache:
+    """Cache utilisé par core.db. Si `shared` est None, seul le L1 mémoire
+    sert. Sinon, chaque entrée partagée est stockée sous la forme
+    (génération, valeur) et la génération courante sous `gen:<clé>`."""
+
+    def __init__(self, shared=None, local: Optional[MemoryBackend] = None):
+        self.shared = shared
+        self.local = local or MemoryBackend()
+
+    def get(self, key: str):
+        if self.shared is None:
+            return self.local.get(key)
+        try:
+            gen = self.shared.get("gen:" + key)
+            if gen is None:
+                return None
+            hit = self.local.get(key)
+            if hit is not None and hit[0] == gen:
+                return hit[1]
+            stored = self.shared.get(key)
+        except Exception as e:
+            logger.error("cache get FAILED key=%s: %s", key, e)
+            return None
+        if stored is None or stored[0] != gen:
+            return None
+        self.local.set(key, stored, DEFAULT_TTL)
+        return stored[1]
+
+    def set(self, key: str, value, ttl: Optional[float] = None):
+        if self.shared is None:
+            self.local.set(key, value, ttl)
+            return
+        try:
+            gen = self.shared.incr("gen:" + key, _gen_ttl(ttl))
+            self.shared.set(key, (gen, value), ttl)
+            self.local.set(key, (gen, value), ttl)
+        except Exception as e:
+            logger.error("cache set FAILED key=%s: %s", key, e)
+            self.local.delete(key)
+
+    def stats(self) -> dict:
+        """Compteurs du L1 local (hits/misses/évictions) + backend actif."""
+        out = self.local.stats()
+        out["backend"] = type(self.shared).__name__ if self.shared is not None else "MemoryBackend"
+        return out
+
+    def delete(self, key: str):
+        """Invalide la clé partout : le bump de génération suffit à rendre
+        caduques les L1 des autres workers."""
+        self.local.delete(key)
+        if self.shared is None:
+            return
+        try:
+            self.shared.incr("gen:" + key, GEN_TTL)
+            self.shared.delete(key)
+        except Exception as e:
+            logger.error("cache delete FAILED key=%s: %s", key, e)
+
+
+DEFAULT_TTL = 60.0
+# Durée de vie d'un compteur `gen:<clé>` : au moins la plus longue TTL de
+# valeur (24 h dans core.db), pour qu'il survive à la valeur et aux copies
+# L1 qu'il protège.
+GEN_TTL = 2 * 24 * 3600.0
+
+
+def _gen_ttl(ttl: Optional[float]) -> float:
+    return max(GEN_TTL, ttl + DEFAULT_TTL) if ttl else GEN_TTL
+
+_cache: Optional[Cache] = None
+_cache_lock = threading.Lock()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+def _build_cache() -> Cache:
+    kind = (os.getenv("CACHE_BACKEND", "memory") or "memory").strip().lower()
+    local = MemoryBackend(
+        max_entries=_env_int("CACHE_MAX_ENTRIES", 512),
+        max_bytes=_env_int("CACHE_MAX_MB", 64) * 1024 * 1024,
+    )
+    if kind == "file":
+        directory = os.getenv("CACHE_DIR") or os.path.join(tempfile.gettempdir(), "muscu-cache")
+        logger.info("cache backend=file dir=%s", directory)
+        backend = FileBackend(
+            directory,
+            max_entries=_env_int("CACHE_FILE_MAX_ENTRIES", 5000),
+            max_bytes=_env_int("CACHE_FILE_MAX_MB", 512) * 1024 * 1024,
+        )
+        return Cache(shared=backend, local=local)
+    if kind == "redis":
+        url = os.getenv("REDIS_URL", "")
+        if url:
+            logger.info("cache backend=redis host=%s", urlparse(url).hostname)
+            return Cache(shared=RedisBackend(url), local=local)
+        logger.warning("CACHE_BACKEND=redis sans REDIS_URL — repli sur le cache mémoire")
+    return Cache(local=local)
+
+
+def get_cache() -> Cache:
+    """Cache process-wide, construit au premier appel depuis l'environnement."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = _build_cache()
+    return _cache
@@ -10,6 +10,13 @@ Chaque appel traverse donc : route → core.data → core.db (service_role +
 filtre `user_id` explicite). Toute route qui oublierait d'être protégée et
 appellerait ces fonctions lèverait immédiatement une RuntimeError — c'est la
 garde côté applicatif qui remplace le RLS Supabase.
+
+Mémoïsation par requête : `get_hist`, `get_prog` et `get_profile` sont
+mémorisés sur `flask.g` le temps de la requête (before_request, context
+processor et route lisent ainsi une seule fois chaque table). Les save_*
+correspondants mettent à jour ou oublient l'entrée. Conséquence : dans une
+même requête, deux `get_prog()` renvoient le même dict — le muter revient à
+muter ce que verront les lectures suivantes de la requête.
 """
 from flask import g
 
@@ -26,54 +33,132 @@ def _uid() -> str:
     return uid
 
 
+# ── Mémo par requête (flask.g) ─────────────────────────────────────────
+def _memo() -> dict:
+    memo = getattr(g, "_data_memo", None)
+    if memo is None:
+        memo = g._data_memo = {}
+    return memo
+
+
+def _memoized(name, loader):
+    memo = _memo()
+    if name not in memo:
+        memo[name] = loader(_uid())
+    return memo[name]
+
+
+def _forget(*names):
+    memo = _memo()
+    for name in names:
+        memo.pop(name, None)
+
+
 # ── Cache ──────────────────────────────────────────────────────────────
 def clear_user_cache():
-    """Invalide le cache mémoire de l'utilisateur courant (hist + prog)."""
+    """Invalide le cache mémoire de l'utilisateur courant (hist, prog, profil)."""
+    _forget("hist", "prog", "profile")
     db.clear_user_cache(_uid())
 
 
+# ── Agrégats (badges, streak…) ──────────────────────────────────────────────────
+def get_aggregate(name):
+    return db.get_aggregate(_uid(), name)
+
+
+def set_aggregate(name, value):
+    return db.set_aggregate(_uid(), name, value)
+
+
+def data_version():
+    return db.data_version(_uid())
+
+
+def get_streak(hist):
+    return db.get_streak(_uid(), hist)
+
+
+def save_streak_record(record):
+    return db.save_streak_record(_uid(), record)
+
+
 # ── Historique ──────────────────────────────────────────────────────────
 def get_hist():
-    return db.get_hist(_uid())
+    return _memoized("hist", db.get_hist)
 
 
 def save_hist(rows):
+    _forget("hist")
     return db.save_hist(_uid(), rows)
 
 
+def iter_hist():
+    """Historique par pages (export en flux) — non mémoïsé."""
+    return db.iter_hist(_uid())
+
+
+def normalize_hist_row(row):
+    return db.normalize_hist_row(_uid(), row)
+
+
+def import_hist_batch(rows, mode="replace", first=False):
+    _forget("hist")
+    return db.import_hist_batch(_uid(), rows, mode, first)
+
+
+def get_import_job():
+    return db.get_import_job(_uid())
+
+
+def save_import_job(job):
+    return db.save_import_job(_uid(), job)
+
+
 # ── Programme ───────────────────────────────────────────────────────────
 def get_prog():
-    return db.get_prog(_uid())
+    return _memoized("prog", db.get_prog)
 
 
 def save_prog(prog_dict):
-    return db.save_prog(_uid(), prog_dict)
+    _forget("prog")
+    out = db.save_prog(_uid(), prog_dict)
+    _memo()["prog"] = prog_dict
+    return out
 
 
 # ── Opérations ciblées ──────────────────────────────────────────────────
 def replace_exo_rows(semaine, seance, exercice, new_rows):
+    _forget("hist")
     return db.replace_exo_rows(_uid(), semaine, seance, exercice, new_rows)
 
 
 def delete_exo_rows(semaine, seance, exercice):
+    _forget("hist")
     return db.delete_exo_rows(_uid(), semaine, seance, exercice)
 
 
 def delete_session_rows(semaine, seance):
+    _forget("hist")
     return db.delete_session_rows(_uid(), semaine, seance)
 
 
 def mark_session_missed(semaine, seance_name, date_str):
+    _forget("hist")
     return db.mark_session_missed(_uid(), semaine, seance_name, date_str)
 
 
 # ── Profil (Phase 4) ────────────────────────────────────────────────────
 def get_profile():
-    return db.get_profile(_uid())
+    return _memoized("profile", db.get_profile)
 
 
 def save_profile(fields):
-    return db.save_profile(_uid(), fields)
+    memo = _memo()
+    previous = memo.pop("profile", None)
+    out = db.save_profile(_uid(), fields)
+    if previous is not None:
+        memo["profile"] = {**previous, **fields}
+    return out
 
 
 # ── Onboarding (Phase 4) ────────────────────────────────────────────────
@@ -119,12 +204,17 @@ def clear_coach_messages():
     return db.clear_coach_messages(_uid())
 
 
+def reserve_coach_turn(day, limit, tail=10):
+    _forget("profile")
+    return db.reserve_coach_turn(_uid(), day, limit, tail)
+
+
 # ── Tier (Prompt D — paywall préparé, non activé) ───────────────────────
 def is_premium() -> bool:
     """True si l'utilisateur courant est tier 'vip'. Pour l'instant tout le
     monde est free — mais les templates peuvent déjà gater des features."""
     try:
-        profile = db.get_profile(_uid()) or {}
+        profile = get_profile() or {}
     except Exception:
         return False
     return (profile.get("tier") or "free").strip().lower() == "vip"
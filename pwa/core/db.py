@@ -13,11 +13,20 @@ Config : deux variables d'env requises
 import os
 import json
 import logging
+import math
+import secrets
+import threading
 import time
+from datetime import date, datetime, timezone
 from typing import Optional
 
 from supabase import create_client, Client
 
+from .cache import get_cache
+from . import badges as badge_agg
+from . import streak as streak_agg
+from .history import HistRow, HistSnapshot
+
 logger = logging.getLogger(__name__)
 
 def _env(name: str) -> str:
@@ -51,44 +60,256 @@ def get_client() -> Client:
     return _client
 
 
-# ── Cache mémoire process-wide (TTL 10 min), clé par user_id ──
-_data_cache: dict = {}
+# ── Cache (TTL 60 s), clé par user_id ──
+# Backend pluggable (mémoire / fichier partagé / Redis) — voir core/cache.py.
+# Avec un backend partagé, tous les workers gunicorn lisent les mêmes
+# entrées et une invalidation est vue par tous.
 _TTL = 60.0
 
 
 def _cache_get(key: str):
-    entry = _data_cache.get(key)
-    if entry and (time.time() - entry["ts"]) < _TTL:
-        return entry["value"]
-    return None
+    return get_cache().get(key)
 
 
-def _cache_set(key: str, value):
-    _data_cache[key] = {"value": value, "ts": time.time()}
+def _cache_set(key: str, value, ttl: float = _TTL):
+    get_cache().set(key, value, ttl)
 
 
 def _cache_invalidate(key: str):
-    _data_cache.pop(key, None)
+    get_cache().delete(key)
+
+
+def cache_stats() -> dict:
+    """Compteurs du cache (hits, misses, évictions, octets) — admin/monitoring."""
+    return get_cache().stats()
 
 
 def clear_user_cache(user_id: str):
     """Invalide explicitement toutes les entrées cache d'un utilisateur.
-    Appelé après chaque save réussi pour éviter les séances vides au reload."""
-    _data_cache.pop(f"hist:{user_id}", None)
-    _data_cache.pop(f"prog:{user_id}", None)
+    Appelé après chaque save réussi pour éviter les séances vides au reload.
+    Couvre hist, prog et profil. L'historique n'est pas jeté : il est marqué à resynchroniser, la
+    prochaine lecture ne récupère que le delta (cf. get_hist)."""
+    _hist_mark_stale(user_id)
+    _cache_invalidate(f"prog:{user_id}")
+    _cache_invalidate(f"profile:{user_id}")
+    bump_data_version(user_id)
+
+
+# Agrégats dérivés de l'historique (badges…) : gardés en cache longue durée.
+# Ils portent leur propre garde de cohérence (high-water mark + nb de lignes,
+# cf. core.badges, core.streak) — pas besoin de les invalider sur les writes
+# ciblés. Les réécritures en masse (save_hist, import) les jettent quand même.
+_AGG_TTL = 24 * 3600
+
+
+def get_aggregate(user_id: str, name: str):
+    return _cache_get(f"agg:{name}:{user_id}")
+
+
+def set_aggregate(user_id: str, name: str, value):
+    _cache_set(f"agg:{name}:{user_id}", value, _AGG_TTL)
+
+
+# Version des données d'un user (ETag des pages, cf. app.py ; contexte du
+# prompt coach) : jeton aléatoire remplacé par chaque write de ce module —
+# sauf les messages et le quota du coach, qu'aucune page versionnée
+# n'affiche et qui changent à chaque tour de coach. Aléatoire plutôt qu'un
+# compteur : une entrée évincée ou un redémarrage ne peut jamais ressusciter
+# un ancien jeton.
+#
+# Durée de vie : longue (_AGG_TTL) dès que tous les writes passent par le
+# même cache — backend partagé, ou un seul process (déploiement par défaut :
+# un worker gthread, cf. railway.json). Seul le cas « cache mémoire +
+# plusieurs workers » garde la fenêtre courte (_TTL) : un worker qui n'a
+# pas vu le write ne sert pas de 304 au-delà. Le nb de workers est lu dans
+# WEB_CONCURRENCY (celui de gunicorn) ; DATA_VERSION_TTL (secondes) force
+# la valeur.
+def _single_process() -> bool:
+    try:
+        return int(_env("WEB_CONCURRENCY") or 1) <= 1
+    except ValueError:
+        return False
+
+
+def _version_ttl() -> float:
+    forced = _env("DATA_VERSION_TTL")
+    if forced:
+        try:
+            return float(forced)
+        except ValueError:
+            logger.error("DATA_VERSION_TTL invalide : %r", forced)
+    if get_cache().shared is not None or _single_process():
+        return _AGG_TTL
+    return _TTL
+
+
+def data_version(user_id: str) -> str:
+    key = f"ver:{user_id}"
+    version = _cache_get(key)
+    if version is None:
+        version = secrets.token_hex(8)
+        _cache_set(key, version, _version_ttl())
+    return version
+
+
+def bump_data_version(user_id: str):
+    _cache_set(f"ver:{user_id}", secrets.token_hex(8), _version_ttl())
+
+
+# Streak hebdo (core.streak) : mis à jour ici à chaque transition du
+# snapshot en cache (delta, patch ciblé) ; reconstruit en un parcours
+# seulement si l'état manque ou ne couvre pas le snapshot lu. Le record est
+# persisté dans la colonne `programs.streak_record` (migration v26).
+def _streak_patch(user_id: str, before, after, removed=(), added=()) -> Optional[int]:
+    """Met l'agrégat en cache à jour. Retourne le nouveau record s'il a
+    grandi, à persister par l'appelant (`_update_streak_record`) une fois
+    le verrou user relâché : pas d'aller-retour Supabase sous le verrou."""
+    key = f"agg:streak:{user_id}"
+    state = _cache_get(key)
+    if not streak_agg.is_valid(state, before):
+        return None
+    new_state = streak_agg.apply(state, removed, added, after)
+    _cache_set(key, new_state, _AGG_TTL)
+    if new_state["record"] > state["record"]:
+        return new_state["record"]
+    return None
+
+
+def _badges_patch(user_id: str, before, after, parts):
+    """Badges (core.badges) : contributions des partitions touchées par un
+    write ciblé remplacées sans relire le snapshot."""
+    key = f"agg:badges:{user_id}"
+    state = _cache_get(key)
+    if not badge_agg.is_valid(state, before):
+        return
+    new_state = badge_agg.apply(state, parts, after)
+    if new_state is None:
+        _cache_invalidate(key)
+    else:
+        _cache_set(key, new_state, _AGG_TTL)
+
+
+def get_streak(user_id: str, hist) -> dict:
+    """État du streak pour le snapshot `hist` (cf. core.streak)."""
+    key = f"agg:streak:{user_id}"
+    state = _cache_get(key)
+    if streak_agg.is_valid(state, hist):
+        return state
+    record = state["record"] if state else _load_streak_record(user_id)
+    state = streak_agg.build(hist, record)
+    _cache_set(key, state, _AGG_TTL)
+    if state["record"] > record:
+        _update_streak_record(user_id, state["record"])
+    return state
+
+
+def save_streak_record(user_id: str, record: int):
+    """Remonte le record (reprise de l'ancien `prog._streak_record`)."""
+    key = f"agg:streak:{user_id}"
+    state = _cache_get(key)
+    if state and record > state["record"]:
+        _cache_set(key, {**state, "record": int(record)}, _AGG_TTL)
+    _update_streak_record(user_id, int(record))
+
+
+def _load_streak_record(user_id: str) -> int:
+    try:
+        resp = (
+            get_client().table("programs")
+            .select("streak_record")
+            .eq("user_id", user_id)
+            .maybe_single()
+            .execute()
+        )
+    except Exception as e:
+        logger.error("streak_record read FAILED user=%s: %s", user_id, e)
+        return 0
+    return int(((resp.data if resp else None) or {}).get("streak_record") or 0)
+
+
+def _update_streak_record(user_id: str, record: int):
+    """UPDATE ciblé d'une colonne (pas de réécriture de programs.data). Le
+    filtre `streak_record < record` rend l'écriture monotone entre workers.
+
+    Aucune ligne modifiée : soit le record en base est déjà au moins aussi
+    haut, soit l'user n'a pas encore de ligne `programs` (historique
+    importé avant tout programme). Dans le doute, INSERT … ON CONFLICT DO
+    NOTHING : crée la ligne si elle manque, sans toucher une ligne
+    existante ; si une ligne est apparue entre-temps, l'UPDATE est rejoué."""
+    client = get_client()
+    try:
+        resp = _streak_record_update(client, user_id, record)
+        if not (resp and resp.data):
+            created = (
+                client.table("programs")
+                .upsert({"user_id": user_id, "data": {}, "streak_record": record},
+                        on_conflict="user_id", ignore_duplicates=True)
+                .execute()
+            )
+            if not (created and created.data):
+                _streak_record_update(client, user_id, record)
+    except Exception as e:
+        logger.error("streak_record update FAILED user=%s: %s", user_id, e)
+        return
+    bump_data_version(user_id)
+
+
+def _streak_record_update(client, user_id: str, record: int):
+    return (
+        client.table("programs")
+        .update({"streak_record": record})
+        .eq("user_id", user_id)
+        .lt("streak_record", record)
+        .execute()
+    )
 
 
 # ────────────────────────────────────────────────────────────
 # Historique des séries
 # ────────────────────────────────────────────────────────────
 
-def get_hist(user_id: str) -> list[dict]:
+def _row_from_supabase(r: dict) -> HistRow:
+    return HistRow({
+        "Semaine": int(r.get("semaine") or 1),
+        "Séance": r.get("seance") or "",
+        "Exercice": r.get("exercice") or "",
+        "Série": int(r.get("serie") or 1),
+        "Reps": int(r.get("reps") or 0),
+        "Poids": float(r.get("poids") or 0),
+        "Remarque": r.get("remarque") or "",
+        "Muscle": r.get("muscle") or "",
+        "Date": str(r.get("date") or ""),
+    })
+
+
+# Entrée cache `hist:{user_id}` = (snapshot, synced_at). L'entrée vit
+# _HIST_KEEP secondes ; passé _TTL, la lecture suivante ne télécharge que
+# les lignes d'id > high-water mark (+ un COUNT pour détecter les
+# suppressions faites ailleurs) au lieu de tout l'historique.
+_HIST_KEEP = 15 * 60
+
+
+def get_hist(user_id: str) -> HistSnapshot:
     """Retourne l'historique de l'user sous la même forme que sheets.get_hist
-    (liste de dicts avec clés Semaine/Séance/Exercice/...)."""
+    (séquence de lignes avec clés Semaine/Séance/Exercice/...).
+
+    Le snapshot est immuable et partagé entre lecteurs — aucune copie par
+    appel. Un appelant qui doit modifier des lignes copie explicitement
+    (`dict(r)`, `r.replace(...)`, `hist.to_dicts()`)."""
     key = f"hist:{user_id}"
-    cached = _cache_get(key)
-    if cached is not None:
-        return [dict(r) for r in cached]
+    entry = _cache_get(key)
+    if entry is not None:
+        snap, synced_at = entry
+        if time.time() - synced_at < _TTL:
+            return snap
+        try:
+            snap = _hist_sync_delta(user_id, snap)
+        except Exception as e:
+            logger.error("get_hist delta sync FAILED user=%s: %s", user_id, e)
+            snap = None
+        if snap is not None:
+            _cache_set(key, (snap, time.time()), _HIST_KEEP)
+            return snap
 
     client = get_client()
     resp = (
@@ -99,26 +320,198 @@ def get_hist(user_id: str) -> list[dict]:
         .execute()
     )
     rows = resp.data or []
-    cleaned = [{
-        "Semaine": int(r.get("semaine") or 1),
-        "Séance": r.get("seance") or "",
-        "Exercice": r.get("exercice") or "",
-        "Série": int(r.get("serie") or 1),
-        "Reps": int(r.get("reps") or 0),
-        "Poids": float(r.get("poids") or 0),
-        "Remarque": r.get("remarque") or "",
-        "Muscle": r.get("muscle") or "",
-        "Date": str(r.get("date") or ""),
-    } for r in rows]
-    _cache_set(key, cleaned)
-    return [dict(r) for r in cleaned]
+    snap = HistSnapshot(
+        (_row_from_supabase(r) for r in rows),
+        (r.get("id") for r in rows),
+    )
+    _cache_set(key, (snap, time.time()), _HIST_KEEP)
+    return snap
+
+
+def _hist_sync_delta(user_id: str, snap: HistSnapshot) -> Optional[HistSnapshot]:
+    """Complète `snap` avec les lignes insérées depuis son id max. Retourne
+    None si le total côté serveur ne colle pas (suppression faite par un
+    autre worker, insert concurrent d'id inférieur…) → rechargement complet."""
+    client = get_client()
+    hwm = max(snap.ids, default=0)
+    resp = (
+        client.table("history")
+        .select("*")
+        .eq("user_id", user_id)
+        .gt("id", hwm)
+        .order("id")
+        .execute()
+    )
+    new_rows = resp.data or []
+    count_resp = (
+        client.table("history")
+        .select("id", count="exact", head=True)
+        .eq("user_id", user_id)
+        .execute()
+    )
+    total = getattr(count_resp, "count", None)
+    if total is None or total != len(snap) + len(new_rows):
+        return None
+    if not new_rows:
+        return snap
+    added = [_row_from_supabase(r) for r in new_rows]
+    out = HistSnapshot(list(snap) + added, snap.ids + tuple(r.get("id") for r in new_rows))
+    record = _streak_patch(user_id, snap, out, added=added)
+    if record is not None:
+        _update_streak_record(user_id, record)
+    return out
+
+
+_HIST_PAGE = 1000
+
+
+def iter_hist(user_id: str, page_size: int = _HIST_PAGE):
+    """Historique par pages de `page_size` lignes (listes de HistRow), en
+    ordre d'id — pagination keyset (`id > dernier id vu`), une requête par
+    page, sans passer par le cache : l'appelant (export en flux) ne garde
+    qu'une page en mémoire à la fois."""
+    client = get_client()
+    last_id = 0
+    while True:
+        resp = (
+            client.table("history")
+            .select("*")
+            .eq("user_id", user_id)
+            .gt("id", last_id)
+            .order("id")
+            .limit(page_size)
+            .execute()
+        )
+        rows = resp.data or []
+        if not rows:
+            return
+        yield [_row_from_supabase(r) for r in rows]
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1].get("id") or 0
+
+
+def _hist_mark_stale(user_id: str):
+    """Force une resynchronisation delta à la prochaine lecture."""
+    key = f"hist:{user_id}"
+    entry = _cache_get(key)
+    if entry is not None:
+        _cache_set(key, (entry[0], 0.0), _HIST_KEEP)
+
+
+# Verrous rayés : un nombre fixe de verrous partagés par hachage du
+# user_id, plutôt qu'un dict qui garderait un verrou par user ayant jamais
+# écrit pendant toute la vie du worker. Deux users du même rayon se
+# sérialisent (rare, et sans risque : un verrou n'est jamais pris
+# pendant qu'un autre est tenu).
+_USER_LOCK_STRIPES = 64
+_user_locks = tuple(threading.Lock() for _ in range(_USER_LOCK_STRIPES))
+
+
+def _user_lock(user_id: str) -> threading.Lock:
+    """Verrou par user : sérialise write Supabase + patch du cache pour que
+    deux saves concurrents (onglets, workers gthread) s'appliquent au cache
+    dans le même ordre qu'en base."""
+    return _user_locks[hash(user_id) % _USER_LOCK_STRIPES]
+
+
+def _hist_patch(user_id: str, semaine: int, seance: str, exercice: Optional[str] = None,
+                inserted: Optional[list] = None) -> Optional[int]:
+    """Write-through : reflète dans le snapshot en cache un write ciblé dont
+    on connaît exactement l'effet — retire les lignes (semaine, séance
+    [, exercice]) puis ajoute les lignes insérées (réponse Supabase, avec
+    leurs ids). L'entrée reste fraîche : le redirect qui suit est servi
+    sans aucune lecture. Si l'insert n'a pas renvoyé ses lignes, l'entrée
+    est marquée à resynchroniser (delta).
+
+    Retourne le nouveau record de streak à persister après le verrou
+    (cf. `_streak_patch`), None sinon."""
+    key = f"hist:{user_id}"
+    entry = _cache_get(key)
+    if entry is None:
+        return None
+    snap, synced_at = entry
+    semaine = int(semaine)
+    inserted = sorted(inserted, key=lambda r: r.get("id") or 0) if inserted is not None else None
+    added = [_row_from_supabase(r) for r in inserted or ()]
+    # Lignes des partitions touchées après le write (badges) : collectées
+    # pendant le parcours qui construit déjà le nouveau snapshot.
+    parts = {(semaine, seance): []}
+    for r in added:
+        parts.setdefault((r["Semaine"], r["Séance"]), [])
+    rows, ids, removed = [], [], []
+    for row_id, r in zip(snap.ids, snap):
+        if (r["Semaine"] == semaine and r["Séance"] == seance
+                and (exercice is None or r["Exercice"] == exercice)):
+            removed.append(r)
+            continue
+        rows.append(r)
+        ids.append(row_id)
+        part = parts.get((r["Semaine"], r["Séance"]))
+        if part is not None:
+            part.append(r)
+    if inserted is None:
+        synced_at = 0.0
+    else:
+        ids += [r.get("id") for r in inserted]
+        rows += added
+        for r in added:
+            parts[(r["Semaine"], r["Séance"])].append(r)
+    out = HistSnapshot(rows, ids)
+    _cache_set(key, (out, synced_at), _HIST_KEEP)
+    if inserted is None:
+        _cache_invalidate(f"agg:streak:{user_id}")
+        return None
+    _badges_patch(user_id, snap, out, parts)
+    return _streak_patch(user_id, snap, out, removed, added)
 
 
 def save_hist(user_id: str, rows: list[dict]):
     """Réécrit tout l'historique de l'user (équivalent du write-all
-    clear+update du Sheet). Garde une copie de secours en mémoire :
-    si l'insert échoue après le delete, on tente de restaurer l'ancien
-    historique pour éviter une perte de données."""
+    clear+update du Sheet).
+
+    Chemin normal : RPC `replace_history` (migration v28) — DELETE + INSERT
+    dans une seule transaction, payload envoyé une fois, rien ne change en
+    cas d'échec. Sans la migration : ancien chemin avec copie de secours."""
+    payload = [_row_to_supabase(user_id, r) for r in rows or []]
+    try:
+        _replace_hist(user_id, payload)
+    finally:
+        _cache_invalidate(f"hist:{user_id}")
+        _cache_invalidate(f"agg:streak:{user_id}")
+        bump_data_version(user_id)
+
+
+# Codes renvoyés par PostgREST quand la fonction appelée n'existe pas
+# (migration pas encore appliquée) : seul cas où un repli legacy a du sens.
+_RPC_MISSING = {"PGRST202", "404"}
+
+
+def _rpc_missing(e: Exception) -> bool:
+    return str(getattr(e, "code", "")) in _RPC_MISSING
+
+
+def _replace_hist(user_id: str, payload: list[dict]):
+    """RPC `replace_history`, repli legacy uniquement si la fonction
+    manque. Toute autre erreur (ligne refusée, timeout…) remonte : la
+    transaction a été annulée, l'historique est intact, et rejouer l'ancien
+    chemin non atomique par-dessus n'arrangerait rien."""
+    client = get_client()
+    rpc_rows = [{k: v for k, v in row.items() if k != "user_id"} for row in payload]
+    try:
+        client.rpc("replace_history", {"p_user_id": user_id, "p_rows": rpc_rows}).execute()
+    except Exception as e:
+        if not _rpc_missing(e):
+            logger.error("replace_history RPC FAILED user=%s: %s", user_id, e)
+            raise
+        logger.warning("replace_history absente (migration v28) user=%s, repli legacy", user_id)
+        _save_hist_legacy(user_id, payload)
+
+
+def _save_hist_legacy(user_id: str, payload: list[dict]):
+    """Delete + insert par paquets de 500. Garde une copie de secours en
+    mémoire : si l'insert échoue après le delete, on tente de restaurer
+    l'ancien historique pour éviter une perte de données."""
     client = get_client()
 
     # 1. Sauvegarde des anciennes données avant suppression
@@ -134,10 +527,8 @@ def save_hist(user_id: str, rows: list[dict]):
     # 2. Delete + re-insert avec rollback en cas d'échec
     try:
         client.table("history").delete().eq("user_id", user_id).execute()
-        if rows:
-            payload = [_row_to_supabase(user_id, r) for r in rows]
-            for i in range(0, len(payload), 500):
-                client.table("history").insert(payload[i:i + 500]).execute()
+        for i in range(0, len(payload), 500):
+            client.table("history").insert(payload[i:i + 500]).execute()
     except Exception as e:
         logger.error("save_hist FAILED user=%s: %s", user_id, e)
         try:
@@ -151,8 +542,6 @@ def save_hist(user_id: str, rows: list[dict]):
             logger.error("save_hist rollback FAILED user=%s: %s", user_id, e2)
         raise
 
-    _cache_invalidate(f"hist:{user_id}")
-
 
 def _row_to_supabase(user_id: str, r: dict) -> dict:
     date_val = r.get("Date")
@@ -170,15 +559,172 @@ def _row_to_supabase(user_id: str, r: dict) -> dict:
     }
 
 
+# ────────────────────────────────────────────────────────────
+# Import en masse de l'historique (/gestion/import)
+# ────────────────────────────────────────────────────────────
+
+_TEXT_MAX = 1000
+_IMPORT_TTL = 24 * 3600
+
+
+def normalize_hist_row(user_id: str, r) -> dict:
+    """Ligne d'un fichier importé → ligne Supabase, via `_row_to_supabase`.
+    Lève ValueError (message affichable) si la ligne est inexploitable."""
+    if not isinstance(r, dict):
+        raise ValueError("la ligne n'est pas un objet")
+    for key in ("Séance", "Exercice", "Remarque", "Muscle", "Date"):
+        value = r.get(key)
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f"{key} doit être un texte")
+        if value and len(value) > _TEXT_MAX:
+            raise ValueError(f"{key} trop long")
+    try:
+        row = _row_to_supabase(user_id, r)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError("Semaine, Série, Reps ou Poids non numérique") from None
+    if not row["exercice"]:
+        raise ValueError("Exercice manquant")
+    if row["semaine"] < 1 or row["serie"] < 1 or row["reps"] < 0:
+        raise ValueError("Semaine, Série ou Reps hors bornes")
+    if not math.isfinite(row["poids"]):
+        raise ValueError("Poids invalide")
+    if row["date"] is not None:
+        try:
+            date.fromisoformat(row["date"])
+        except ValueError:
+            raise ValueError(f"Date invalide ({row['date'][:20]})") from None
+    return row
+
+
+def import_hist_batch(user_id: str, payload: list[dict], mode: str = "replace",
+                      first: bool = False) -> dict:
+    """Écrit un paquet de lignes déjà normalisées (`normalize_hist_row`).
+
+    - replace : le premier paquet remplace tout l'historique
+      (`replace_history`, même chemin que save_hist), les suivants sont
+      ajoutés par un INSERT ;
+    - merge : upsert sur (semaine, séance, exercice, série) — RPC
+      `merge_history` (migration v29), repli Python sans la migration.
+    Retourne {"inserted": n, "updated": n}."""
+    try:
+        if mode == "merge":
+            return _merge_hist(user_id, payload)
+        if first:
+            _replace_hist(user_id, payload)
+        elif payload:
+            get_client().table("history").insert(payload).execute()
+        return {"inserted": len(payload), "updated": 0}
+    finally:
+        # Réécriture en masse : snapshot, streak et badges sont reconstruits
+        # d'une traite au prochain affichage plutôt que patchés.
+        _cache_invalidate(f"hist:{user_id}")
+        _cache_invalidate(f"agg:streak:{user_id}")
+        _cache_invalidate(f"agg:badges:{user_id}")
+        bump_data_version(user_id)
+
+
+def _hist_key(row: dict) -> tuple:
+    return (int(row["semaine"]), row["seance"], row["exercice"], int(row["serie"]))
+
+
+def _merge_hist(user_id: str, payload: list[dict]) -> dict:
+    if not payload:
+        return {"inserted": 0, "updated": 0}
+    client = get_client()
+    rpc_rows = [{k: v for k, v in row.items() if k != "user_id"} for row in payload]
+    try:
+        resp = client.rpc("merge_history", {"p_user_id": user_id, "p_rows": rpc_rows}).execute()
+    except Exception as e:
+        if not _rpc_missing(e):
+            logger.error("merge_history RPC FAILED user=%s: %s", user_id, e)
+            raise
+        logger.warning("merge_history absente (migration v29) user=%s, repli legacy", user_id)
+        return _merge_hist_legacy(user_id, payload)
+    out = resp.data or {}
+    return {"inserted": int(out.get("inserted") or 0), "updated": int(out.get("updated") or 0)}
+
+
+def _merge_hist_legacy(user_id: str, payload: list[dict]) -> dict:
+    """Sans la migration v29 : lit les clés existantes des semaines du
+    paquet, insère le paquet puis supprime les anciennes lignes remplacées.
+    Insert avant delete : un échec entre les deux laisse des doublons (qu'un
+    nouvel import fusionné résorbe), jamais une perte."""
+    client = get_client()
+    latest = {}
+    for row in payload:
+        latest[_hist_key(row)] = row  # dernier gagnant, position du premier
+    weeks = sorted({key[0] for key in latest})
+    resp = (
+        client.table("history")
+        .select("id,semaine,seance,exercice,serie")
+        .eq("user_id", user_id)
+        .in_("semaine", weeks)
+        .execute()
+    )
+    old = [r for r in resp.data or [] if _hist_key(r) in latest]
+    client.table("history").insert(list(latest.values())).execute()
+    old_ids = [r["id"] for r in old]
+    for i in range(0, len(old_ids), 200):
+        client.table("history").delete().eq("user_id", user_id).in_("id", old_ids[i:i + 200]).execute()
+    updated = len({_hist_key(r) for r in old})
+    return {"inserted": len(latest) - updated, "updated": updated}
+
+
+# Job d'import (progression + point de reprise), clé `import:{user_id}` :
+# lu par /gestion/import/status pendant l'import, et relu si le même
+# fichier est renvoyé après une interruption. Écrit aussi dans la table
+# `import_jobs` (migration v31) : le point de reprise survit à un
+# redémarrage ou une éviction du cache.
+def get_import_job(user_id: str) -> Optional[dict]:
+    key = f"import:{user_id}"
+    job = _cache_get(key)
+    if job is not None:
+        return job
+    try:
+        resp = (
+            get_client().table("import_jobs")
+            .select("job")
+            .eq("user_id", user_id)
+            .maybe_single()
+            .execute()
+        )
+    except Exception as e:
+        logger.error("import job read FAILED user=%s: %s", user_id, e)
+        return None
+    job = ((resp.data if resp else None) or {}).get("job")
+    if job is not None:
+        _cache_set(key, job, _IMPORT_TTL)
+    return job
+
+
+def save_import_job(user_id: str, job: dict) -> bool:
+    """Cache + table `import_jobs`. Retourne False si le job n'a pu être
+    gardé qu'en cache (table absente, Supabase injoignable)."""
+    _cache_set(f"import:{user_id}", job, _IMPORT_TTL)
+    try:
+        get_client().table("import_jobs").upsert({
+            "user_id": user_id,
+            "job": job,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }).execute()
+    except Exception as e:
+        logger.error("import job write FAILED user=%s: %s", user_id, e)
+        return False
+    return True
+
+
 # ────────────────────────────────────────────────────────────
 # Programme (stocké en JSON dans programs.data)
 # ────────────────────────────────────────────────────────────
 
 def get_prog(user_id: str) -> dict:
+    """Programme de l'user. Les routes modifient le dict retourné puis le
+    sauvegardent : le cache garde donc le JSON sérialisé une seule fois et
+    chaque lecture ne paie qu'un `json.loads` (plus de dumps + loads)."""
     key = f"prog:{user_id}"
     cached = _cache_get(key)
     if cached is not None:
-        return json.loads(json.dumps(cached))
+        return json.loads(cached)
 
     client = get_client()
     resp = (
@@ -189,8 +735,8 @@ def get_prog(user_id: str) -> dict:
         .execute()
     )
     data = (resp.data or {}).get("data") or {} if resp else {}
-    _cache_set(key, data)
-    return json.loads(json.dumps(data))
+    _cache_set(key, json.dumps(data))
+    return data
 
 
 def save_prog(user_id: str, prog_dict: dict):
@@ -200,6 +746,7 @@ def save_prog(user_id: str, prog_dict: dict):
         "data": prog_dict,
     }).execute()
     _cache_invalidate(f"prog:{user_id}")
+    bump_data_version(user_id)
 
 
 # ────────────────────────────────────────────────────────────
@@ -208,45 +755,60 @@ def save_prog(user_id: str, prog_dict: dict):
 
 def replace_exo_rows(user_id: str, semaine: int, seance: str, exercice: str, new_rows: list[dict]):
     """Supprime les lignes d'un (semaine, séance, exercice) précis et réinsère
-    les nouvelles lignes en une seule requête. Pas de delete-all global."""
+    les nouvelles lignes en une seule requête. Pas de delete-all global.
+    Le cache est patché en place (write-through), pas invalidé."""
     client = get_client()
-    (
-        client.table("history").delete()
-        .eq("user_id", user_id)
-        .eq("semaine", int(semaine))
-        .eq("seance", seance)
-        .eq("exercice", exercice)
-        .execute()
-    )
-    if new_rows:
-        payload = [_row_to_supabase(user_id, r) for r in new_rows]
-        client.table("history").insert(payload).execute()
-    _cache_invalidate(f"hist:{user_id}")
+    with _user_lock(user_id):
+        (
+            client.table("history").delete()
+            .eq("user_id", user_id)
+            .eq("semaine", int(semaine))
+            .eq("seance", seance)
+            .eq("exercice", exercice)
+            .execute()
+        )
+        inserted = []
+        if new_rows:
+            payload = [_row_to_supabase(user_id, r) for r in new_rows]
+            resp = client.table("history").insert(payload).execute()
+            inserted = resp.data if resp and len(resp.data or []) == len(payload) else None
+        record = _hist_patch(user_id, semaine, seance, exercice, inserted)
+        bump_data_version(user_id)
+    if record is not None:
+        _update_streak_record(user_id, record)
 
 
 def delete_exo_rows(user_id: str, semaine: int, seance: str, exercice: str):
     client = get_client()
-    (
-        client.table("history").delete()
-        .eq("user_id", user_id)
-        .eq("semaine", int(semaine))
-        .eq("seance", seance)
-        .eq("exercice", exercice)
-        .execute()
-    )
-    _cache_invalidate(f"hist:{user_id}")
+    with _user_lock(user_id):
+        (
+            client.table("history").delete()
+            .eq("user_id", user_id)
+            .eq("semaine", int(semaine))
+            .eq("seance", seance)
+            .eq("exercice", exercice)
+            .execute()
+        )
+        record = _hist_patch(user_id, semaine, seance, exercice, [])
+        bump_data_version(user_id)
+    if record is not None:
+        _update_streak_record(user_id, record)
 
 
 def delete_session_rows(user_id: str, semaine: int, seance: str):
     client = get_client()
-    (
-        client.table("history").delete()
-        .eq("user_id", user_id)
-        .eq("semaine", int(semaine))
-        .eq("seance", seance)
-        .execute()
-    )
-    _cache_invalidate(f"hist:{user_id}")
+    with _user_lock(user_id):
+        (
+            client.table("history").delete()
+            .eq("user_id", user_id)
+            .eq("semaine", int(semaine))
+            .eq("seance", seance)
+            .execute()
+        )
+        record = _hist_patch(user_id, semaine, seance, None, [])
+        bump_data_version(user_id)
+    if record is not None:
+        _update_streak_record(user_id, record)
 
 
 def mark_session_missed(user_id: str, semaine: int, seance_name: str, date_str: str):
@@ -275,14 +837,26 @@ def mark_session_missed(user_id: str, semaine: int, seance_name: str, date_str:
         "Date": date_str,
     }
     client.table("history").insert(_row_to_supabase(user_id, row)).execute()
-    _cache_invalidate(f"hist:{user_id}")
+    _hist_mark_stale(user_id)
+    bump_data_version(user_id)
 
 
 # ────────────────────────────────────────────────────────────
 # Profil (Phase 4 — onboarding)
 # ────────────────────────────────────────────────────────────
 
+# Le profil (tier VIP compris) est lu à chaque rendu de template : on le
+# garde en cache plus longtemps que hist/prog, toutes les écritures passant
+# par _profile_upsert qui remet la ligne renvoyée par Supabase en cache.
+_PROFILE_TTL = 10 * 60
+
+
 def get_profile(user_id: str) -> dict:
+    key = f"profile:{user_id}"
+    cached = _cache_get(key)
+    if cached is not None:
+        return dict(cached)
+
     client = get_client()
     resp = (
         client.table("profiles")
@@ -291,16 +865,45 @@ def get_profile(user_id: str) -> dict:
         .maybe_single()
         .execute()
     )
-    return (resp.data if resp else None) or {}
+    data = (resp.data if resp else None) or {}
+    _cache_set(key, data, _PROFILE_TTL)
+    return dict(data)
+
+
+def _profile_upsert(user_id: str, fields: dict, bump: bool = True):
+    """Upsert profiles + write-through : la ligne complète renvoyée par
+    l'upsert remplace l'entrée cache. Sans représentation → invalidation.
+
+    `bump=False` pour les champs qui ne touchent pas la version des données
+    (quota coach)."""
+    key = f"profile:{user_id}"
+    client = get_client()
+    try:
+        resp = client.table("profiles").upsert({"id": user_id, **fields}).execute()
+    except Exception:
+        _cache_invalidate(key)
+        raise
+    finally:
+        if bump:
+            bump_data_version(user_id)
+    rows = (resp.data if resp else None) or []
+    if rows and isinstance(rows[0], dict):
+        _cache_set(key, dict(rows[0]), _PROFILE_TTL)
+    else:
+        _cache_invalidate(key)
 
 
 def save_profile(user_id: str, fields: dict):
     """Upsert sur public.profiles (id = user_id). Phase 4 : doit pouvoir
     créer la row si elle n'existe pas encore (nouveau user qui passe
     l'onboarding pour la première fois)."""
-    client = get_client()
-    payload = {"id": user_id, **fields}
-    client.table("profiles").upsert(payload).execute()
+    _profile_upsert(user_id, fields)
+
+
+def save_coach_quota(user_id: str, quota_date: str, quota_count: int):
+    """Compteur quotidien du coach (sans changer la version des données)."""
+    _profile_upsert(user_id, {"coach_quota_date": quota_date, "coach_quota_count": quota_count},
+                    bump=False)
 
 
 # ────────────────────────────────────────────────────────────
@@ -326,6 +929,7 @@ def save_onboarding(user_id: str, fields: dict):
     client = get_client()
     payload = {"user_id": user_id, **fields}
     client.table("onboarding").upsert(payload).execute()
+    bump_data_version(user_id)
 
 
 # ────────────────────────────────────────────────────────────
@@ -351,6 +955,7 @@ def insert_nutrition(user_id: str, row: dict) -> None:
     client = get_client()
     payload = {"user_id": user_id, **row}
     client.table("nutrition").insert(payload).execute()
+    bump_data_version(user_id)
 
 
 def delete_nutrition(user_id: str, entry_id: int) -> None:
@@ -361,6 +966,7 @@ def delete_nutrition(user_id: str, entry_id: int) -> None:
         .eq("id", int(entry_id))
         .execute()
     )
+    bump_data_version(user_id)
 
 
 def list_all_users_with_tier() -> list[dict]:
@@ -406,8 +1012,7 @@ def set_user_tier(user_id: str, tier: str) -> None:
     """Upsert profiles.tier pour un user. tier ∈ {'free', 'vip'}."""
     if tier not in ("free", "vip"):
         raise ValueError(f"tier invalide: {tier}")
-    client = get_client()
-    client.table("profiles").upsert({"id": user_id, "tier": tier}).execute()
+    _profile_upsert(user_id, {"tier": tier})
 
 
 def list_coach_messages(user_id: str, limit: int = 50) -> list[dict]:
@@ -442,6 +1047,102 @@ def clear_coach_messages(user_id: str) -> None:
     client.table("coach_messages").delete().eq("user_id", user_id).execute()
 
 
+# ── Tour de coach : réservation du quota + fin de conversation en un appel
+# (RPC `coach_reserve_turn`, migration v27), puis les deux messages en un
+# seul INSERT. Sans la migration : repli sur l'ancien chemin (profil +
+# upsert quota + lecture des messages).
+def _profile_cache_patch(user_id: str, fields: dict):
+    """Reporte dans le profil en cache des champs écrits par une RPC."""
+    key = f"profile:{user_id}"
+    cached = _cache_get(key)
+    if cached is not None:
+        _cache_set(key, {**cached, **fields}, _PROFILE_TTL)
+
+
+def _reserve_coach_turn_legacy(user_id: str, day: str, limit: int, tail: int) -> dict:
+    profile = get_profile(user_id) or {}
+    count = int(profile.get("coach_quota_count") or 0)
+    if str(profile.get("coach_quota_date") or "") != day:
+        count = 0  # nouveau jour → reset
+    if count >= limit:
+        return {"allowed": False, "count": count, "tail": []}
+    count += 1
+    try:
+        save_coach_quota(user_id, day, count)
+    except Exception as e:
+        logger.error("coach quota save FAILED user=%s: %s", user_id, e)
+    try:
+        messages = list_coach_messages(user_id, tail)
+    except Exception as e:
+        logger.error("coach tail load FAILED user=%s: %s", user_id, e)
+        messages = []
+    return {"allowed": True, "count": count, "tail": messages}
+
+
+def reserve_coach_turn(user_id: str, day: str, limit: int, tail: int = 10) -> dict:
+    """Réserve un message du quota de `day` (atomique côté base) et renvoie
+    les `tail` derniers messages : {"allowed", "count", "tail"}.
+
+    `count` = messages utilisés ce jour-là après la réservation (ou au
+    moment du refus).
+
+    Repli legacy (lecture-modification-écriture non atomique) seulement si
+    la fonction manque (migration v27). Toute autre erreur remonte : après
+    un timeout la réservation a pu être validée côté base, la refaire par
+    l'ancien chemin compterait le message deux fois."""
+    client = get_client()
+    try:
+        resp = client.rpc("coach_reserve_turn", {
+            "p_user_id": user_id, "p_day": day, "p_limit": limit, "p_tail": tail,
+        }).execute()
+        data = resp.data if resp else None
+        if isinstance(data, list):
+            data = data[0] if data else None
+        if not isinstance(data, dict):
+            raise ValueError(f"réponse inattendue : {data!r}")
+    except Exception as e:
+        if not _rpc_missing(e):
+            logger.error("coach_reserve_turn RPC FAILED user=%s: %s", user_id, e)
+            raise
+        logger.warning("coach_reserve_turn absente (migration v27) user=%s, repli legacy", user_id)
+        return _reserve_coach_turn_legacy(user_id, day, limit, tail)
+    count = int(data.get("count") or 0)
+    _profile_cache_patch(user_id, {"coach_quota_date": day, "coach_quota_count": count})
+    return {"allowed": bool(data.get("allowed")), "count": count, "tail": list(data.get("tail") or [])}
+
+
+def release_coach_turn(user_id: str, day: str) -> None:
+    """Rend le message réservé pour `day` (appel LLM en échec). Même règle
+    de repli que reserve_coach_turn : sinon un timeout après validation
+    rendrait le message deux fois."""
+    client = get_client()
+    try:
+        resp = client.rpc("coach_release_turn", {"p_user_id": user_id, "p_day": day}).execute()
+    except Exception as e:
+        if not _rpc_missing(e):
+            logger.error("coach_release_turn RPC FAILED user=%s: %s", user_id, e)
+            raise
+        logger.warning("coach_release_turn absente (migration v27) user=%s, repli legacy", user_id)
+        profile = get_profile(user_id) or {}
+        count = int(profile.get("coach_quota_count") or 0)
+        if str(profile.get("coach_quota_date") or "") == day and count > 0:
+            save_coach_quota(user_id, day, count - 1)
+        return
+    count = resp.data if resp else None
+    if isinstance(count, int):
+        _profile_cache_patch(user_id, {"coach_quota_count": count})
+
+
+def insert_coach_turn(user_id: str, question: str, reply: str, asked_at: str, answered_at: str) -> None:
+    """Question + réponse en un seul INSERT. Les horodatages sont fixés ici
+    (un INSERT multi-lignes donnerait le même now() aux deux messages)."""
+    client = get_client()
+    client.table("coach_messages").insert([
+        {"user_id": user_id, "role": "user", "content": question, "created_at": asked_at},
+        {"user_id": user_id, "role": "assistant", "content": reply, "created_at": answered_at},
+    ]).execute()
+
+
 # ────────────────────────────────────────────────────────────
 # Admin — stats globales + fiche user
 # ────────────────────────────────────────────────────────────
@@ -540,8 +1241,7 @@ def get_user_details(user_id: str) -> dict:
 
 def reset_user_coach_quota(user_id: str) -> None:
     """Remet à 0 le quota coach IA du jour pour un user (admin)."""
-    client = get_client()
-    client.table("profiles").upsert({"id": user_id, "coach_quota_count": 0}).execute()
+    _profile_upsert(user_id, {"coach_quota_count": 0}, bump=False)
 
 
 def sum_nutrition_day(user_id: str, date_str: str) -> dict:
@@ -12,6 +12,7 @@ Contient aussi :
 - EXERCISE_SUBSTITUTIONS : remplacement si le matériel manque
 """
 import re
+from functools import lru_cache
 
 
 EXERCISES_INFO = {
@@ -1059,34 +1060,65 @@ EXERCISE_SUBSTITUTIONS = {
 
 # ── Lookup avec correspondance floue ───────────────────────────────────
 
+_EQUIPMENT_SUFFIXES = ("haltères", "haltère", "barre", "poulie", "machine",
+                       "élastique", "élastiques", "sol")
+_PAREN_RE = re.compile(r"\s*\(.*?\)")
+
+
+def _build_prefix_trie(keys):
+    """Trie caractère par caractère sur les clés en minuscules. Le marqueur
+    "" d'un nœud porte la clé d'origine ; à égalité (deux clés identiques
+    en minuscules) la première dans l'ordre du dict gagne, comme l'ancien
+    parcours linéaire."""
+    root = {}
+    for key in keys:
+        node = root
+        for ch in key.lower():
+            node = node.setdefault(ch, {})
+        node.setdefault("", key)
+    return root
+
+
+_PREFIX_TRIE = _build_prefix_trie(EXERCISES_INFO)
+
+
+def _longest_prefix_key(name_lower):
+    """Clé la plus longue dont la version minuscule préfixe `name_lower`."""
+    node = _PREFIX_TRIE
+    best = None
+    for ch in name_lower:
+        node = node.get(ch)
+        if node is None:
+            break
+        best = node.get("", best)
+    return best
+
+
+@lru_cache(maxsize=2048)
 def get_exercise_info(name):
     """Retourne la fiche d'un exercice. Essaie une correspondance exacte,
     puis supprime les parenthèses et suffixes d'équipement pour trouver
-    une fiche de base. Retourne None si rien ne correspond."""
+    une fiche de base. Retourne None si rien ne correspond.
+
+    Le plus long préfixe passe par un trie construit à l'import (plus de
+    parcours du catalogue), et les réponses sont en LRU."""
     if not name:
         return None
     # 1. Exact match
     if name in EXERCISES_INFO:
         return EXERCISES_INFO[name]
     # 2. Strip parenthetical notes: "Tractions (ou tirage vertical)" → "Tractions"
-    clean = re.sub(r"\s*\(.*?\)", "", name).strip()
+    clean = _PAREN_RE.sub("", name).strip()
     if clean in EXERCISES_INFO:
         return EXERCISES_INFO[clean]
     # 3. Strip equipment suffixes
-    for suffix in ("haltères", "haltère", "barre", "poulie", "machine",
-                    "élastique", "élastiques", "sol"):
+    for suffix in _EQUIPMENT_SUFFIXES:
         if clean.endswith(" " + suffix):
             base = clean[: -(len(suffix) + 1)].strip()
             if base in EXERCISES_INFO:
                 return EXERCISES_INFO[base]
     # 4. Longest matching prefix
-    name_lower = name.lower()
-    best_key = None
-    best_len = 0
-    for key in EXERCISES_INFO:
-        if name_lower.startswith(key.lower()) and len(key) > best_len:
-            best_key = key
-            best_len = len(key)
+    best_key = _longest_prefix_key(name.lower())
     if best_key:
         return EXERCISES_INFO[best_key]
     return None
@@ -0,0 +1,240 @@
+"""Snapshots immuables de l'historique — partagés sans copie.
+
+Avant, `core.db.get_hist` renvoyait `[dict(r) for r in cached]` à chaque
+appel parce que les routes modifiaient les lignes en place
+(`_normalize_hist`, `r["1RM"] = ...`). Pour un user à 10k+ séries cette
+copie dominait le temps de `/seance` et `/progres`.
+
+Désormais :
+  - `HistRow` : ligne en lecture seule (dict gelé, `__slots__` vide). Les
+    lectures `r["Poids"]`, `r.get(...)`, `tojson`, `json.dumps` marchent
+    comme avant, à vitesse dict native.
+  - `HistSnapshot` : tuple de `HistRow` + les ids Supabase (ordre `id`).
+    Un même snapshot est renvoyé à tous les lecteurs ; toute mutation
+    lève une TypeError.
+
+Copy-on-write explicite : un appelant qui doit modifier une ligne fait
+`dict(r)` (ou `r.copy()`), ou `r.replace(Muscle=...)` pour obtenir une
+nouvelle ligne gelée.
+"""
+
+
+class HistRow(dict):
+    """Ligne d'historique en lecture seule (clés Semaine/Séance/Exercice/…)."""
+
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("HistRow est en lecture seule — utiliser dict(r) ou r.replace(...)")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    update = pop = popitem = setdefault = clear = _readonly
+
+    def copy(self) -> dict:
+        """Copie modifiable (dict classique)."""
+        return dict(self)
+
+    def replace(self, **fields) -> "HistRow":
+        """Nouvelle ligne gelée avec certains champs remplacés."""
+        out = dict(self)
+        out.update(fields)
+        return HistRow(out)
+
+    def __reduce__(self):
+        # dict.__reduce_ex__ repasse par __setitem__ : interdit ici.
+        return (HistRow, (dict(self),))
+
+
+class HistSnapshot(tuple):
+    """Historique complet d'un user : tuple de HistRow ordonné par id.
+
+    `ids` est aligné sur les lignes (même index)."""
+
+    def __new__(cls, rows=(), ids=()):
+        self = super().__new__(cls, rows)
+        self.ids = tuple(ids)
+        return self
+
+    def __reduce__(self):
+        return (HistSnapshot, (tuple(self), self.ids))
+
+    def to_dicts(self) -> list[dict]:
+        """Copie modifiable de tout l'historique."""
+        return [dict(r) for r in self]
+
+    def attached_size(self) -> int:
+        """Octets approximatifs de ce que le snapshot porte en plus de ses
+        lignes : les ids, puis ce qui est mémorisé dessus après coup
+        (`HistoryIndex` et ses `derived`, snapshot des muscles normalisés).
+        Compté par `core.cache.approx_size` ; recalculé seulement quand ces
+        structures changent."""
+        import sys
+        from .cache import approx_size
+
+        idx = getattr(self, "_index", None)
+        norm = getattr(self, "_normalized", None)
+        out = norm[1] if norm is not None and norm[1] is not self else None
+        state = (
+            id(idx), id(out),
+            idx is not None and tuple((k, id(v), len(v) if isinstance(v, dict) else 0)
+                                      for k, v in idx.derived.items()),
+        )
+        cached = getattr(self, "_attached", None)
+        if cached is not None and cached[0] == state:
+            return cached[1]
+        size = sys.getsizeof(self.ids) + 28 * len(self.ids)  # tuple + objets int
+        if idx is not None:
+            size += idx.container_size() + approx_size(idx.derived)
+        if out is not None:
+            # Lignes inchangées partagées avec ce snapshot, clés et valeurs des
+            # lignes modifiées aussi (sauf Muscle) : seuls les dicts neufs pèsent.
+            size += sys.getsizeof(out) + out.attached_size()
+            size += sum(sys.getsizeof(r) for r, mine in zip(out, self) if r is not mine)
+        self._attached = (state, size)
+        return size
+
+
+def normalize_muscles(hist, prog):
+    """Snapshot dont la colonne Muscle suit le programme (+ fix_muscle).
+
+    Calculé une fois par (snapshot, version du mapping muscle du programme)
+    et mémorisé sur le snapshot, comme l'index. Pendant le calcul chaque
+    couple (exercice, muscle stocké) distinct n'est résolu qu'une fois, et
+    la résolution elle-même est en LRU (cf. `core.muscu.resolve_muscle`).
+    Si aucune ligne ne change, le snapshot d'origine est renvoyé tel quel.
+    """
+    import json
+    from .muscu import programme_muscle_mapping, resolve_muscle
+
+    mapping = programme_muscle_mapping(prog)
+    version = json.dumps(mapping, sort_keys=True, default=str)
+    cached = getattr(hist, "_normalized", None)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    memo = {}
+    rows = []
+    changed = False
+    for r in hist:
+        key = (r["Exercice"], r["Muscle"])
+        try:
+            muscle = memo[key]
+        except KeyError:
+            muscle = memo[key] = resolve_muscle(key[0], key[1], mapping)
+        except TypeError:
+            muscle = resolve_muscle(key[0], key[1], mapping)
+        if muscle != key[1]:
+            r = r.replace(Muscle=muscle) if isinstance(r, HistRow) else {**r, "Muscle": muscle}
+            changed = True
+        rows.append(r)
+    out = HistSnapshot(rows, getattr(hist, "ids", ())) if changed else hist
+    for snap in (hist, out):
+        try:
+            snap._normalized = (version, out)
+        except AttributeError:
+            pass
+    return out
+
+
+class HistoryIndex:
+    """Index d'un snapshot, construit une fois puis partagé.
+
+    Les helpers de `/seance` (`_exo_curr_rows`, `_best_record`,
+    `_previous_weeks_data`…) refaisaient chacun un parcours complet de
+    l'historique, cinq fois par exercice affiché. Ici, un seul parcours
+    range les lignes par clé (ordre du snapshot conservé dans chaque
+    groupe) et pré-calcule les records par exercice.
+
+    `HistoryIndex.of(snapshot)` mémorise l'index sur le snapshot lui-même :
+    tant que le cache renvoie le même snapshot, l'index n'est jamais
+    reconstruit. Il n'est pas sérialisé (cf. `HistSnapshot.__reduce__`),
+    un worker qui reçoit le snapshot d'un backend partagé le reconstruit.
+
+    `derived` est un dict libre où les blueprints mémorisent leurs propres
+    structures dérivées du snapshot (même durée de vie que l'index).
+    """
+
+    __slots__ = ("by_exo", "by_seance", "by_seance_exo", "by_week",
+                 "by_week_seance", "by_date", "best", "first_date", "max_week",
+                 "derived", "_size")
+
+    def __init__(self, rows):
+        from datetime import datetime
+        from .muscu import calc_1rm
+
+        by_exo, by_seance, by_seance_exo = {}, {}, {}
+        by_week, by_week_seance, by_date = {}, {}, {}
+        best = {}
+        for r in rows:
+            exo, seance, week = r["Exercice"], r["Séance"], r["Semaine"]
+            by_exo.setdefault(exo, []).append(r)
+            by_seance.setdefault(seance, []).append(r)
+            by_seance_exo.setdefault((seance, exo), []).append(r)
+            by_week.setdefault(week, []).append(r)
+            by_week_seance.setdefault((week, seance), []).append(r)
+            d = r.get("Date")
+            if d:
+                by_date.setdefault(d, []).append(r)
+            reps = r["Reps"]
+            if reps > 0:
+                poids = r["Poids"]
+                one_rm = calc_1rm(poids, reps)
+                b = best.get(exo)
+                if b is None:
+                    best[exo] = {"weight": poids, "one_rm": one_rm, "reps": reps}
+                else:
+                    if poids > b["weight"]:
+                        b["weight"] = poids
+                    if one_rm > b["one_rm"]:
+                        b["one_rm"] = one_rm
+                    if reps > b["reps"]:
+                        b["reps"] = reps
+
+        self.by_exo = {k: tuple(v) for k, v in by_exo.items()}
+        self.by_seance = {k: tuple(v) for k, v in by_seance.items()}
+        self.by_seance_exo = {k: tuple(v) for k, v in by_seance_exo.items()}
+        self.by_week = {k: tuple(v) for k, v in by_week.items()}
+        self.by_week_seance = {k: tuple(v) for k, v in by_week_seance.items()}
+        self.by_date = {k: tuple(v) for k, v in by_date.items()}
+        self.best = best
+        self.max_week = max(by_week, default=None)
+
+        first = None
+        for d in by_date:
+            try:
+                parsed = datetime.strptime(d, "%Y-%m-%d").date()
+            except (ValueError, TypeError):
+                continue
+            if first is None or parsed < first:
+                first = parsed
+        self.first_date = first
+        self.derived = {}
+        self._size = None
+
+    def container_size(self) -> int:
+        """Octets approximatifs des groupes et des records (hors `derived`).
+        Les groupes ne référencent que les lignes du snapshot, déjà
+        comptées avec lui : seuls les conteneurs pèsent ici."""
+        if self._size is None:
+            import sys
+            from .cache import approx_size
+
+            size = sys.getsizeof(self) + approx_size(self.best)
+            for groups in (self.by_exo, self.by_seance, self.by_seance_exo,
+                           self.by_week, self.by_week_seance, self.by_date):
+                size += sys.getsizeof(groups)
+                size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in groups.items())
+            self._size = size
+        return self._size
+
+    @classmethod
+    def of(cls, rows) -> "HistoryIndex":
+        """Index mémorisé sur le snapshot (reconstruit pour une simple liste)."""
+        idx = getattr(rows, "_index", None)
+        if idx is None:
+            idx = cls(rows)
+            try:
+                rows._index = idx
+            except AttributeError:
+                pass
+        return idx
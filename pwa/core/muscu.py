@@ -1,4 +1,6 @@
 """Logique métier muscu — extraite verbatim de app.py pour garantir le même comportement."""
+import re
+from functools import lru_cache
 
 
 def calc_1rm(weight, reps):
@@ -34,74 +36,123 @@ def get_base_name(full_name):
     return full_name.split("(")[0].strip() if "(" in full_name else full_name
 
 
+# Table de règles : (mots-clés, muscles). Un groupe s'applique dès qu'un de
+# ses mots-clés apparaît (sous-chaîne) dans le nom en minuscules.
+_MUSCLE_RULES = [
+    (["écarté", "fly", "pec deck", "butterfly", "cable crossover", "poulie croisée", "crossover"], ["Pecs"]),
+    (["dips"], ["Pecs"]),
+    (["pompe", "push-up", "pushup", "push up"], ["Pecs"]),
+    (["développé couché", "bench press", "dc haltères", "dc barre"], ["Pecs"]),
+    (["développé incliné", "di haltères", "di barre"], ["Pecs"]),
+    (["développé décliné", "dd "], ["Pecs"]),
+    (["développé"], ["Pecs"]),
+    (["traction", "pull-up", "pullup", "chin-up", "chinup", "chin up"], ["Dos"]),
+    (["tirage", "lat machine", "lat pull", "lat pulldown"], ["Dos"]),
+    (["rowing", "row", "t-bar", "barre t"], ["Dos"]),
+    (["pull-over", "pullover"], ["Dos", "Pecs"]),
+    (["hyperextension", "back extension", "good morning"], ["Dos", "Ischio-jambiers"]),
+    (["soulevé de terre", "deadlift", "sdt", "sumo"], ["Dos", "Ischio-jambiers", "Fessiers"]),
+    (["développé militaire", "overhead press", "ohp", "military press", "press assis", "press debout", "shoulder press"], ["Épaules"]),
+    (["arnold"], ["Épaules"]),
+    (["élévation latérale", "lateral raise", "élévation lat"], ["Épaules"]),
+    (["élévation frontale", "front raise", "élévation front"], ["Épaules"]),
+    (["oiseau", "reverse fly", "rear delt"], ["Épaules"]),
+    (["face pull"], ["Épaules", "Trapèzes"]),
+    (["shrug", "haussement"], ["Trapèzes"]),
+    (["upright row", "tirage menton"], ["Épaules", "Trapèzes"]),
+    (["curl marteau", "hammer curl", "marteau"], ["Biceps"]),
+    (["reverse curl", "curl inversé"], ["Biceps"]),
+    (["curl barre", "curl haltère", "curl poulie", "curl concentré", "curl incliné", "curl scott", "preacher curl", "zottman"], ["Biceps"]),
+    (["curl"], ["Biceps"]),
+    (["biceps"], ["Biceps"]),
+    (["skull crusher", "barre front", "jm press", "lying extension", "extension nuque"], ["Triceps"]),
+    (["pushdown", "tirage poulie triceps", "corde triceps", "triceps poulie", "poulie triceps"], ["Triceps"]),
+    (["kick-back triceps", "kickback triceps"], ["Triceps"]),
+    (["extension triceps", "triceps barre", "extension haltère"], ["Triceps"]),
+    (["triceps"], ["Triceps"]),
+    (["poignet", "wrist curl", "avant-bras", "forearm"], ["Avant-bras"]),
+    (["crunch", "sit-up", "situp"], ["Abdos"]),
+    (["gainage", "planche", "plank"], ["Abdos"]),
+    (["relevé de jambe", "leg raise", "hanging leg", "knee raise"], ["Abdos"]),
+    (["rotation", "twist", "russian", "oblique"], ["Abdos"]),
+    (["abdos", "abdominal", "ab "], ["Abdos"]),
+    (["roue abdos", "wheel"], ["Abdos"]),
+    (["leg extension", "extension cuisse", "extension jambe"], ["Quadriceps"]),
+    (["hack squat"], ["Quadriceps"]),
+    (["split squat", "bulgare", "bulgarian"], ["Quadriceps", "Fessiers", "Ischio-jambiers"]),
+    (["fente", "lunge", "walking lunge"], ["Quadriceps", "Fessiers", "Ischio-jambiers"]),
+    (["leg press", "presse à cuisse", "presse cuisse", "presse jambe"], ["Quadriceps", "Fessiers"]),
+    (["goblet"], ["Quadriceps", "Fessiers"]),
+    (["squat", "back squat", "front squat", "box squat"], ["Quadriceps", "Fessiers"]),
+    (["presse"], ["Quadriceps", "Fessiers"]),
+    (["leg curl", "curl jambe", "ischio", "lying leg curl", "seated leg curl", "nordic"], ["Ischio-jambiers"]),
+    (["rdl", "romanian", "roumain", "soulevé jambe tendue", "stiff leg"], ["Ischio-jambiers", "Fessiers"]),
+    (["hip thrust", "hip-thrust", "hip extension"], ["Fessiers"]),
+    (["abduction", "écartement cuisse"], ["Fessiers"]),
+    (["kickback", "kick-back", "donkey kick"], ["Fessiers", "Ischio-jambiers"]),
+    (["glute bridge", "fessier", "glute"], ["Fessiers"]),
+    (["mollet", "calf raise", "calves", "talon", "standing calf", "seated calf"], ["Mollets"]),
+    (["adducteur", "adduction poulie", "copenhagen"], ["Adducteurs"]),
+    (["squat sumo"], ["Adducteurs"]),
+    (["fente latérale"], ["Adducteurs"]),
+    (["abducteur", "abduction poulie", "clam shell", "marche latérale élastique"], ["Abducteurs"]),
+    (["machine abducteur"], ["Abducteurs"]),
+    (["machine adducteur"], ["Adducteurs"]),
+]
+
+
+def _compile_muscle_rules(rules):
+    """Compile la table en une seule regex + table mot-clé → muscles.
+
+    La regex est une alternance en lookahead `(?=(kw1|kw2|…))` : `finditer`
+    essaie chaque position du nom et renvoie le mot-clé le plus long qui y
+    commence (alternance factorisée en trie, cf. _trie_pattern). Les mots-clés
+    plus courts commençant au même endroit en sont des préfixes : chaque
+    mot-clé porte donc aussi les muscles de ses préfixes, ce qui rend le
+    résultat identique au test `any(kw in n …)` groupe par groupe."""
+    kw_muscles = {}
+    for keywords, ms in rules:
+        for kw in keywords:
+            kw_muscles.setdefault(kw, set()).update(ms)
+    closed = {
+        kw: frozenset().union(*(ms for p, ms in kw_muscles.items() if kw.startswith(p)))
+        for kw in kw_muscles
+    }
+    return re.compile(f"(?=({_trie_pattern(kw_muscles)}))"), closed
+
+
+def _trie_pattern(words):
+    """Alternance factorisée en trie (`dé(?:veloppé(?: couché)?|…)`) : un seul
+    chemin possible par caractère, et les `?` gloutons donnent le mot le
+    plus long qui commence à la position courante."""
+    trie = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node):
+        alts = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+_MUSCLE_RE, _KEYWORD_MUSCLES = _compile_muscle_rules(_MUSCLE_RULES)
+
+
+@lru_cache(maxsize=4096)
 def auto_muscles(name):
-    """Déduit les muscles à partir du nom d'exercice. Identique à app.py."""
-    n = name.lower()
+    """Déduit les muscles à partir du nom d'exercice. Identique à app.py.
+    Un seul passage de la regex compilée sur le nom ; résultat mis en cache
+    (LRU) : les mêmes noms reviennent à chaque ligne d'historique."""
     muscles = set()
-    rules = [
-        (["écarté", "fly", "pec deck", "butterfly", "cable crossover", "poulie croisée", "crossover"], ["Pecs"]),
-        (["dips"], ["Pecs"]),
-        (["pompe", "push-up", "pushup", "push up"], ["Pecs"]),
-        (["développé couché", "bench press", "dc haltères", "dc barre"], ["Pecs"]),
-        (["développé incliné", "di haltères", "di barre"], ["Pecs"]),
-        (["développé décliné", "dd "], ["Pecs"]),
-        (["développé"], ["Pecs"]),
-        (["traction", "pull-up", "pullup", "chin-up", "chinup", "chin up"], ["Dos"]),
-        (["tirage", "lat machine", "lat pull", "lat pulldown"], ["Dos"]),
-        (["rowing", "row", "t-bar", "barre t"], ["Dos"]),
-        (["pull-over", "pullover"], ["Dos", "Pecs"]),
-        (["hyperextension", "back extension", "good morning"], ["Dos", "Ischio-jambiers"]),
-        (["soulevé de terre", "deadlift", "sdt", "sumo"], ["Dos", "Ischio-jambiers", "Fessiers"]),
-        (["développé militaire", "overhead press", "ohp", "military press", "press assis", "press debout", "shoulder press"], ["Épaules"]),
-        (["arnold"], ["Épaules"]),
-        (["élévation latérale", "lateral raise", "élévation lat"], ["Épaules"]),
-        (["élévation frontale", "front raise", "élévation front"], ["Épaules"]),
-        (["oiseau", "reverse fly", "rear delt"], ["Épaules"]),
-        (["face pull"], ["Épaules", "Trapèzes"]),
-        (["shrug", "haussement"], ["Trapèzes"]),
-        (["upright row", "tirage menton"], ["Épaules", "Trapèzes"]),
-        (["curl marteau", "hammer curl", "marteau"], ["Biceps"]),
-        (["reverse curl", "curl inversé"], ["Biceps"]),
-        (["curl barre", "curl haltère", "curl poulie", "curl concentré", "curl incliné", "curl scott", "preacher curl", "zottman"], ["Biceps"]),
-        (["curl"], ["Biceps"]),
-        (["biceps"], ["Biceps"]),
-        (["skull crusher", "barre front", "jm press", "lying extension", "extension nuque"], ["Triceps"]),
-        (["pushdown", "tirage poulie triceps", "corde triceps", "triceps poulie", "poulie triceps"], ["Triceps"]),
-        (["kick-back triceps", "kickback triceps"], ["Triceps"]),
-        (["extension triceps", "triceps barre", "extension haltère"], ["Triceps"]),
-        (["triceps"], ["Triceps"]),
-        (["poignet", "wrist curl", "avant-bras", "forearm"], ["Avant-bras"]),
-        (["crunch", "sit-up", "situp"], ["Abdos"]),
-        (["gainage", "planche", "plank"], ["Abdos"]),
-        (["relevé de jambe", "leg raise", "hanging leg", "knee raise"], ["Abdos"]),
-        (["rotation", "twist", "russian", "oblique"], ["Abdos"]),
-        (["abdos", "abdominal", "ab "], ["Abdos"]),
-        (["roue abdos", "wheel"], ["Abdos"]),
-        (["leg extension", "extension cuisse", "extension jambe"], ["Quadriceps"]),
-        (["hack squat"], ["Quadriceps"]),
-        (["split squat", "bulgare", "bulgarian"], ["Quadriceps", "Fessiers", "Ischio-jambiers"]),
-        (["fente", "lunge", "walking lunge"], ["Quadriceps", "Fessiers", "Ischio-jambiers"]),
-        (["leg press", "presse à cuisse", "presse cuisse", "presse jambe"], ["Quadriceps", "Fessiers"]),
-        (["goblet"], ["Quadriceps", "Fessiers"]),
-        (["squat", "back squat", "front squat", "box squat"], ["Quadriceps", "Fessiers"]),
-        (["presse"], ["Quadriceps", "Fessiers"]),
-        (["leg curl", "curl jambe", "ischio", "lying leg curl", "seated leg curl", "nordic"], ["Ischio-jambiers"]),
-        (["rdl", "romanian", "roumain", "soulevé jambe tendue", "stiff leg"], ["Ischio-jambiers", "Fessiers"]),
-        (["hip thrust", "hip-thrust", "hip extension"], ["Fessiers"]),
-        (["abduction", "écartement cuisse"], ["Fessiers"]),
-        (["kickback", "kick-back", "donkey kick"], ["Fessiers", "Ischio-jambiers"]),
-        (["glute bridge", "fessier", "glute"], ["Fessiers"]),
-        (["mollet", "calf raise", "calves", "talon", "standing calf", "seated calf"], ["Mollets"]),
-        (["adducteur", "adduction poulie", "copenhagen"], ["Adducteurs"]),
-        (["squat sumo"], ["Adducteurs"]),
-        (["fente latérale"], ["Adducteurs"]),
-        (["abducteur", "abduction poulie", "clam shell", "marche latérale élastique"], ["Abducteurs"]),
-        (["machine abducteur"], ["Abducteurs"]),
-        (["machine adducteur"], ["Adducteurs"]),
-    ]
-    for keywords, ms in rules:
-        if any(kw in n for kw in keywords):
-            muscles.update(ms)
+    for m in _MUSCLE_RE.finditer(name.lower()):
+        muscles |= _KEYWORD_MUSCLES[m.group(1)]
     return ",".join(sorted(muscles)) if muscles else None
 
 
@@ -113,3 +164,26 @@ def fix_muscle(exercice, muscle):
             return result
         return "Autre"
     return str(muscle)
+
+
+def programme_muscle_mapping(prog):
+    """{nom d'exo: muscle} d'après les séances du programme (clés `_*` ignorées)."""
+    return {ex["name"]: ex.get("muscle", "Autre")
+            for k, exos in prog.items() if not k.startswith("_")
+            for ex in exos}
+
+
+@lru_cache(maxsize=8192)
+def _fix_muscle_cached(exercice, muscle):
+    return fix_muscle(exercice, muscle)
+
+
+def resolve_muscle(exercice, stored, mapping):
+    """Muscle affiché pour une ligne : celui du programme si l'exo (nom de
+    base) y figure, sinon la valeur stockée — puis fix_muscle."""
+    base = get_base_name(str(exercice))
+    muscle = mapping[base] if base in mapping else stored
+    try:
+        return _fix_muscle_cached(exercice, muscle)
+    except TypeError:  # valeur non hashable dans un vieux programme
+        return fix_muscle(exercice, muscle)
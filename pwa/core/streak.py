@@ -0,0 +1,96 @@
+"""Streak hebdo maintenu comme agrégat.
+
+L'accueil triait à chaque visite toutes les semaines ayant une perf pour
+compter les semaines consécutives, puis réécrivait tout le programme
+(`save_prog`) dès que le record grandissait. Ici l'état est tenu à jour par
+`core.db` à chaque écriture de l'historique (mêmes transitions que le
+snapshot en cache : chargement complet, delta, patch ciblé) et le tableau
+de bord ne fait que le lire.
+
+État (dict JSON-sérialisable, clé cache `agg:streak:{user_id}`) :
+  - `weeks`   : semaine (str) → nb de lignes « perf » (muscu avec poids ou
+                cardio avec durée) — un compteur, pour qu'une suppression
+                ne retire la semaine que si plus rien n'y reste ;
+  - `current` : semaines consécutives en partant de la plus récente active ;
+  - `record`  : meilleur streak connu (persisté dans `programs.streak_record`) ;
+  - `n`, `hwm` : nb de lignes et plus grand id du snapshot couvert — garde
+                de cohérence : un état dont l'empreinte (n, hwm) ne colle
+                pas au snapshot est reconstruit. Le nombre seul ne suffit
+                pas : un historique réécrit (save_hist, import) avec autant
+                de lignes passerait ; ses nouvelles lignes ont des ids
+                plus grands, l'empreinte change.
+
+Les semaines sont celles de la colonne `Semaine` (semaine du programme),
+comme le calcul d'origine.
+"""
+
+STATE_VERSION = 2
+
+
+def is_active(r) -> bool:
+    """Ligne qui compte pour le streak."""
+    if r["Poids"] > 0:
+        return True
+    return str(r.get("Exercice") or "").startswith("CARDIO:") and r["Reps"] > 0
+
+
+def _current(weeks) -> int:
+    streak = 0
+    prev = None
+    for w in sorted((int(w) for w in weeks), reverse=True):
+        if prev is not None and w != prev - 1:
+            break
+        streak += 1
+        prev = w
+    return streak
+
+
+def hwm(hist):
+    """Plus grand id du snapshot (ordonné par id), None sans ids."""
+    ids = getattr(hist, "ids", None)
+    return ids[-1] if ids else None
+
+
+def _finish(weeks, n, high, record) -> dict:
+    current = _current(weeks)
+    return {"v": STATE_VERSION, "n": n, "hwm": high, "weeks": weeks,
+            "current": current, "record": max(int(record or 0), current)}
+
+
+def build(hist, record=0) -> dict:
+    """État complet à partir d'un snapshot (un seul parcours)."""
+    weeks = {}
+    for r in hist:
+        if is_active(r):
+            key = str(r["Semaine"])
+            weeks[key] = weeks.get(key, 0) + 1
+    return _finish(weeks, len(hist), hwm(hist), record)
+
+
+def apply(state, removed=(), added=(), after=None) -> dict:
+    """Nouvel état après retrait/ajout de lignes (l'original n'est pas modifié).
+
+    `after` = snapshot après l'écriture (empreinte n / hwm)."""
+    weeks = dict(state["weeks"])
+    for r in removed:
+        if is_active(r):
+            key = str(r["Semaine"])
+            count = weeks.get(key, 0) - 1
+            if count > 0:
+                weeks[key] = count
+            else:
+                weeks.pop(key, None)
+    for r in added:
+        if is_active(r):
+            key = str(r["Semaine"])
+            weeks[key] = weeks.get(key, 0) + 1
+    if after is None:
+        n, high = state["n"] - len(removed) + len(added), state["hwm"]
+    else:
+        n, high = len(after), hwm(after)
+    return _finish(weeks, n, high, state["record"])
+
+
+def is_valid(state, hist) -> bool:
+    return (bool(state) and state.get("v") == STATE_VERSION
+            and state.get("n") == len(hist) and state.get("hwm") == hwm(hist))
@@ -7,27 +7,17 @@ from flask import Blueprint, render_template
 
 from datetime import date as _date, datetime as _datetime
 
-from core.data import get_hist, get_prog, get_profile, get_onboarding, sum_nutrition_day
+from core.data import (
+    get_hist, get_prog, get_profile, get_onboarding, sum_nutrition_day,
+    get_aggregate, set_aggregate, get_streak, save_streak_record,
+)
+from core import badges as badge_engine
 from core.dates import now_paris, today_paris, today_paris_str, logical_today_paris, logical_today_paris_str, monday_of, DAYS_FR, MONTHS_FR
-from core.muscu import get_base_name, fix_muscle
+from core.history import HistoryIndex, normalize_muscles
 
 bp = Blueprint("accueil", __name__)
 
 
-def _normalize_hist(rows, prog):
-    """Applique le mapping muscle via le programme + fix_muscle, comme app.py ligne 1466-1468."""
-    prog_seances = {k: v for k, v in prog.items() if not k.startswith("_")}
-    muscle_mapping = {ex["name"]: ex.get("muscle", "Autre")
-                      for s in prog_seances for ex in prog_seances[s]}
-    for r in rows:
-        base = get_base_name(r["Exercice"])
-        mapped = muscle_mapping.get(base)
-        if mapped:
-            r["Muscle"] = mapped
-        r["Muscle"] = fix_muscle(r["Exercice"], r["Muscle"])
-    return rows, prog_seances
-
-
 def _is_real_perf(row):
     """Réplique du filtre app.py 1757-1761 : une ligne 'réelle' (perf enregistrée ou SKIP)."""
     if row["Exercice"] == "SESSION":
@@ -59,56 +49,20 @@ BADGE_DEFS = [
 def _compute_badges(hist, prog, profile, planning_map, streak):
     """Retourne (badges_unlocked:set, new_unlocked:list) et persiste _badges.
 
-    Recalcule les badges à chaque visite de l'accueil. Un badge déjà obtenu
-    reste obtenu (on ne peut pas le perdre — `_badges` dans prog en garde la
-    liste). Les "new" sont ceux débloqués depuis la dernière visite.
+    Évalue les badges à chaque visite de l'accueil à partir d'agrégats
+    incrémentaux (core.badges) : seules les lignes ajoutées depuis le
+    dernier calcul sont lues. Un badge déjà obtenu reste obtenu (on ne peut
+    pas le perdre — `_badges` dans prog en garde la liste). Les "new" sont
+    ceux débloqués depuis la dernière visite.
     """
     already = set(prog.get("_badges", []) or [])
-    unlocked = set()
-
-    muscu = [r for r in hist if not _is_cardio_row(r) and r.get("Exercice") != "SESSION"]
-    muscu_real = [r for r in muscu if r.get("Reps", 0) > 0 and r.get("Poids", 0) > 0]
-    cardio = [r for r in hist if _is_cardio_row(r) and int(r.get("Reps") or 0) > 0]
-
-    # Première séance : au moins une perf réelle (muscu OU cardio)
-    if muscu_real or cardio:
-        unlocked.add("first_session")
-
-    # Séances distinctes (date, Séance) — muscu + cardio
-    distinct_sessions = {(r.get("Date"), r.get("Séance")) for r in muscu_real if r.get("Date")}
-    for r in cardio:
-        if r.get("Date"):
-            distinct_sessions.add((r.get("Date"), r.get("Séance")))
-    total_sessions_done = len(distinct_sessions)
-    if total_sessions_done >= 100:
-        unlocked.add("centurion")
-
-    # Tonnage cumulé (muscu uniquement)
-    tonnage = int(sum(r["Poids"] * r["Reps"] for r in muscu_real))
-    if tonnage >= 10_000:  unlocked.add("tonnage_10k")
-    if tonnage >= 50_000:  unlocked.add("tonnage_50k")
-    if tonnage >= 100_000: unlocked.add("tonnage_100k")
-
-    # Régulier : 4 semaines consécutives sans manquer une séance planifiée.
-    # On approxime : streak >= 4 (streak = semaines consécutives avec au moins
-    # une perf), ce qui garantit qu'il n'y a pas eu de semaine sans données.
-    if streak >= 4:
-        unlocked.add("regulier")
-
-    # Semaine complète : toutes les séances planifiées de la semaine courante
-    # ont été faites (comptées dans streak_danger → on réutilise la logique).
-    planned = [s for s in planning_map.values() if s]
-    if planned:
-        # Nombre de séances distinctes faites cette semaine
-        try:
-            s_act = max(r["Semaine"] for r in muscu_real)
-        except ValueError:
-            s_act = 0
-        if s_act:
-            done_this_week = {r["Séance"] for r in muscu_real if r["Semaine"] == s_act}
-            planned_set = {p for p in planned if p}
-            if planned_set and planned_set.issubset(done_this_week):
-                unlocked.add("full_week")
+
+    # État : cache seul (agg:badges) — absent ou évincé, il est reconstruit
+    # en un passage. Plus rien dans programs.data (migration v30).
+    state = get_aggregate("badges")
+    state, changed = badge_engine.refresh(state, hist)
+    if changed:
+        set_aggregate("badges", state)
 
     # Costaud : 1RM > poids de corps sur au moins un exercice
     poids_corps = 0.0
@@ -116,11 +70,7 @@ def _compute_badges(hist, prog, profile, planning_map, streak):
         poids_corps = float((profile or {}).get("poids_kg") or 0)
     except (TypeError, ValueError):
         poids_corps = 0.0
-    if poids_corps > 0 and muscu_real:
-        # 1RM Epley
-        max_1rm = max((r["Poids"] * (1 + r["Reps"] / 30)) for r in muscu_real)
-        if max_1rm > poids_corps:
-            unlocked.add("costaud")
+    unlocked = badge_engine.unlocked(state, planning_map, streak, poids_corps)
 
     # Union : un badge obtenu reste obtenu
     final = already | unlocked
@@ -128,6 +78,7 @@ def _compute_badges(hist, prog, profile, planning_map, streak):
 
     if final != already:
         prog["_badges"] = sorted(final)
+        prog.pop("_badge_state", None)  # ancien emplacement de l'état
         try:
             from core.data import save_prog as _save_prog
             _save_prog(prog)
@@ -140,39 +91,80 @@ def _compute_badges(hist, prog, profile, planning_map, streak):
 MAKEUP_WINDOW_DAYS = 3  # tolérance : séance du lundi faite mardi/merc/jeu = OK
 
 
-def _day_status(day_date, hist_rows, planning_map, today, joined_date=None):
-    """Statut d'une journée — porté de _day_status() app.py 1751-1784."""
+def _is_perf(row):
+    """Perf comptée pour « fait aujourd'hui » : muscu avec poids, ou cardio avec durée."""
+    return row["Poids"] > 0 or (_is_cardio_row(row) and row["Reps"] > 0)
+
+
+def _day_bucket(rows):
+    """Résumé d'une journée, calculé une fois à partir de ses seules lignes."""
+    real = [r for r in rows if _is_real_perf(r)]
+    title = cardio_label = None
+    if real:
+        cardio_rows = [r for r in real if _is_cardio_row(r)]
+        non_cardio = [r for r in real if not _is_cardio_row(r)]
+        if cardio_rows and not non_cardio:
+            cardio_label = ", ".join(sorted({r["Exercice"].split(":", 1)[1] for r in cardio_rows}))
+        else:
+            # Séance majoritaire = celle avec le plus d'exos distincts (hors cardio)
+            counts = {}
+            for r in non_cardio or real:
+                counts.setdefault(r["Séance"], set()).add(r["Exercice"])
+            title = max(counts.items(), key=lambda kv: len(kv[1]))[0]
+    perf_seances = {r.get("Séance") for r in rows if _is_perf(r)}
+    return {
+        "real": bool(real),
+        "title": title,
+        "cardio_label": cardio_label,
+        "real_seances": {r.get("Séance") for r in real},
+        "missed": any(r["Exercice"] == "SESSION" and "MANQUÉE" in (r.get("Remarque") or "")
+                      for r in rows),
+        "perf": bool(perf_seances),
+        "perf_seances": perf_seances,
+    }
+
+
+class _DayBuckets:
+    """date ISO → résumé de la journée (real / cardio / manquée / perf).
+
+    Rempli à la demande et mémorisé sur l'index du snapshot : le coût d'une
+    journée ne dépend que de ses propres lignes, pas de la taille de
+    l'historique, et n'est payé qu'une fois par snapshot."""
+
+    def __init__(self, hist):
+        idx = HistoryIndex.of(hist)
+        self._by_date = idx.by_date
+        self._memo = idx.derived.setdefault("accueil_days", {})
+
+    def __getitem__(self, d_iso):
+        bucket = self._memo.get(d_iso)
+        if bucket is None:
+            bucket = self._memo[d_iso] = _day_bucket(self._by_date.get(d_iso, ()))
+        return bucket
+
+
+def _day_status(day_date, days, planning_map, today, joined_date=None):
+    """Statut d'une journée — porté de _day_status() app.py 1751-1784.
+    `days` : _DayBuckets du snapshot."""
     d_str = day_date.strftime("%Y-%m-%d")
-    day_rows = [r for r in hist_rows if r["Date"] == d_str]
+    day = days[d_str]
     day_name_fr = DAYS_FR[day_date.weekday()]
     is_rest = day_name_fr in planning_map and not planning_map.get(day_name_fr, "")
     planned_seance = planning_map.get(day_name_fr, "") if day_name_fr in planning_map else ""
 
-    real = [r for r in day_rows if _is_real_perf(r)]
-    if real:
+    if day["real"]:
         # Si la journée ne contient que du cardio : titre dédié + couleur orange
-        cardio_rows = [r for r in real if _is_cardio_row(r)]
-        non_cardio = [r for r in real if not _is_cardio_row(r)]
-        if cardio_rows and not non_cardio:
-            types = {r["Exercice"].split(":", 1)[1] for r in cardio_rows}
-            label = ", ".join(sorted(types))
-            return {"status": "done", "title": f"Cardio · {label}", "badge": "CARDIO",
+        if day["cardio_label"] is not None:
+            return {"status": "done", "title": f"Cardio · {day['cardio_label']}", "badge": "CARDIO",
                     "color": "#d4944a", "cardio": True}
-        # Séance majoritaire = celle avec le plus d'exos distincts (hors cardio)
-        rows_for_top = non_cardio or real
-        counts = {}
-        for r in rows_for_top:
-            counts.setdefault(r["Séance"], set()).add(r["Exercice"])
-        top = max(counts.items(), key=lambda kv: len(kv[1]))[0]
-        return {"status": "done", "title": str(top), "badge": "FAIT", "color": "#5bbd8a"}
+        return {"status": "done", "title": str(day["title"]), "badge": "FAIT", "color": "#5bbd8a"}
 
     if is_rest:
         return {"status": "rest", "title": "Repos", "badge": "REPOS", "color": "#6b7280"}
 
     # Marqueur SESSION "SÉANCE MANQUÉE" explicite
-    for r in day_rows:
-        if r["Exercice"] == "SESSION" and "MANQUÉE" in (r.get("Remarque") or ""):
-            return {"status": "missed", "title": "Manquée", "badge": "MANQUÉE", "color": "#d45a5a"}
+    if day["missed"]:
+        return {"status": "missed", "title": "Manquée", "badge": "MANQUÉE", "color": "#d45a5a"}
 
     # Pour un nouveau compte : ne jamais afficher "manquée" sur des jours
     # antérieurs à l'inscription (l'user n'avait pas encore l'app).
@@ -191,13 +183,7 @@ def _day_status(day_date, hist_rows, planning_map, today, joined_date=None):
             d2_name_fr = DAYS_FR[d2.weekday()]
             if planning_map.get(d2_name_fr) == planned_seance:
                 continue  # jour où la même séance est re-planifiée → pas un rattrapage
-            d2_iso = d2.strftime("%Y-%m-%d")
-            d2_rows = [r for r in hist_rows if r["Date"] == d2_iso]
-            d2_done = any(
-                r for r in d2_rows
-                if _is_real_perf(r) and r.get("Séance") == planned_seance
-            )
-            if d2_done:
+            if planned_seance in days[d2.strftime("%Y-%m-%d")]["real_seances"]:
                 return {"status": "done", "title": planned_seance,
                         "badge": "RATTRAPÉE", "color": "#5bbd8a", "makeup": True}
 
@@ -229,7 +215,9 @@ def index():
         except ValueError:
             joined_date = None
 
-    hist, prog_seances = _normalize_hist(hist, prog)
+    # Muscle via le mapping du programme (normalisation mémorisée sur le snapshot)
+    hist = normalize_muscles(hist, prog)
+    prog_seances = {k: v for k, v in prog.items() if not k.startswith("_")}
     planning_map = prog.get("_planning", {})
 
     # « Journée logique » : entre minuit et 04h, on reste sur la veille
@@ -239,15 +227,18 @@ def index():
     day_name = DAYS_FR[today.weekday()]
     date_str = f"{today.day} {MONTHS_FR[today.month - 1]} {today.year}"
 
+    idx = HistoryIndex.of(hist)
+    days = _DayBuckets(hist)
+
     # Semaine en cours
-    s_act = max((r["Semaine"] for r in hist), default=1)
+    s_act = idx.max_week if idx.max_week is not None else 1
 
     # Grille 7 jours (lundi -> dimanche)
     monday = monday_of(today)
     week = []
     for i in range(7):
         d = monday + timedelta(days=i)
-        info = _day_status(d, hist, planning_map, today, joined_date)
+        info = _day_status(d, days, planning_map, today, joined_date)
         week.append({
             "index": i,
             "day_label": DAYS_FR[i],
@@ -258,7 +249,7 @@ def index():
         })
 
     # Stats semaine
-    cur_week = [r for r in hist if r["Semaine"] == s_act]
+    cur_week = idx.by_week.get(s_act, ())
     # Les lignes cardio (Exercice "CARDIO:*") ne doivent pas compter dans le
     # volume muscu (km × min ≠ kg × reps). Elles sont agrégées à part.
     cur_week_muscu = [r for r in cur_week if not _is_cardio_row(r)]
@@ -268,36 +259,23 @@ def index():
     sessions_done = len({r["Séance"] for r in cur_week_real})
     total_sessions = len(prog_seances)
 
-    # Streak : semaines consécutives avec au moins une perf (muscu avec poids OU cardio avec durée)
-    weeks_with_data = sorted({
-        r["Semaine"] for r in hist
-        if (r["Poids"] > 0) or (_is_cardio_row(r) and r["Reps"] > 0)
-    }, reverse=True)
-    streak = 0
-    for i, w in enumerate(weeks_with_data):
-        if i == 0 or w == weeks_with_data[i - 1] - 1:
-            streak += 1
-        else:
-            break
-
-    # Record de streak (stocké dans prog._streak_record)
-    streak_record = int(prog.get("_streak_record", 0) or 0)
-    if streak > streak_record:
-        streak_record = streak
-        prog["_streak_record"] = streak_record
-        from core.data import save_prog as _save_prog
-        _save_prog(prog)
+    # Streak : semaines consécutives avec au moins une perf (muscu avec poids
+    # OU cardio avec durée) — agrégat tenu à jour par core.db sur les writes.
+    streak_state = get_streak(hist)
+    streak = streak_state["current"]
+    streak_record = streak_state["record"]
+    # Ancien record stocké dans prog._streak_record : repris une fois dans
+    # la colonne programs.streak_record.
+    legacy_record = int(prog.get("_streak_record", 0) or 0)
+    if legacy_record > streak_record:
+        streak_record = legacy_record
+        save_streak_record(legacy_record)
 
     # Streak en danger ? (aujourd'hui est un jour de séance et pas fait)
     today_day_name = DAYS_FR[today.weekday()]
     today_seance = planning_map.get(today_day_name, "")
     today_iso = today.strftime("%Y-%m-%d")
-    today_done = any(
-        r for r in hist
-        if r["Date"] == today_iso and (
-            r["Poids"] > 0 or (_is_cardio_row(r) and r["Reps"] > 0)
-        )
-    )
+    today_done = days[today_iso]["perf"]
     # Si la séance du jour a été rattrapée récemment, on ne considère pas
     # le streak en danger (le jour est affiché comme RATTRAPÉE).
     if today_seance and not today_done:
@@ -305,13 +283,7 @@ def index():
             d_prev = today - timedelta(days=off)
             d_prev_name = DAYS_FR[d_prev.weekday()]
             if planning_map.get(d_prev_name) == today_seance:
-                d_prev_iso = d_prev.strftime("%Y-%m-%d")
-                d_prev_done = any(
-                    r for r in hist
-                    if r["Date"] == d_prev_iso and r.get("Séance") == today_seance
-                    and (r["Poids"] > 0 or (_is_cardio_row(r) and r["Reps"] > 0))
-                )
-                if d_prev_done:
+                if today_seance in days[d_prev.strftime("%Y-%m-%d")]["perf_seances"]:
                     today_done = True  # déjà couvert par un rattrapage récent
                     break
     streak_danger = bool(today_seance and not today_done and today.weekday() < 5)
@@ -326,13 +298,7 @@ def index():
         if not seance_name:
             continue
         d_iso = d.strftime("%Y-%m-%d")
-        d_done = any(
-            r for r in hist
-            if r["Date"] == d_iso and (
-                r["Poids"] > 0 or (_is_cardio_row(r) and r["Reps"] > 0)
-            )
-        )
-        if d_done:
+        if days[d_iso]["perf"]:
             continue
         # Tolérance : si cette séance a été rattrapée sur un jour précédent
         # (dans la fenêtre), on la considère couverte.
@@ -342,12 +308,7 @@ def index():
                 d_prev = d - timedelta(days=off_prev)
                 d_prev_name = DAYS_FR[d_prev.weekday()]
                 if planning_map.get(d_prev_name) == seance_name:
-                    d_prev_iso = d_prev.strftime("%Y-%m-%d")
-                    if any(
-                        r for r in hist
-                        if r["Date"] == d_prev_iso and r.get("Séance") == seance_name
-                        and (r["Poids"] > 0 or (_is_cardio_row(r) and r["Reps"] > 0))
-                    ):
+                    if seance_name in days[d_prev.strftime("%Y-%m-%d")]["perf_seances"]:
                         covered = True
                         break
             if covered:
@@ -82,6 +82,13 @@ def user_details(user_id):
     return jsonify(info)
 
 
+@bp.route("/admin/cache-stats")
+def cache_stats():
+    """Compteurs du cache de ce worker (hit rate, évictions, mémoire)."""
+    _require_admin()
+    return jsonify(core_db.cache_stats())
+
+
 @bp.route("/admin/reset-quota", methods=["POST"])
 @limiter.limit("20 per minute")
 def reset_quota():
@@ -1,23 +1,40 @@
 """Blueprint coach — assistant IA musculation via Claude Haiku.
 
-- /coach     : page chat (GET)
-- /coach/ask : endpoint JSON (POST) → appelle l'API Anthropic
+- /coach        : page chat (GET)
+- /coach/stream : endpoint SSE (POST) → tokens au fil de l'eau
+- /coach/ask    : endpoint JSON (POST) → réponse complète (anciens clients)
 
 Rate limit : 20 messages/jour/user via profiles.coach_quota_date +
 profiles.coach_quota_count (reset automatique à chaque nouveau jour).
+
+L'appel à l'API Anthropic ne tourne jamais dans le thread de la requête :
+il part dans un pool borné (`_executor`, COACH_MAX_CONCURRENT appels
+simultanés, 429 + Retry-After au-delà). Le thread de requête ne fait que
+relayer les morceaux de texte (ou attendre la réponse complète pour
+/coach/ask) ; le pool étant plafonné à la moitié des threads gunicorn
+`gthread`, une réponse lente ne bloque jamais les pages des autres users.
+ANTHROPIC_BASE_URL permet de pointer vers un faux serveur LLM en local.
 """
+import hashlib
+import json
 import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
-from flask import Blueprint, render_template, request, jsonify, redirect, url_for, g
+from flask import Blueprint, Response, render_template, request, jsonify, redirect, url_for, g
 
 from core.data import (
-    get_prog, get_hist, get_profile, save_profile, get_onboarding,
-    list_coach_messages, insert_coach_message, clear_coach_messages,
+    get_prog, get_hist, get_profile, get_onboarding,
+    list_coach_messages, clear_coach_messages, reserve_coach_turn, data_version,
+    get_aggregate, set_aggregate,
 )
 from core.dates import today_paris_str
 from core.db import _env
 from core.limiter import limiter
 from core import catalog
+from core import db as core_db
 
 logger = logging.getLogger(__name__)
 
@@ -26,8 +43,40 @@ bp = Blueprint("coach", __name__)
 DAILY_QUOTA = 10
 MODEL = "claude-haiku-4-5-20251001"
 MAX_TOKENS = 500
+LLM_TIMEOUT = 60        # s, par requête HTTP vers l'API
+TURN_TIMEOUT = 180      # s, plafond d'un tour complet côté requête
+HEARTBEAT = 15          # s, commentaire SSE pour garder la connexion ouverte
+
+
+BUSY_RETRY_AFTER = 5    # s, Retry-After quand le pool est plein
+
+
+def _env_int(name, default):
+    try:
+        return int(_env(name) or default)
+    except ValueError:
+        return default
+
+
+def _max_concurrent():
+    """COACH_MAX_CONCURRENT, plafonné à la moitié de GUNICORN_THREADS : chaque
+    tour occupe aussi un thread de requête (relais SSE ou attente de
+    /coach/ask), l'autre moitié reste aux pages."""
+    wanted = max(1, _env_int("COACH_MAX_CONCURRENT", 4))
+    return max(1, min(wanted, _env_int("GUNICORN_THREADS", 8) // 2))
+
+
+MAX_CONCURRENT = _max_concurrent()
+_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT, thread_name_prefix="coach")
+_slots = threading.BoundedSemaphore(MAX_CONCURRENT)
 
-SYSTEM_PROMPT_TMPL = (
+# Version du prompt : à incrémenter quand les gabarits ci-dessous changent
+# (invalide les contextes user mémorisés).
+PROMPT_VERSION = 2
+
+# Partie commune à tous les users (app, catalogue, règles) : construite une
+# fois par process et envoyée comme préfixe cacheable (cache_control).
+STATIC_PROMPT_TMPL = (
     "Tu es le coach IA intégré à l'application Muscu Tracker PRO (PWA Flask). "
     "Tu réponds en français, concis et pratique. Tu connais le programme, "
     "l'historique et l'app elle-même — profite de cette double connaissance.\n"
@@ -47,6 +96,16 @@ SYSTEM_PROMPT_TMPL = (
     "- Pour aider à ajouter une séance précise → lien [nom](/programme#planning) vers le planning.\n\n"
     "## CATALOGUE DES PROGRAMMES DISPONIBLES\n"
     "{catalog_list}\n\n"
+    "## RÈGLES DE FORMULATION\n"
+    "- Utilise du markdown : **gras**, listes à puce, titres avec ##.\n"
+    "- Quand tu mentionnes un programme du catalogue, fais-en un lien cliquable "
+    "[Titre du programme](/programme?apply=ID) pour que l'utilisateur puisse y aller en un clic.\n"
+    "- Quand tu suggères de consulter une section de l'app, mets un lien [nom onglet](/chemin).\n"
+    "- Reste bref : 3-6 phrases max par réponse, sauf si l'utilisateur demande un plan détaillé."
+)
+
+# Partie propre à l'user : mémorisée sur la version de ses données.
+USER_PROMPT_TMPL = (
     "## CONTEXTE UTILISATEUR\n"
     "- Prénom : {prenom}\n"
     "- Âge : {age}\n"
@@ -58,13 +117,7 @@ SYSTEM_PROMPT_TMPL = (
     "## PROGRAMME ACTUEL\n"
     "{programme_detail}\n\n"
     "## 14 DERNIÈRES SÉANCES\n"
-    "{dernieres_seances}\n\n"
-    "## RÈGLES DE FORMULATION\n"
-    "- Utilise du markdown : **gras**, listes à puce, titres avec ##.\n"
-    "- Quand tu mentionnes un programme du catalogue, fais-en un lien cliquable "
-    "[Titre du programme](/programme?apply=ID) pour que l'utilisateur puisse y aller en un clic.\n"
-    "- Quand tu suggères de consulter une section de l'app, mets un lien [nom onglet](/chemin).\n"
-    "- Reste bref : 3-6 phrases max par réponse, sauf si l'utilisateur demande un plan détaillé."
+    "{dernieres_seances}"
 )
 
 SUGGESTIONS = [
@@ -160,40 +213,262 @@ def _dernieres_seances(hist):
     return "\n".join(lines)
 
 
-def _check_and_bump_quota(profile):
-    """Retourne (allowed: bool, count_after: int, limit: int).
+_static_prompt_text = None
 
-    Reset automatique à chaque changement de jour. Si allowed, incrémente
-    déjà le compteur et le persiste avant l'appel à l'API. En cas d'échec
-    API, l'appelant doit appeler _revert_quota(profile) pour ne pas faire
-    payer un message qui n'a jamais abouti.
-    """
-    today = today_paris_str()
-    q_date = str(profile.get("coach_quota_date") or "")
-    q_count = int(profile.get("coach_quota_count") or 0)
-    if q_date != today:
-        q_count = 0  # nouveau jour → reset
-    if q_count >= DAILY_QUOTA:
-        return False, q_count, DAILY_QUOTA
-    q_count += 1
+
+def _static_prompt():
+    """Partie commune du system prompt (catalogue compris), construite une
+    fois par process — sauf si le catalogue était indisponible."""
+    global _static_prompt_text
+    if _static_prompt_text is not None:
+        return _static_prompt_text
+    catalog_list = _catalog_list_for_prompt()
+    text = STATIC_PROMPT_TMPL.format(catalog_list=catalog_list)
+    if catalog_list != "(catalogue indisponible)":
+        _static_prompt_text = text
+    return text
+
+
+def _prompt_inputs_key(profile, onboarding, prog, hist):
+    """Empreinte de ce que lit le contexte user : champs du profil et de
+    l'onboarding affichés, séances du programme + planning, historique
+    (nb de lignes + plus grand id, comme la garde du streak)."""
+    ids = getattr(hist, "ids", ())
+    raw = json.dumps([
+        {k: onboarding.get(k) for k in ("prenom", "niveau", "objectif", "equipement", "age")},
+        {k: profile.get(k) for k in ("age", "poids_kg", "taille_cm")},
+        {k: v for k, v in prog.items() if not k.startswith("_") or k == "_planning"},
+    ], sort_keys=True, default=str)
+    digest = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    return f"{len(hist)}:{ids[-1] if ids else ''}:{digest}"
+
+
+def _user_prompt():
+    """Contexte user (profil, programme, 14 dernières séances).
+
+    Mémorisé dans l'agrégat `coach_prompt` sous la version des données de
+    l'user : tant qu'aucun write n'a eu lieu, ni l'historique ni le programme
+    ne sont relus ou ré-agrégés. La version est lue avant les données : un
+    write concurrent laisse au pire un contexte plus frais que sa version.
+
+    Version changée (write sans rapport — badges, record de streak, autre
+    champ du profil — ou jeton expiré) : si l'empreinte des entrées n'a pas
+    bougé, le texte est réutilisé sans re-parcourir l'historique."""
     try:
-        save_profile({"coach_quota_date": today, "coach_quota_count": q_count})
+        version = data_version()
+        memo = get_aggregate("coach_prompt")
     except Exception as e:
-        logger.error("coach save_profile quota FAILED: %s", e)
-    return True, q_count, DAILY_QUOTA
-
+        logger.error("coach prompt memo read FAILED: %s", e)
+        version, memo = None, None
+    if memo and version and memo.get("v") == version and memo.get("p") == PROMPT_VERSION:
+        return memo["text"]
 
-def _revert_quota():
-    """Décrémente le compteur de 1 (si > 0) après un échec API."""
     try:
         profile = get_profile() or {}
-        today = today_paris_str()
-        q_date = str(profile.get("coach_quota_date") or "")
-        q_count = int(profile.get("coach_quota_count") or 0)
-        if q_date == today and q_count > 0:
-            save_profile({"coach_quota_date": today, "coach_quota_count": q_count - 1})
+        onboarding = get_onboarding() or {}
+        prog = get_prog() or {}
+        hist = get_hist() or []
+    except Exception as e:
+        logger.error("coach context load FAILED: %s", e)
+        profile, onboarding, prog, hist = {}, {}, {}, []
+        version = None  # contexte dégradé : pas mémorisé
+
+    inputs = _prompt_inputs_key(profile, onboarding, prog, hist) if version else None
+    if memo and inputs and memo.get("in") == inputs and memo.get("p") == PROMPT_VERSION:
+        _save_prompt_memo(version, inputs, memo["text"])
+        return memo["text"]
+
+    prenom = (onboarding.get("prenom") or "l'athlète").strip() or "l'athlète"
+    niveau = onboarding.get("niveau") or "non précisé"
+    objectif = onboarding.get("objectif") or "non précisé"
+    equipement = onboarding.get("equipement") or "non précisé"
+    if isinstance(equipement, list):
+        equipement = ", ".join(str(x) for x in equipement) or "non précisé"
+    age = onboarding.get("age") or profile.get("age")
+    age_str = f"{age} ans" if age else "non précisé"
+    poids = profile.get("poids_kg")
+    poids_str = f"{poids} kg" if poids else "non précisé"
+    taille = profile.get("taille_cm")
+    taille_str = f"{taille} cm" if taille else "non précisé"
+
+    text = USER_PROMPT_TMPL.format(
+        prenom=prenom,
+        age=age_str,
+        poids=poids_str,
+        taille=taille_str,
+        niveau=niveau,
+        objectif=objectif,
+        equipement=equipement,
+        programme_detail=_programme_detail(prog),
+        dernieres_seances=_dernieres_seances(hist),
+    )
+    if version:
+        _save_prompt_memo(version, inputs, text)
+    return text
+
+
+def _save_prompt_memo(version, inputs, text):
+    try:
+        set_aggregate("coach_prompt", {"v": version, "in": inputs, "p": PROMPT_VERSION, "text": text})
+    except Exception as e:
+        logger.error("coach prompt memo write FAILED: %s", e)
+
+
+def _system_blocks():
+    """System prompt en blocs : préfixe commun marqué cacheable côté API
+    (prompt caching), puis le contexte user."""
+    return [
+        {"type": "text", "text": _static_prompt(), "cache_control": {"type": "ephemeral"}},
+        {"type": "text", "text": _user_prompt()},
+    ]
+
+
+_llm = None  # (clé, base_url, client)
+_llm_lock = threading.Lock()
+
+
+def _llm_client(api_key):
+    """Client Anthropic process-wide : pool de connexions HTTP (keep-alive,
+    TLS) partagé par tous les tours. Recréé si la clé ou l'URL change."""
+    global _llm
+    base_url = _env("ANTHROPIC_BASE_URL") or None
+    current = _llm
+    if current is not None and current[0] == api_key and current[1] == base_url:
+        return current[2]
+    with _llm_lock:
+        if _llm is None or _llm[0] != api_key or _llm[1] != base_url:
+            import anthropic  # type: ignore
+
+            client = anthropic.Anthropic(
+                api_key=api_key,
+                base_url=base_url,
+                timeout=LLM_TIMEOUT,
+                max_retries=1,
+            )
+            _llm = (api_key, base_url, client)
+        return _llm[2]
+
+
+def _reserve_quota():
+    """Réserve un message du quota du jour (atomique, cf. core.db).
+
+    Retourne (allowed, count_after, limit, tail, day) : `tail` = 10 derniers
+    messages pour le contexte, `day` = jour de la réservation (à rendre via
+    core.db.release_coach_turn si l'appel API échoue)."""
+    day = today_paris_str()
+    try:
+        out = reserve_coach_turn(day, DAILY_QUOTA, 10)
     except Exception as e:
-        logger.error("coach revert_quota FAILED: %s", e)
+        # Base injoignable : on laisse passer plutôt que de bloquer le coach.
+        logger.error("coach reserve quota FAILED: %s", e)
+        out = {"allowed": True, "count": 0, "tail": []}
+    return out["allowed"], out["count"], DAILY_QUOTA, out["tail"], day
+
+
+def _release_quota(user_id, day):
+    """Rend le message réservé après un échec API (appelé depuis le pool)."""
+    try:
+        core_db.release_coach_turn(user_id, day)
+    except Exception as e:
+        logger.error("coach release quota FAILED: %s", e)
+
+
+def _llm_error_message(e):
+    """Message parlant pour l'user (détail loggé côté serveur, sans la clé)."""
+    err_type = type(e).__name__
+    err_msg = str(e)[:300]
+    logger.error("coach anthropic FAILED (%s): %s", err_type, err_msg)
+    # Messages spécifiques pour les erreurs les plus fréquentes
+    lower = err_msg.lower()
+    if "authentication" in lower or ("invalid" in lower and "api" in lower):
+        return "Clé API Anthropic invalide. Vérifie ANTHROPIC_API_KEY dans Railway."
+    if "credit" in lower or "billing" in lower or "quota" in lower:
+        return "Crédit Anthropic épuisé. Ajoute du crédit sur console.anthropic.com."
+    if "not_found" in lower or ("model" in lower and "not" in lower):
+        return f"Modèle introuvable côté API. Détail : {err_msg}"
+    return f"Erreur Anthropic ({err_type}) : {err_msg}"
+
+
+def _utc_now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class _CoachTurn:
+    """Un tour de conversation exécuté dans `_executor`.
+
+    Le thread de requête lit `events` : ("delta", texte)…, puis ("done",
+    réponse) ou ("error", message). La persistance du tour (ou le retour du
+    quota en cas d'échec) est faite par le pool, même si le client s'est
+    déconnecté entre-temps. Libère son slot de `_slots` en fin de tour.
+    """
+
+    def __init__(self, user_id, api_key, message, system, api_messages,
+                 quota_remaining, quota_limit, quota_day):
+        self.user_id = user_id
+        self.api_key = api_key
+        self.message = message
+        self.system = system
+        self.api_messages = api_messages
+        self.quota_remaining = quota_remaining
+        self.quota_limit = quota_limit
+        self.quota_day = quota_day
+        self.asked_at = _utc_now_iso()
+        self.events = queue.Queue()
+
+    def run(self):
+        try:
+            try:
+                reply = self._complete()
+            except Exception as e:
+                # L'appel API a échoué : on reverse l'incrément de quota pour
+                # ne pas faire payer un message qui n'a jamais abouti.
+                _release_quota(self.user_id, self.quota_day)
+                self.quota_remaining = min(self.quota_limit, self.quota_remaining + 1)
+                self.events.put(("error", _llm_error_message(e)))
+                return
+            # Persiste le tour de conversation (user puis assistant, un seul
+            # INSERT) pour que l'historique survive aux rechargements et aux
+            # autres sessions.
+            try:
+                core_db.insert_coach_turn(self.user_id, self.message, reply,
+                                          self.asked_at, _utc_now_iso())
+            except Exception as e:
+                logger.error("coach persist FAILED user=%s: %s", self.user_id, e)
+            self.events.put(("done", reply))
+        finally:
+            _slots.release()
+
+    def _complete(self):
+        parts = []
+        with _llm_client(self.api_key).messages.stream(
+            model=MODEL,
+            max_tokens=MAX_TOKENS,
+            system=self.system,
+            messages=self.api_messages,
+        ) as stream:
+            for text in stream.text_stream:
+                if text:
+                    parts.append(text)
+                    self.events.put(("delta", text))
+        return "".join(parts).strip() or "Désolé, je n'ai pas pu répondre."
+
+    def next_event(self, timeout):
+        """Prochain événement, None si rien pendant `timeout` secondes."""
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def result(self):
+        """Bloque jusqu'à la fin du tour : ("done", réponse) ou ("error", message)."""
+        waited = 0
+        while waited < TURN_TIMEOUT:
+            event = self.next_event(HEARTBEAT)
+            if event is None:
+                waited += HEARTBEAT
+            elif event[0] != "delta":
+                return event
+        return "error", "Le coach met trop de temps à répondre, réessaie."
 
 
 def _quota_remaining(profile):
@@ -247,132 +522,125 @@ def clear():
     return redirect(url_for("coach.index"))
 
 
-@bp.route("/coach/ask", methods=["POST"])
-@limiter.limit("30 per minute")
-def ask():
+def _start_turn():
+    """Vérifs, quota et prompt puis lancement du tour dans le pool.
+
+    Retourne (réponse d'erreur, None) ou (None, _CoachTurn)."""
     if not getattr(g, "is_vip", False):
-        return jsonify({"error": "Coach IA réservé aux membres PRO."}), 403
+        return (jsonify({"error": "Coach IA réservé aux membres PRO."}), 403), None
     payload = request.get_json(silent=True) or {}
     message = (payload.get("message") or "").strip()
     if not message:
-        return jsonify({"error": "message vide"}), 400
+        return (jsonify({"error": "message vide"}), 400), None
     if len(message) > 1500:
         message = message[:1500]
 
     # _env() strip les guillemets et `=` parasites souvent injectés par Railway
     api_key = _env("ANTHROPIC_API_KEY")
     if not api_key:
-        return jsonify({"error": "Coach IA non configuré (ANTHROPIC_API_KEY manquante)."}), 503
+        return (jsonify({"error": "Coach IA non configuré (ANTHROPIC_API_KEY manquante)."}), 503), None
 
     try:
-        import anthropic  # type: ignore
+        import anthropic  # type: ignore  # noqa: F401
     except ImportError:
-        return jsonify({"error": "Bibliothèque anthropic absente."}), 503
-
-    # Contexte utilisateur
-    try:
-        profile = get_profile() or {}
-        onboarding = get_onboarding() or {}
-        prog = get_prog() or {}
-        hist = get_hist() or []
-    except Exception as e:
-        logger.error("/coach/ask context load FAILED: %s", e)
-        profile, onboarding, prog, hist = {}, {}, {}, []
-
-    # Quota (persisté).
-    allowed, count_after, limit = _check_and_bump_quota(profile)
-    if not allowed:
-        return jsonify({
-            "error": f"Limite quotidienne atteinte : {limit}/{limit} messages utilisés aujourd'hui. Reviens demain.",
-            "quota_remaining": 0,
-            "quota_limit": limit,
-        }), 429
+        return (jsonify({"error": "Bibliothèque anthropic absente."}), 503), None
 
-    prenom = (onboarding.get("prenom") or "l'athlète").strip() or "l'athlète"
-    niveau = onboarding.get("niveau") or "non précisé"
-    objectif = onboarding.get("objectif") or "non précisé"
-    equipement = onboarding.get("equipement") or "non précisé"
-    if isinstance(equipement, list):
-        equipement = ", ".join(str(x) for x in equipement) or "non précisé"
-    age = onboarding.get("age") or profile.get("age")
-    age_str = f"{age} ans" if age else "non précisé"
-    poids = profile.get("poids_kg")
-    poids_str = f"{poids} kg" if poids else "non précisé"
-    taille = profile.get("taille_cm")
-    taille_str = f"{taille} cm" if taille else "non précisé"
-
-    system_prompt = SYSTEM_PROMPT_TMPL.format(
-        prenom=prenom,
-        age=age_str,
-        poids=poids_str,
-        taille=taille_str,
-        niveau=niveau,
-        objectif=objectif,
-        equipement=equipement,
-        programme_detail=_programme_detail(prog),
-        dernieres_seances=_dernieres_seances(hist),
-        catalog_list=_catalog_list_for_prompt(),
-    )
-
-    # Historique (10 derniers) envoyé comme contexte conversationnel
+    # Pool plein : on refuse tout de suite plutôt que d'occuper un thread.
+    if not _slots.acquire(blocking=False):
+        return (jsonify({"error": "Le coach est très sollicité, réessaie dans quelques secondes."}),
+                429, {"Retry-After": str(BUSY_RETRY_AFTER)}), None
+    submitted = False
     try:
-        history = list_coach_messages(10) or []
-    except Exception as e:
-        logger.error("/coach/ask history load FAILED: %s", e)
-        history = []
-    api_messages = [
-        {"role": m["role"], "content": m["content"]}
-        for m in history
-        if m.get("role") in ("user", "assistant") and m.get("content")
-    ]
-    api_messages.append({"role": "user", "content": message})
+        # Quota (réservé atomiquement) + 10 derniers messages, un seul appel.
+        allowed, count_after, limit, history, day = _reserve_quota()
+        if not allowed:
+            return (jsonify({
+                "error": f"Limite quotidienne atteinte : {limit}/{limit} messages utilisés aujourd'hui. Reviens demain.",
+                "quota_remaining": 0,
+                "quota_limit": limit,
+            }), 429), None
+
+        system = _system_blocks()
+
+        # Historique envoyé comme contexte conversationnel
+        api_messages = [
+            {"role": m["role"], "content": m["content"]}
+            for m in history
+            if m.get("role") in ("user", "assistant") and m.get("content")
+        ]
+        api_messages.append({"role": "user", "content": message})
+
+        turn = _CoachTurn(g.user_id, api_key, message, system, api_messages,
+                          max(0, limit - count_after), limit, day)
+        _executor.submit(turn.run)
+        submitted = True
+        return None, turn
+    finally:
+        if not submitted:
+            _slots.release()
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@bp.route("/coach/stream", methods=["POST"])
+@limiter.limit("30 per minute")
+def stream():
+    """Tour de coach en Server-Sent Events.
+
+    `delta` ({text}) au fil de la génération, puis `done` ({reply,
+    quota_remaining, quota_limit}) ou `error` ({error}). Les refus (VIP,
+    quota, pool plein…) restent des réponses JSON avec leur code HTTP."""
+    error, turn = _start_turn()
+    if error is not None:
+        return error
+
+    def events():
+        waited = 0
+        while waited < TURN_TIMEOUT:
+            event = turn.next_event(HEARTBEAT)
+            if event is None:
+                waited += HEARTBEAT
+                yield ": ping\n\n"
+                continue
+            waited = 0
+            kind, value = event
+            if kind == "delta":
+                yield _sse("delta", {"text": value})
+                continue
+            if kind == "done":
+                yield _sse("done", {"reply": value, "quota_remaining": turn.quota_remaining,
+                                    "quota_limit": turn.quota_limit})
+            else:
+                yield _sse("error", {"error": value, "quota_remaining": turn.quota_remaining,
+                                     "quota_limit": turn.quota_limit})
+            return
+        yield _sse("error", {"error": "Le coach met trop de temps à répondre, réessaie."})
+
+    return Response(events(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # pas de bufferisation par le proxy
+    })
 
-    try:
-        client = anthropic.Anthropic(api_key=api_key)
-        response = client.messages.create(
-            model=MODEL,
-            max_tokens=MAX_TOKENS,
-            system=system_prompt,
-            messages=api_messages,
-        )
-        # Concatène les blocs text (Anthropic renvoie une liste de content blocks)
-        reply_parts = []
-        for block in response.content or []:
-            text = getattr(block, "text", None)
-            if text:
-                reply_parts.append(text)
-        reply = "\n".join(reply_parts).strip() or "Désolé, je n'ai pas pu répondre."
-    except Exception as e:
-        # L'appel API a échoué : on reverse l'incrément de quota pour ne pas
-        # faire payer un message qui n'a jamais abouti.
-        _revert_quota()
-        # On log le détail côté serveur et on renvoie un message parlant au
-        # client pour faciliter le debug (sans fuiter la clé API).
-        err_type = type(e).__name__
-        err_msg = str(e)[:300]
-        logger.error("/coach/ask anthropic FAILED (%s): %s", err_type, err_msg)
-        # Messages spécifiques pour les erreurs les plus fréquentes
-        lower = err_msg.lower()
-        if "authentication" in lower or ("invalid" in lower and "api" in lower):
-            user_msg = "Clé API Anthropic invalide. Vérifie ANTHROPIC_API_KEY dans Railway."
-        elif "credit" in lower or "billing" in lower or "quota" in lower:
-            user_msg = "Crédit Anthropic épuisé. Ajoute du crédit sur console.anthropic.com."
-        elif "not_found" in lower or ("model" in lower and "not" in lower):
-            user_msg = f"Modèle introuvable côté API. Détail : {err_msg}"
-        else:
-            user_msg = f"Erreur Anthropic ({err_type}) : {err_msg}"
-        return jsonify({"error": user_msg}), 502
-
-    # Persiste le tour de conversation (user puis assistant) pour que
-    # l'historique survive aux rechargements et aux autres sessions.
-    try:
-        insert_coach_message("user", message)
-        insert_coach_message("assistant", reply)
-    except Exception as e:
-        logger.error("/coach/ask persist FAILED: %s", e)
 
+@bp.route("/coach/ask", methods=["POST"])
+@limiter.limit("30 per minute")
+def ask():
+    """Tour de coach en JSON (anciens clients, le front utilise /coach/stream).
+
+    Même admission que le flux (`_start_turn` : slot de `_slots` pris avant
+    tout, 429 + Retry-After si le pool est plein) : le thread de requête
+    n'attend `turn.result()` que pour un tour qui a déjà son slot, donc au
+    plus COACH_MAX_CONCURRENT threads en attente, jamais tous."""
+    error, turn = _start_turn()
+    if error is not None:
+        return error
+    kind, value = turn.result()
+    if kind == "error":
+        return jsonify({"error": value}), 502
     return jsonify({
-        "reply": reply,
-        "quota_remaining": max(0, limit - count_after),
-        "quota_limit": limit,
+        "reply": value,
+        "quota_remaining": turn.quota_remaining,
+        "quota_limit": turn.quota_limit,
     })
@@ -4,13 +4,22 @@ Le planning et le CRUD du programme sont déjà gérés dans /programme.
 Cette page regroupe : paramètres d'affichage, auto-assignation des muscles,
 reset soft, reset total, vider l'archive.
 """
-import json
+import hashlib
+import logging
+import time
 from datetime import date
 
-from flask import Blueprint, render_template, request, redirect, url_for, session, jsonify, Response, g
+from flask import (Blueprint, render_template, request, redirect, url_for, session, jsonify,
+                   Response, g, stream_with_context)
 
-from core.data import get_hist, get_prog, save_prog, save_hist, get_profile, get_onboarding
+from core import backup
+from core.data import (
+    get_hist, iter_hist, get_prog, save_prog, save_hist, get_profile, get_onboarding,
+    normalize_hist_row, import_hist_batch, get_import_job, save_import_job,
+)
 from core.limiter import limiter
+
+logger = logging.getLogger(__name__)
 bp = Blueprint("gestion", __name__)
 
 DEFAULT_SETTINGS = {
@@ -45,6 +54,7 @@ def gestion():
     nb_exos = sum(len(prog[k]) for k in prog if not k.startswith("_"))
     nb_hist = len(hist)
     nb_archive = len(prog.get("_archive", []))
+    import_job = get_import_job() if request.args.get("import") else None
 
     return render_template(
         "gestion.html",
@@ -54,6 +64,7 @@ def gestion():
         nb_exos=nb_exos,
         nb_hist=nb_hist,
         nb_archive=nb_archive,
+        import_job=import_job,
     )
 
 
@@ -154,48 +165,188 @@ def reset_total():
 
 @bp.route("/gestion/export")
 def export_data():
-    """Exporte toutes les données utilisateur en JSON (VIP uniquement)."""
+    """Exporte toutes les données utilisateur (VIP uniquement), en flux.
+
+    `?format=ndjson` : une ligne d'en-tête puis une ligne par série ;
+    `?format=compact` : colonnes compressées (toujours `.gz`) ;
+    `?gzip=1` : fichier `.gz`. Sans `gzip=1`, le flux est tout de même
+    compressé en transit si le client accepte gzip (`_compress` ne touche
+    pas aux réponses streamées). L'historique est lu par pages : la mémoire
+    ne grandit pas avec sa longueur (cf. core.backup)."""
     if not getattr(g, "is_vip", False):
         return render_template("vip_wall.html", active="plus", feature="Export complet"), 403
+    fmt = request.args.get("format", "json")
+    if fmt not in backup.FORMATS:
+        fmt = "json"
+    as_gz = request.args.get("gzip") == "1"
     prog = get_prog()
-    hist = get_hist()
     profile = get_profile() or {}
     onboarding = get_onboarding() or {}
-    payload = {
-        "version": 1,
+    meta = {
+        "version": backup.EXPORT_VERSION,
         "exported_at": date.today().isoformat(),
-        "programme": prog,
-        "historique": hist,
+        "programme": {k: v for k, v in prog.items() if k != "_badge_state"},
         "profil": {k: v for k, v in profile.items() if k != "id"},
         "onboarding": {k: v for k, v in onboarding.items() if k not in ("user_id", "id")},
     }
-    filename = f"muscu-tracker-backup-{date.today().isoformat()}.json"
-    return Response(
-        json.dumps(payload, ensure_ascii=False, indent=2),
-        mimetype="application/json",
-        headers={"Content-Disposition": f"attachment; filename={filename}"},
-    )
+    pages = iter_hist()
+
+    def generate():
+        try:
+            yield from backup.stream(meta, pages, fmt)
+        except Exception as e:
+            # En-têtes déjà partis : on ne peut que couper le flux → fichier
+            # tronqué (JSON invalide), que l'import refusera.
+            logger.error("export FAILED user=%s: %s", g.user_id, e)
+
+    chunks = stream_with_context(generate())
+    filename = f"muscu-tracker-backup-{meta['exported_at']}.{fmt}"
+    headers = {"Cache-Control": "no-store"}
+    mimetype = "application/x-ndjson" if fmt == "ndjson" else "application/json"
+    if fmt == "compact":
+        filename += ".gz"
+        mimetype = "application/gzip"  # déjà gzippé par core.backup
+    elif as_gz:
+        filename += ".gz"
+        mimetype = "application/gzip"
+        chunks = backup.gzip_chunks(chunks)
+    elif request.accept_encodings["gzip"] > 0:
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+        chunks = backup.gzip_chunks(chunks)
+    headers["Content-Disposition"] = f"attachment; filename={filename}"
+    return Response(chunks, mimetype=mimetype, headers=headers)
+
+
+IMPORT_BATCH = 500
+IMPORT_MAX_ROWS = 200_000
+_IMPORT_STALE = 5 * 60  # un job "running" muet depuis plus longtemps est mort
+
+
+def _scan_upload(stream):
+    """Passe 1 : lit tout le fichier, valide chaque série, n'écrit rien.
+
+    Retourne (digest, meta, has_hist, total, errors) — errors = [(n° de
+    série, message)], 5 au plus."""
+    hasher = hashlib.sha256()
+    meta, has_hist, total, errors = {}, False, 0, []
+    for event in backup.read(backup.file_chunks(stream, hasher)):
+        if event[0] == "meta":
+            if event[1] == "programme":
+                meta["programme"] = event[2]
+        elif event[0] == "hist":
+            has_hist = True
+        else:
+            total += 1
+            if total > IMPORT_MAX_ROWS:
+                raise backup.BackupFormatError(f"plus de {IMPORT_MAX_ROWS} séries")
+            try:
+                normalize_hist_row(event[1])
+            except ValueError as e:
+                if len(errors) < 5:
+                    errors.append((total, str(e)))
+    return hasher.hexdigest(), meta, has_hist, total, errors
+
+
+def _write_rows(stream, job):
+    """Passe 2 : relit le fichier et écrit l'historique par paquets de
+    IMPORT_BATCH, en sautant les `job["done"]` premières séries (reprise).
+    Le job est enregistré après chaque paquet (progression)."""
+    skip = job["done"]
+    first = job["mode"] == "replace" and skip == 0
+    batch = []
+
+    def flush():
+        nonlocal first
+        res = import_hist_batch(batch, job["mode"], first)
+        first = False
+        job["done"] += len(batch)
+        job["inserted"] += res["inserted"]
+        job["updated"] += res["updated"]
+        job["updated_at"] = time.time()
+        save_import_job(job)
+        batch.clear()
+
+    n = 0
+    for event in backup.read(backup.file_chunks(stream)):
+        if event[0] != "row":
+            continue
+        n += 1
+        if n <= skip:
+            continue
+        batch.append(normalize_hist_row(event[1]))
+        if len(batch) >= IMPORT_BATCH:
+            flush()
+    if batch or first:
+        flush()  # replace sans aucune série : vide quand même l'historique
 
 
 @bp.route("/gestion/import", methods=["POST"])
 @limiter.limit("5 per minute")
 def import_data():
-    """Importe des données depuis un fichier JSON (VIP uniquement)."""
+    """Importe une sauvegarde (JSON ou NDJSON, éventuellement gzippée — VIP
+    uniquement), en flux.
+
+    Passe 1 : validation complète sans rien écrire — un fichier invalide est
+    refusé avant de toucher aux données. Passe 2 : écriture par paquets
+    (core.db.import_hist_batch), progression lisible sur
+    /gestion/import/status. Si l'écriture s'interrompt, renvoyer le même
+    fichier (même mode) reprend après la dernière série écrite.
+
+    `mode=replace` (défaut) : programme + historique remplacés.
+    `mode=merge` : historique fusionné sur (semaine, séance, exercice,
+    série), programme inchangé."""
     if not getattr(g, "is_vip", False):
         return render_template("vip_wall.html", active="plus", feature="Import complet"), 403
     f = request.files.get("file")
     if not f:
         return redirect(url_for("gestion.gestion") + "?import=error")
+    mode = "merge" if request.form.get("mode") == "merge" else "replace"
+    user_id = g.user_id
     try:
-        data = json.loads(f.read().decode("utf-8"))
-    except (json.JSONDecodeError, UnicodeDecodeError):
+        digest, meta, has_hist, total, errors = _scan_upload(f.stream)
+    except backup.BackupFormatError as e:
+        logger.info("import refusé user=%s: %s", user_id, e)
         return redirect(url_for("gestion.gestion") + "?import=error")
+    if errors:
+        save_import_job({"status": "invalid", "mode": mode, "total": total,
+                         "errors": [f"série {i} : {msg}" for i, msg in errors]})
+        return redirect(url_for("gestion.gestion") + "?import=invalid")
 
-    if "programme" in data:
-        save_prog(data["programme"])
-    if "historique" in data:
-        save_hist(data["historique"])
+    job = get_import_job() or {}
+    if (job.get("status") == "running"
+            and time.time() - job.get("updated_at", 0) < _IMPORT_STALE):
+        return redirect(url_for("gestion.gestion") + "?import=busy")
+    resume = (job.get("status") in ("running", "failed") and job.get("digest") == digest
+              and job.get("mode") == mode and 0 < job.get("done", 0) < total)
+    if not resume:
+        job = {"digest": digest, "mode": mode, "total": total, "done": 0,
+               "inserted": 0, "updated": 0, "started_at": time.time()}
+    job.update(status="running", updated_at=time.time())
+    save_import_job(job)
+
+    try:
+        if mode == "replace" and isinstance(meta.get("programme"), dict):
+            # État des badges propre au compte (ids d'historique) : jamais importé.
+            meta["programme"].pop("_badge_state", None)
+            save_prog(meta["programme"])
+        if has_hist:
+            f.stream.seek(0)
+            _write_rows(f.stream, job)
+    except Exception as e:
+        logger.error("import FAILED user=%s done=%d/%d: %s", user_id, job["done"], total, e)
+        job.update(status="failed", updated_at=time.time())
+        save_import_job(job)
+        return redirect(url_for("gestion.gestion") + "?import=resume")
 
+    job.update(status="done", updated_at=time.time())
+    save_import_job(job)
+    logger.info("import ok user=%s mode=%s rows=%d (reprise=%s)", user_id, mode, total, resume)
     return redirect(url_for("gestion.gestion") + "?import=ok")
 
 
+@bp.route("/gestion/import/status")
+def import_status():
+    """Progression du dernier import (sondé par la page pendant l'envoi)."""
+    job = get_import_job() or {"status": "none"}
+    return jsonify({k: v for k, v in job.items() if k != "digest"})
@@ -183,10 +183,12 @@ def programme():
             "error.html", code=503,
             message="Impossible de charger le programme. Vérifie ta connexion.",
         ), 503
+    before = json.dumps(prog, sort_keys=True, default=str)
     _ensure_planning(prog)
     programmes, seance_prog = _ensure_programmes(prog)
     profiles, active_profile = _ensure_profiles(prog)
-    save_prog(prog)  # persiste la migration si c'était la première fois
+    if json.dumps(prog, sort_keys=True, default=str) != before:
+        save_prog(prog)  # persiste la migration si c'était la première fois
     seances = _seance_items(prog)
 
     current_origin = prog.get("_origin")
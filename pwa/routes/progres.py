@@ -3,15 +3,17 @@
 Logique portée depuis app.py body_map_section (863-1299) et tab_st (2681-2713).
 """
 import calendar
+import json
 import logging
 from datetime import date, timedelta
 
-from flask import Blueprint, render_template, request, g
+from flask import Blueprint, render_template, request, g, abort, jsonify
 
 from core.data import get_hist, get_prog, get_onboarding
 from core.dates import today_paris, DAYS_FR
-from core.muscu import calc_1rm, get_base_name, fix_muscle, get_rep_estimations, get_rep_table
+from core.muscu import calc_1rm, get_rep_estimations, get_rep_table, programme_muscle_mapping, resolve_muscle
 from core.body_map import get_body_polygons
+from core.history import HistoryIndex, normalize_muscles
 
 logger = logging.getLogger(__name__)
 
@@ -69,17 +71,15 @@ def _sid(m):
 
 
 def _normalize(hist, prog):
-    prog_seances = {k: v for k, v in prog.items() if not k.startswith("_")}
-    muscle_mapping = {ex["name"]: ex.get("muscle", "Autre")
-                      for s in prog_seances for ex in prog_seances[s]}
-    for r in hist:
-        base = get_base_name(r["Exercice"])
-        if base in muscle_mapping:
-            r["Muscle"] = muscle_mapping[base]
-        r["Muscle"] = fix_muscle(r["Exercice"], r["Muscle"])
-    # Ajoute l'archive si présente
-    archive = prog.get("_archive", [])
-    for a in archive:
+    """Retourne (snapshot aux muscles normalisés, lignes d'archive).
+
+    Le snapshot d'origine est réutilisé tel quel (index compris) si aucun
+    muscle ne change ; l'archive est renvoyée à part, sans Date."""
+    muscle_mapping = programme_muscle_mapping(prog)
+    hist = normalize_muscles(hist, prog)
+    # Archive si présente
+    archive = []
+    for a in prog.get("_archive", []):
         try:
             a_reps = int(float(a.get("Reps", 0) or 0))
             a_poids = float(a.get("Poids", 0) or 0)
@@ -88,60 +88,132 @@ def _normalize(hist, prog):
             continue
         if a_reps <= 0:
             continue
-        base = get_base_name(str(a.get("Exercice", "")))
-        muscle = muscle_mapping.get(base, a.get("Muscle", "")) or ""
-        muscle = fix_muscle(a.get("Exercice", ""), muscle)
-        hist.append({
+        muscle = resolve_muscle(a.get("Exercice", ""), a.get("Muscle", ""), muscle_mapping)
+        archive.append({
             "Semaine": a_sem, "Séance": "", "Exercice": str(a.get("Exercice", "")),
             "Série": 0, "Reps": a_reps, "Poids": a_poids,
             "Remarque": "", "Muscle": muscle, "Date": "",
         })
-    return hist
+    return hist, archive
 
 
-def _muscle_rows(df, m):
-    return [r for r in df if m in (r.get("Muscle") or "")]
+def _is_cardio(r):
+    return str(r.get("Exercice") or "").startswith("CARDIO:")
 
 
-def _build_muscle_data(df_p):
+class _ProgressCube:
+    """Agrégats (muscle, semaine, exercice) des perfs muscu, en un passage.
+
+    `_build_muscle_data` et `_build_volume_map` filtraient toutes les lignes
+    une fois par muscle (test de sous-chaîne sur `Muscle`). Ici chaque ligne
+    (Reps > 0, hors cardio, archive comprise) est rangée une fois dans les
+    cellules de ses muscles :
+
+      cells[muscle][semaine][exercice] = {
+          "rm", "rm_w", "rm_r", "rm_pos" : meilleur 1RM et sa série,
+          "w", "w_r", "w_pos"            : série la plus lourde,
+          "sets", "vol"                  : nb de séries, tonnage,
+          "pos", "ppos"                  : 1re série, 1re série à 1RM > 0 (ou None),
+      }
+      day_sets[muscle][date] = séries datées hors SESSION (carte de volume).
+
+    Les `*_pos` (rang de la ligne dans l'historique) départagent les
+    égalités comme le faisaient les `max()` sur les listes de lignes.
+    Mémorisé sur l'index du snapshot (`derived`), par version de l'archive.
+    """
+
+    __slots__ = ("cells", "day_sets")
+
+    def __init__(self, rows):
+        cells, day_sets, matches = {}, {}, {}
+        for pos, r in enumerate(rows):
+            reps = r["Reps"]
+            if reps <= 0:
+                continue
+            muscle = r.get("Muscle") or ""
+            ms = matches.get(muscle)
+            if ms is None:
+                ms = matches[muscle] = tuple(m for m in MUSCLES if m in muscle)
+            if not ms:
+                continue
+            exo, week, poids = r["Exercice"], r["Semaine"], r["Poids"]
+            one_rm = calc_1rm(poids, reps)
+            d = r.get("Date", "") if exo != "SESSION" else ""
+            for m in ms:
+                by_exo = cells.setdefault(m, {}).setdefault(week, {})
+                c = by_exo.get(exo)
+                if c is None:
+                    by_exo[exo] = {"rm": one_rm, "rm_w": poids, "rm_r": reps, "rm_pos": pos,
+                                   "w": poids, "w_r": reps, "w_pos": pos,
+                                   "sets": 1, "vol": poids * reps, "pos": pos,
+                                   "ppos": pos if one_rm > 0 else None}
+                else:
+                    if one_rm > c["rm"]:
+                        c["rm"], c["rm_w"], c["rm_r"], c["rm_pos"] = one_rm, poids, reps, pos
+                    if poids > c["w"]:
+                        c["w"], c["w_r"], c["w_pos"] = poids, reps, pos
+                    c["sets"] += 1
+                    c["vol"] += poids * reps
+                    if c["ppos"] is None and one_rm > 0:
+                        c["ppos"] = pos
+                if d:
+                    per_day = day_sets.setdefault(m, {})
+                    per_day[d] = per_day.get(d, 0) + 1
+        self.cells = cells
+        self.day_sets = day_sets
+
+    @classmethod
+    def of(cls, idx, snap, archive):
+        """Cube mémorisé sur l'index du snapshot (recalculé si l'archive change)."""
+        version = json.dumps(archive, sort_keys=True, default=str)
+        cached = idx.derived.get("progres_cube")
+        if cached is None or cached[0] != version:
+            rows = [r for r in snap if not _is_cardio(r)] + archive
+            cached = idx.derived["progres_cube"] = (version, cls(rows))
+        return cached[1]
+
+
+def _best_cell(cells, value, pos):
+    """Cellule au plus grand `value`, la plus ancienne en cas d'égalité."""
+    return min(cells, key=lambda c: (-c[value], c[pos]))
+
+
+def _build_muscle_data(cube):
     out = {}
     for m, info in MUSCLES.items():
-        md = _muscle_rows(df_p, m)
-        md_valid = [r for r in md if r["Reps"] > 0]
+        weeks = cube.cells.get(m, {})
+        all_cells = [c for exos in weeks.values() for c in exos.values()]
 
-        rm_max = max((r["1RM"] for r in md_valid), default=0)
+        rm_max = max((c["rm"] for c in all_cells), default=0)
         pct = min((rm_max / info["std"]) * 100, 120) if info["std"] > 0 else 0
 
         best_w, best_r = 0, 0
         last_sessions, top_exos, evo = [], [], []
 
-        if md_valid:
-            best = max(md_valid, key=lambda r: r["1RM"])
-            best_w = float(best["Poids"])
-            best_r = int(best["Reps"])
+        if all_cells:
+            best = _best_cell(all_cells, "rm", "rm_pos")
+            best_w = float(best["rm_w"])
+            best_r = int(best["rm_r"])
 
             # 4 dernières semaines (PR hebdo = set avec le plus gros poids)
-            by_week = {}
-            for r in md_valid:
-                by_week.setdefault(r["Semaine"], []).append(r)
-            for wk in sorted(by_week.keys(), reverse=True)[:4]:
-                wk_rows = by_week[wk]
-                br = max(wk_rows, key=lambda r: r["Poids"])
-                last_sessions.append({"s": int(wk), "w": float(br["Poids"]), "r": int(br["Reps"])})
-
-            # Top 4 exos par 1RM
+            for wk in sorted(weeks.keys(), reverse=True)[:4]:
+                br = _best_cell(weeks[wk].values(), "w", "w_pos")
+                last_sessions.append({"s": int(wk), "w": float(br["w"]), "r": int(br["w_r"])})
+
+            # Top 4 exos par 1RM (ordre de 1re apparition avant tri)
             by_exo = {}
-            for r in md_valid:
-                by_exo.setdefault(r["Exercice"], []).append(r)
+            for exos in weeks.values():
+                for name, c in exos.items():
+                    by_exo.setdefault(name, []).append(c)
             exos_tmp = []
-            for name, grp in by_exo.items():
-                br = max(grp, key=lambda r: r["1RM"])
-                exos_tmp.append({"name": str(name), "w": float(br["Poids"]), "r": int(br["Reps"])})
+            for name, grp in sorted(by_exo.items(), key=lambda kv: min(c["pos"] for c in kv[1])):
+                br = _best_cell(grp, "rm", "rm_pos")
+                exos_tmp.append({"name": str(name), "w": float(br["rm_w"]), "r": int(br["rm_r"])})
             top_exos = sorted(exos_tmp, key=lambda e: e["w"] * (1 + e["r"] / 30), reverse=True)[:4]
 
             # Évolution 1RM par semaine
-            for wk in sorted(by_week.keys()):
-                best_rm = max(r["1RM"] for r in by_week[wk])
+            for wk in sorted(weeks.keys()):
+                best_rm = max(c["rm"] for c in weeks[wk].values())
                 evo.append({"w": int(wk), "r": round(float(best_rm), 1)})
 
         out[m] = {
@@ -159,6 +231,24 @@ def _build_muscle_data(df_p):
     return out
 
 
+def _build_podium(cube, selected_muscles):
+    """Hall of Fame : top 3 exercices par 1RM sur les muscles sélectionnés."""
+    by_exo = {}
+    for m in dict.fromkeys(selected_muscles):
+        for exos in cube.cells.get(m, {}).values():
+            for name, c in exos.items():
+                if c["ppos"] is None:
+                    continue  # aucun 1RM > 0
+                cur = by_exo.get(name)
+                if cur is None:
+                    by_exo[name] = [c["rm"], c["ppos"]]
+                else:
+                    cur[0] = max(cur[0], c["rm"])
+                    cur[1] = min(cur[1], c["ppos"])
+    ranked = sorted(by_exo.items(), key=lambda kv: kv[1][1])
+    return sorted(((name, v[0]) for name, v in ranked), key=lambda kv: kv[1], reverse=True)[:3]
+
+
 def _parse_iso_date(s):
     try:
         return date.fromisoformat(str(s))
@@ -166,20 +256,19 @@ def _parse_iso_date(s):
         return None
 
 
-def _compute_start_monday(rows, prog=None):
+def _compute_start_monday(idx, prog=None):
     """Lundi de la semaine de début du programme.
-    Utilise _started_at du programme si dispo, sinon 1ère séance trackée."""
+    Utilise _started_at du programme si dispo, sinon 1ère séance trackée
+    (date la plus ancienne de l'index)."""
     if prog:
         started = prog.get("_started_at")
         if started:
             d = _parse_iso_date(started)
             if d:
                 return d - timedelta(days=d.weekday())
-    dates = [_parse_iso_date(r.get("Date")) for r in rows]
-    dates = [d for d in dates if d is not None]
-    if not dates:
+    first = idx.first_date
+    if first is None:
         return None
-    first = min(dates)
     return first - timedelta(days=first.weekday())
 
 
@@ -247,24 +336,19 @@ def _build_cardio_stats(cardio_rows, start_monday):
     }
 
 
-def _build_volume_map(hist, period_days=7):
+def _build_volume_map(cube, period_days=7):
     """Calcule le volume (total séries) par muscle pour une période donnée.
     Retourne {muscle: {sets, vol_pct, color, last_date}} pour la carte du corps."""
     today = today_paris()
     cutoff = (today - timedelta(days=period_days)).isoformat()
 
-    period_rows = [r for r in hist
-                   if r.get("Date", "") >= cutoff
-                   and r["Reps"] > 0 and r["Exercice"] != "SESSION"]
-
-    # Comptage séries par muscle
+    # Comptage séries par muscle (dates ISO : comparaison de chaînes)
     muscle_sets = {}
     muscle_last = {}
-    for r in period_rows:
-        for m in MUSCLES:
-            if m in (r.get("Muscle") or ""):
-                muscle_sets[m] = muscle_sets.get(m, 0) + 1
-                d = r.get("Date", "")
+    for m in MUSCLES:
+        for d, sets in cube.day_sets.get(m, {}).items():
+            if d >= cutoff:
+                muscle_sets[m] = muscle_sets.get(m, 0) + sets
                 if d > muscle_last.get(m, ""):
                     muscle_last[m] = d
 
@@ -305,122 +389,52 @@ def _build_svg_context(muscle_data, volume_map=None):
     return svg
 
 
-@bp.route("/progres")
-def progres():
-    try:
-        hist = get_hist()
-        prog = get_prog()
-    except Exception as e:
-        logger.error("progres() DB failed: %s", e)
-        return render_template(
-            "error.html", code=503,
-            message="Impossible de charger ta progression. Vérifie ta connexion.",
-        ), 503
-    hist = _normalize(hist, prog)
+MONTHS_FR = ["Janvier", "Février", "Mars", "Avril", "Mai", "Juin",
+             "Juillet", "Août", "Septembre", "Octobre", "Novembre", "Décembre"]
+
+# Sections rechargeables seules (/progres/section/<name>) : partial rendu,
+# paramètres d'URL propres à la section, réservée VIP ou non, et `lazy` :
+# absente du rendu de /progres (placeholder), chargée ensuite par la page.
+SECTIONS = {
+    "calendar": {"template": "_progres_calendar.html", "params": ("cy", "cm"), "vip": False,
+                 "lazy": False},
+    "body":     {"template": "_progres_body.html",     "params": ("bm_period",), "vip": True,
+                 "lazy": True},
+    "hof":      {"template": "_progres_hof.html",      "params": ("m",), "vip": True,
+                 "lazy": True},
+    "zoom":     {"template": "_progres_zoom.html",     "params": ("exo", "w"), "vip": False,
+                 "lazy": True},
+}
 
-    # ── Cardio — statistiques dédiées avant filtrage ──
-    cardio_rows = [r for r in hist if str(r.get("Exercice") or "").startswith("CARDIO:")]
-    # start_monday : lundi de la semaine de la toute 1ère séance (muscu + cardio)
-    # pour numéroter S1, S2, … relatif à quand le user a commencé à tracker.
-    start_monday = _compute_start_monday(hist, prog)
-    cardio = _build_cardio_stats(cardio_rows, start_monday)
 
-    # Exclure le cardio des stats muscu (sinon il fausse les 1RM, le filtre muscle, etc.)
-    hist = [r for r in hist if not str(r.get("Exercice") or "").startswith("CARDIO:")]
+def _load():
+    """(prog, snapshot normalisé, archive, index) de l'utilisateur courant."""
+    hist = get_hist()
+    prog = get_prog()
+    snap, archive = _normalize(hist, prog)
+    return prog, snap, archive, HistoryIndex.of(snap)
 
-    # df_p = perfs réelles (Reps > 0), avec 1RM calculé
-    df_p = [r for r in hist if r["Reps"] > 0]
-    for r in df_p:
-        r["1RM"] = calc_1rm(r["Poids"], r["Reps"])
 
-    is_vip = bool(getattr(g, "is_vip", False))
+def _link_params(args, idx, archive):
+    """Paramètres communs à toutes les sections : chaque lien de la page
+    reporte l'état des autres (exo, muscles, mois, période)."""
+    # Exos avec au moins une perf réelle : les records de l'index ne
+    # contiennent que des exos à Reps > 0.
+    all_exos = sorted({e for e in idx.best if not e.startswith("CARDIO:")}
+                      | {a["Exercice"] for a in archive})
 
-    # ── Carte du corps — période sélectionnée ────────────────
-    bm_period = request.args.get("bm_period", "7")
+    bm_period = args.get("bm_period", "7")
     try:
         bm_days = int(bm_period)
     except ValueError:
         bm_days = 7
     if bm_days not in (7, 30, 90):
         bm_days = 7
-    # Stats avancées (body map + hall of fame + 1RM) : VIP only.
-    # Pour les non-VIP on ne calcule rien — le template affiche un aperçu verrouillé.
-    if is_vip:
-        volume_map = _build_volume_map(hist, period_days=bm_days)
-        muscle_data = _build_muscle_data(df_p)
-        svg_ctx = _build_svg_context(muscle_data, volume_map)
-    else:
-        volume_map = {}
-        muscle_data = {}
-        svg_ctx = {}
-
-    # ── Hall of Fame : top 3 par 1RM (filtré par muscles) ───────
-    selected_muscles = request.args.getlist("m") or FILTER_MUSCLES
-    if is_vip:
-        filtered = [r for r in df_p if any(m in (r.get("Muscle") or "") for m in selected_muscles)]
-        by_exo = {}
-        for r in filtered:
-            cur = by_exo.get(r["Exercice"], 0)
-            if r["1RM"] > cur:
-                by_exo[r["Exercice"]] = r["1RM"]
-        podium = sorted(by_exo.items(), key=lambda kv: kv[1], reverse=True)[:3]
-    else:
-        podium = []
-
-    # ── Zoom mouvement ──────────────────────────────────────────
-    all_exos = sorted({r["Exercice"] for r in df_p})
-    sel_exo = request.args.get("exo") or (all_exos[0] if all_exos else None)
-
-    zoom = None
-    if sel_exo:
-        df_e = [r for r in df_p if r["Exercice"] == sel_exo]
-        # Enrichit chaque ligne avec son rel_week (S1/S2/…) — utilisé partout
-        # en dessous. _rel_week peut renvoyer None si Date manquante → on
-        # met 0 par défaut pour garder la ligne visible mais en dernier.
-        for r in df_e:
-            r["_rw"] = _rel_week(r.get("Date"), start_monday) or 0
-        if df_e:
-            best = max(df_e, key=lambda r: (r["Poids"], r["Reps"]))
-            one_rm = calc_1rm(best["Poids"], best["Reps"])
-            # Évolution par semaine : max poids par semaine relative
-            by_week = {}
-            for r in df_e:
-                w = r["_rw"]
-                if r["Poids"] > by_week.get(w, -1):
-                    by_week[w] = r["Poids"]
-            weeks = sorted(by_week.keys())
-            chart_x = [f"S{w}" for w in weeks]
-            chart_y = [by_week[w] for w in weeks]
-
-            # ── Table historique : filtre par semaine (défaut = dernière) ──
-            avail_weeks = sorted({r["_rw"] for r in df_e}, reverse=True)
-            try:
-                sel_week = int(request.args.get("w") or 0) or avail_weeks[0]
-            except (ValueError, TypeError, IndexError):
-                sel_week = avail_weeks[0] if avail_weeks else 0
-            table = [r for r in df_e if r["_rw"] == sel_week]
-            table = sorted(table, key=lambda r: (-r["Poids"], -int(r.get("Série") or 0)))
-
-            zoom = {
-                "exo": sel_exo,
-                "best_w": best["Poids"],
-                "best_r": int(best["Reps"]),
-                "one_rm": round(one_rm, 1) if is_vip else None,
-                "rep_ests": get_rep_estimations(one_rm) if is_vip else None,
-                "rep_table": get_rep_table(one_rm) if is_vip else None,
-                "chart_x": chart_x,
-                "chart_y": chart_y,
-                "table": table,
-                "avail_weeks": avail_weeks,
-                "sel_week": sel_week,
-                "total_sets": len(df_e),
-            }
-
-    # ── Calendrier mensuel ──────────────────────────────────
+
     today = today_paris()
     try:
-        cal_year = int(request.args.get("cy", today.year))
-        cal_month = int(request.args.get("cm", today.month))
+        cal_year = int(args.get("cy", today.year))
+        cal_month = int(args.get("cm", today.month))
     except (ValueError, TypeError):
         cal_year, cal_month = today.year, today.month
     # Clamp
@@ -429,7 +443,93 @@ def progres():
     elif cal_month > 12:
         cal_month, cal_year = 1, cal_year + 1
 
-    _prog_for_cal = get_prog() or {}
+    return {
+        "all_exos": all_exos,
+        "sel_exo": args.get("exo") or (all_exos[0] if all_exos else None),
+        "selected_muscles": args.getlist("m") or FILTER_MUSCLES,
+        "bm_days": bm_days,
+        "cal_year": cal_year,
+        "cal_month": cal_month,
+    }
+
+
+def _body_section(cube, bm_days):
+    """Carte du corps : volume par période + stats par muscle."""
+    volume_map = _build_volume_map(cube, period_days=bm_days)
+    muscle_data = _build_muscle_data(cube)
+    return {
+        "muscle_data": muscle_data,
+        "volume_map": volume_map,
+        "svg_ctx": _build_svg_context(muscle_data, volume_map),
+        "body_polygons": get_body_polygons(),
+        "display_muscles": list(MUSCLES.keys()),
+    }
+
+
+def _zoom_section(idx, archive, start_monday, sel_exo, week_arg, is_vip):
+    """Zoom mouvement : meilleur set, 1RM, évolution et table par semaine."""
+    if not sel_exo:
+        return None
+    df_e = []
+    if not sel_exo.startswith("CARDIO:"):
+        for r in list(idx.by_exo.get(sel_exo, ())) + [a for a in archive if a["Exercice"] == sel_exo]:
+            if r["Reps"] > 0:
+                row = dict(r)
+                row["1RM"] = calc_1rm(r["Poids"], r["Reps"])
+                df_e.append(row)
+    # Enrichit chaque ligne avec son rel_week (S1/S2/…) — utilisé partout
+    # en dessous. _rel_week peut renvoyer None si Date manquante → on
+    # met 0 par défaut pour garder la ligne visible mais en dernier.
+    rel_weeks = {}
+    for r in df_e:
+        d = r.get("Date")
+        rw = rel_weeks.get(d)
+        if rw is None:
+            rw = rel_weeks[d] = _rel_week(d, start_monday) or 0
+        r["_rw"] = rw
+    if not df_e:
+        return None
+    best = max(df_e, key=lambda r: (r["Poids"], r["Reps"]))
+    one_rm = calc_1rm(best["Poids"], best["Reps"])
+    # Évolution par semaine : max poids par semaine relative
+    by_week = {}
+    for r in df_e:
+        w = r["_rw"]
+        if r["Poids"] > by_week.get(w, -1):
+            by_week[w] = r["Poids"]
+    weeks = sorted(by_week.keys())
+    chart_x = [f"S{w}" for w in weeks]
+    chart_y = [by_week[w] for w in weeks]
+
+    # ── Table historique : filtre par semaine (défaut = dernière) ──
+    avail_weeks = sorted({r["_rw"] for r in df_e}, reverse=True)
+    try:
+        sel_week = int(week_arg or 0) or avail_weeks[0]
+    except (ValueError, TypeError, IndexError):
+        sel_week = avail_weeks[0] if avail_weeks else 0
+    table = [r for r in df_e if r["_rw"] == sel_week]
+    table = sorted(table, key=lambda r: (-r["Poids"], -int(r.get("Série") or 0)))
+
+    return {
+        "exo": sel_exo,
+        "best_w": best["Poids"],
+        "best_r": int(best["Reps"]),
+        "one_rm": round(one_rm, 1) if is_vip else None,
+        "rep_ests": get_rep_estimations(one_rm) if is_vip else None,
+        "rep_table": get_rep_table(one_rm) if is_vip else None,
+        "chart_x": chart_x,
+        "chart_y": chart_y,
+        "table": table,
+        "avail_weeks": avail_weeks,
+        "sel_week": sel_week,
+        "total_sets": len(df_e),
+    }
+
+
+def _calendar_section(idx, prog, cal_year, cal_month):
+    """Calendrier mensuel : statut de chaque jour + assiduité."""
+    today = today_paris()
+    _prog_for_cal = prog or {}
     planning_map = _prog_for_cal.get("_planning", {})
     # Date plancher : ne jamais marquer « manquée » une journée antérieure
     # à la création du compte / au démarrage du programme. Couvre le cas
@@ -448,22 +548,19 @@ def progres():
                 floor_date = _dt.fromisoformat(str(completed)[:10]).date()
     except (ValueError, TypeError):
         floor_date = None
-    hist_dates_done = set()
-    hist_dates_missed = set()
-    for r in hist:
-        d = r.get("Date", "")
-        if not d:
-            continue
-        if r["Exercice"] == "SESSION" and "MANQUÉE" in (r.get("Remarque") or ""):
-            hist_dates_missed.add(d)
-        elif r["Poids"] > 0 or r["Reps"] > 0:
-            hist_dates_done.add(d)
-    # Les séances cardio (stockées hors de `hist` désormais) comptent aussi
-    # comme des jours "done" dans le calendrier.
-    for r in cardio_rows:
-        d = r.get("Date", "")
-        if d and int(r.get("Reps") or 0) > 0:
-            hist_dates_done.add(d)
+
+    def _cal_flags(d_str):
+        """(done, missed) pour une journée — seules les lignes du jour sont lues."""
+        done = missed = False
+        for r in idx.by_date.get(d_str, ()):
+            if _is_cardio(r):
+                # Les séances cardio comptent aussi comme des jours "done".
+                done = done or int(r.get("Reps") or 0) > 0
+            elif r["Exercice"] == "SESSION" and "MANQUÉE" in (r.get("Remarque") or ""):
+                missed = True
+            elif r["Poids"] > 0 or r["Reps"] > 0:
+                done = True
+        return done, missed
 
     cal_weeks = []
     first_day, days_in_month = calendar.monthrange(cal_year, cal_month)
@@ -476,12 +573,13 @@ def progres():
         d_str = d.isoformat()
         day_name_fr = DAYS_FR[d.weekday()]
         is_training_day = bool(planning_map.get(day_name_fr, ""))
+        day_done, day_missed = _cal_flags(d_str)
 
-        if d_str in hist_dates_done:
+        if day_done:
             status = "done"
             if is_training_day:
                 done_count += 1
-        elif d_str in hist_dates_missed:
+        elif day_missed:
             status = "missed"
         elif d > today:
             status = "upcoming" if is_training_day else "rest"
@@ -515,50 +613,117 @@ def progres():
         cal_weeks.append(week_row)
 
     cal_rate = round(done_count / planned_count * 100) if planned_count > 0 else 0
-    MONTHS_FR = ["Janvier", "Février", "Mars", "Avril", "Mai", "Juin",
-                 "Juillet", "Août", "Septembre", "Octobre", "Novembre", "Décembre"]
     prev_m, prev_y = (cal_month - 1, cal_year) if cal_month > 1 else (12, cal_year - 1)
     next_m, next_y = (cal_month + 1, cal_year) if cal_month < 12 else (1, cal_year + 1)
+    return {
+        "cal_weeks": cal_weeks,
+        "cal_month_name": MONTHS_FR[cal_month - 1],
+        "cal_rate": cal_rate,
+        "prev_m": prev_m, "prev_y": prev_y,
+        "next_m": next_m, "next_y": next_y,
+    }
+
+
+def _volume_section(idx, start_monday):
+    """Volume par semaine (8 dernières).
 
-    # ── Volume par semaine (8 dernières) ─────────────────────
-    # Indexé relatif à la 1ère séance (S1, S2, …) — pas ISO week.
+    Indexé relatif à la 1ère séance (S1, S2, …) — pas ISO week.
+    Lignes sans Date (archive) ignorées : on parcourt l'index par jour,
+    une seule conversion date → semaine par journée."""
     vol_by_week = {}
-    for r in hist:
-        if r["Poids"] > 0 and r["Reps"] > 0:
-            w = _rel_week(r.get("Date"), start_monday)
-            if w is None:
-                continue
-            vol_by_week[w] = vol_by_week.get(w, 0) + int(r["Poids"] * r["Reps"])
+    for d_str, day_rows in idx.by_date.items():
+        w = _rel_week(d_str, start_monday)
+        if w is None:
+            continue
+        for r in day_rows:
+            if r["Poids"] > 0 and r["Reps"] > 0 and not _is_cardio(r):
+                vol_by_week[w] = vol_by_week.get(w, 0) + int(r["Poids"] * r["Reps"])
     vol_weeks_sorted = sorted(vol_by_week.keys())[-8:]
-    vol_labels = [f"S{w}" for w in vol_weeks_sorted]
     vol_values = [vol_by_week[w] for w in vol_weeks_sorted]
-    vol_max = max(vol_values) if vol_values else 1
+    return {
+        "vol_labels": [f"S{w}" for w in vol_weeks_sorted],
+        "vol_values": vol_values,
+        "vol_max": max(vol_values) if vol_values else 1,
+    }
+
+
+def _section(name, prog, snap, archive, idx, params, is_vip):
+    """Variables de template d'une section (+ données JS éventuelles)."""
+    if name == "calendar":
+        return _calendar_section(idx, prog, params["cal_year"], params["cal_month"]), None
+    if name == "zoom":
+        zoom = _zoom_section(idx, archive, _compute_start_monday(idx, prog),
+                             params["sel_exo"], request.args.get("w"), is_vip)
+        return {"zoom": zoom}, None
+    cube = _ProgressCube.of(idx, snap, archive)
+    if name == "body":
+        ctx = _body_section(cube, params["bm_days"])
+        return ctx, {"muscle_data": ctx["muscle_data"], "volume_map": ctx["volume_map"]}
+    # hof — Hall of Fame : top 3 par 1RM (filtré par muscles)
+    return {"podium": _build_podium(cube, params["selected_muscles"]),
+            "filter_muscles": FILTER_MUSCLES}, None
+
+
+@bp.route("/progres")
+def progres():
+    try:
+        prog, snap, archive, idx = _load()
+    except Exception as e:
+        logger.error("progres() DB failed: %s", e)
+        return render_template(
+            "error.html", code=503,
+            message="Impossible de charger ta progression. Vérifie ta connexion.",
+        ), 503
+
+    # ── Cardio — statistiques dédiées avant filtrage ──
+    cardio_rows = [r for r in snap if _is_cardio(r)]
+    # start_monday : lundi de la semaine de la toute 1ère séance (muscu + cardio)
+    # pour numéroter S1, S2, … relatif à quand le user a commencé à tracker.
+    start_monday = _compute_start_monday(idx, prog)
+    cardio = _build_cardio_stats(cardio_rows, start_monday)
+
+    is_vip = bool(getattr(g, "is_vip", False))
+    params = _link_params(request.args, idx, archive)
+
+    # Seules les sections légères sont rendues ici. Les lourdes (carte du
+    # corps et Hall of Fame sur le cube, zoom mouvement) sont des
+    # placeholders que la page remplit via /progres/section/<name> : le
+    # premier rendu ne construit pas le cube. Stats avancées VIP only — pour
+    # les non-VIP le template affiche un aperçu verrouillé, sans requête.
+    ctx = {}
+    for name, spec in SECTIONS.items():
+        if spec["lazy"] or (spec["vip"] and not is_vip):
+            continue
+        ctx.update(_section(name, prog, snap, archive, idx, params, is_vip)[0])
 
     return render_template(
         "progres.html",
         active="progres",
-        muscle_data=muscle_data,
-        svg_ctx=svg_ctx,
-        body_polygons=get_body_polygons(),
-        volume_map=volume_map,
-        bm_days=bm_days,
-        display_muscles=list(MUSCLES.keys()),
-        filter_muscles=FILTER_MUSCLES,
-        selected_muscles=selected_muscles,
-        podium=podium,
-        all_exos=all_exos,
-        sel_exo=sel_exo,
-        zoom=zoom,
-        has_data=bool(df_p),
-        cal_weeks=cal_weeks,
-        cal_month_name=MONTHS_FR[cal_month - 1],
-        cal_year=cal_year,
-        cal_month=cal_month,
-        cal_rate=cal_rate,
-        prev_m=prev_m, prev_y=prev_y,
-        next_m=next_m, next_y=next_y,
-        vol_labels=vol_labels,
-        vol_values=vol_values,
-        vol_max=vol_max,
+        **params,
+        **ctx,
+        has_data=bool(params["all_exos"]),
+        **_volume_section(idx, start_monday),
         cardio=cardio,
+        section_params={name: spec["params"] for name, spec in SECTIONS.items()},
     )
+
+
+@bp.route("/progres/section/<name>")
+def progres_section(name):
+    """Fragment d'une section : {"html": partial rendu, "data": données JS}.
+    La page remplace la carte concernée sans recalculer les autres."""
+    spec = SECTIONS.get(name)
+    if spec is None:
+        abort(404)
+    is_vip = bool(getattr(g, "is_vip", False))
+    if spec["vip"] and not is_vip:
+        return jsonify({"error": "Stats avancées réservées aux membres PRO."}), 403
+    try:
+        prog, snap, archive, idx = _load()
+    except Exception as e:
+        logger.error("progres_section(%s) DB failed: %s", name, e)
+        return jsonify({"error": "Impossible de charger ta progression."}), 503
+    params = _link_params(request.args, idx, archive)
+    ctx, data = _section(name, prog, snap, archive, idx, params, is_vip)
+    html = render_template(spec["template"], **params, **ctx)
+    return jsonify({"html": html, "data": data})
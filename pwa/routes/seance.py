@@ -10,14 +10,15 @@ from flask import Blueprint, render_template, request, redirect, url_for, abort,
 logger = logging.getLogger(__name__)
 
 from core.data import (
-    get_hist, get_prog, clear_user_cache,
+    get_hist, get_prog,
     replace_exo_rows, delete_exo_rows, delete_session_rows, mark_session_missed,
 )
 from core.dates import today_paris, today_paris_str, logical_today_paris, logical_today_paris_str, now_paris, DAYS_FR, MONTHS_FR
 from core.limiter import limiter
-from core.muscu import calc_1rm, get_base_name, fix_muscle, auto_muscles
+from core.muscu import auto_muscles
 from core.exercises_data import get_exercise_info, filter_exos_by_equipment, detect_isometric
 from core.body_map import get_body_polygons
+from core.history import HistoryIndex, normalize_muscles
 
 bp = Blueprint("seance", __name__)
 
@@ -32,15 +33,10 @@ BW_EXOS = {"Dips", "Tractions"}
 # ────────────────────────────────────────────────────────────────
 
 def _normalize_hist(hist, prog):
+    """Muscle via le mapping du programme + fix_muscle (normalisation
+    mémorisée sur le snapshot, cf. core.history.normalize_muscles)."""
     prog_seances = {k: v for k, v in prog.items() if not k.startswith("_")}
-    muscle_mapping = {ex["name"]: ex.get("muscle", "Autre")
-                      for s in prog_seances for ex in prog_seances[s]}
-    for r in hist:
-        base = get_base_name(r["Exercice"])
-        if base in muscle_mapping:
-            r["Muscle"] = muscle_mapping[base]
-        r["Muscle"] = fix_muscle(r["Exercice"], r["Muscle"])
-    return hist, prog_seances
+    return normalize_muscles(hist, prog), prog_seances
 
 
 def _parse_date(s):
@@ -67,15 +63,7 @@ def _display_week(target_date, prog, hist):
         start = None
     if start is None:
         # Fallback: date de la première séance non-archivée avec Date valide
-        dates = []
-        for r in hist:
-            d = r.get("Date")
-            if d:
-                try:
-                    dates.append(datetime.strptime(d, "%Y-%m-%d").date())
-                except (ValueError, TypeError):
-                    pass
-        start = min(dates) if dates else target_date
+        start = HistoryIndex.of(hist).first_date or target_date
         # Persist for next time
         from core.data import get_prog as _gp, save_prog as _sp
         p = _gp()
@@ -101,7 +89,7 @@ def _is_real_perf(r):
 
 def _find_done_session(date_iso, hist):
     """Si une séance a été effectivement réalisée ce jour-là, retourne son nom."""
-    day_rows = [r for r in hist if r["Date"] == date_iso]
+    day_rows = HistoryIndex.of(hist).by_date.get(date_iso, ())
     real = [r for r in day_rows if _is_real_perf(r)]
     if not real:
         return None
@@ -112,8 +100,8 @@ def _find_done_session(date_iso, hist):
 
 
 def _exo_curr_rows(hist, semaine, seance, exercice):
-    return [r for r in hist
-            if r["Semaine"] == semaine and r["Séance"] == seance and r["Exercice"] == exercice]
+    rows = HistoryIndex.of(hist).by_week_seance.get((semaine, seance), ())
+    return [r for r in rows if r["Exercice"] == exercice]
 
 
 def _exo_completed(curr_rows):
@@ -126,11 +114,10 @@ def _exo_completed(curr_rows):
 
 def _last_variant(hist, seance, exo_base):
     """Dernière variante utilisée pour cet exo dans cette séance."""
-    matches = [r for r in hist
-               if r["Séance"] == seance and exo_base in r["Exercice"]]
-    if not matches:
+    last = next((r["Exercice"] for r in reversed(HistoryIndex.of(hist).by_seance.get(seance, ()))
+                 if exo_base in r["Exercice"]), None)
+    if last is None:
         return "Standard"
-    last = matches[-1]["Exercice"]
     if "(" in last:
         v = last.split("(")[1].replace(")", "").strip()
         return v if v in VARIANTS else "Standard"
@@ -139,24 +126,21 @@ def _last_variant(hist, seance, exo_base):
 
 def _best_record(hist, exo_final, is_bw):
     """Renvoie {best_weight, best_1rm, best_reps} pour la variante exacte."""
-    matches = [r for r in hist if r["Exercice"] == exo_final and r["Reps"] > 0]
-    if not matches:
+    best = HistoryIndex.of(hist).best.get(exo_final)
+    if best is None:
         return None
     if is_bw:
-        return {"reps": max(r["Reps"] for r in matches)}
-    best_w = max(r["Poids"] for r in matches)
-    best_1rm = max(calc_1rm(r["Poids"], r["Reps"]) for r in matches)
-    return {"weight": best_w, "one_rm": round(best_1rm, 1)}
+        return {"reps": best["reps"]}
+    return {"weight": best["weight"], "one_rm": round(best["one_rm"], 1)}
 
 
 def _previous_weeks_data(hist, exo_final, seance, s_act, n_weeks=2):
     """Semaines précédentes avec leurs séries, + semaines manquées."""
-    f_h = [r for r in hist if r["Exercice"] == exo_final and r["Séance"] == seance]
-    hist_weeks_all = sorted({r["Semaine"] for r in f_h if r["Semaine"] < s_act})
-    hist_weeks = [w for w in hist_weeks_all
-                  if any(r["Semaine"] == w and r["Poids"] > 0 for r in f_h)]
-    missed = {r["Semaine"] for r in hist
-              if r["Séance"] == seance and r["Exercice"] == "SESSION" and r["Semaine"] < s_act}
+    idx = HistoryIndex.of(hist)
+    f_h = idx.by_seance_exo.get((seance, exo_final), ())
+    hist_weeks = sorted({r["Semaine"] for r in f_h if r["Semaine"] < s_act and r["Poids"] > 0})
+    missed = {r["Semaine"] for r in idx.by_seance_exo.get((seance, "SESSION"), ())
+              if r["Semaine"] < s_act}
 
     if not hist_weeks:
         return []
@@ -180,9 +164,10 @@ def _recup_status(hist, s_act):
     muscles = ["Pecs", "Dos", "Épaules", "Biceps", "Triceps", "Abdos", "Quadriceps",
                "Adducteurs", "Abducteurs", "Mollets"]
     now = now_paris().replace(tzinfo=None)
+    week_rows = HistoryIndex.of(hist).by_week.get(s_act, ())
     out = []
     for m in muscles:
-        trained = [r for r in hist if r["Semaine"] == s_act and m in (r.get("Muscle") or "")]
+        trained = [r for r in week_rows if m in (r.get("Muscle") or "")]
         color, label = "#00FF7F", "PRÊT"
         if trained:
             dates = [r["Date"] for r in trained if r.get("Date")]
@@ -204,14 +189,13 @@ def _last_session_sets(hist, exo_final, seance, s_act):
     """Retourne les séries de la dernière semaine où cet exo a été réalisé,
     sous forme de liste de dicts {reps, poids}. Utilisé pour le pré-remplissage
     des poids et l'affichage inline 'Dernière fois'."""
-    matches = [r for r in hist
-               if r["Exercice"] == exo_final and r["Séance"] == seance
-               and r["Semaine"] < s_act and r["Poids"] > 0]
+    idx = HistoryIndex.of(hist)
+    matches = [r for r in idx.by_seance_exo.get((seance, exo_final), ())
+               if r["Semaine"] < s_act and r["Poids"] > 0]
     if not matches:
         # Chercher dans toutes les séances si pas trouvé dans la même séance
-        matches = [r for r in hist
-                   if r["Exercice"] == exo_final
-                   and r["Semaine"] < s_act and r["Poids"] > 0]
+        matches = [r for r in idx.by_exo.get(exo_final, ())
+                   if r["Semaine"] < s_act and r["Poids"] > 0]
     if not matches:
         return []
     last_week = max(r["Semaine"] for r in matches)
@@ -417,10 +401,12 @@ def seance():
             planning_map = prog.get("_planning", {})
             seance_names_set = set(prog_seances.keys())
             # Séances déjà faites sur une date donnée (par nom).
+            by_date = HistoryIndex.of(hist).by_date
             done_by_date = {}
-            for r in hist:
-                if _is_real_perf(r) and r.get("Date") and r.get("Séance"):
-                    done_by_date.setdefault(r["Date"], set()).add(r["Séance"])
+            for d_iso, day_rows in by_date.items():
+                for r in day_rows:
+                    if _is_real_perf(r) and r.get("Séance"):
+                        done_by_date.setdefault(d_iso, set()).add(r["Séance"])
             # Pour chaque nom de séance, collecte toutes les dates où elle
             # a été faite (sert à détecter un rattrapage déjà effectué).
             done_dates_by_seance = {}
@@ -455,9 +441,8 @@ def seance():
                     continue
                 # Marquée manquée explicitement ?
                 marked_missed = any(
-                    r for r in hist
-                    if r.get("Date") == d_iso
-                    and r.get("Exercice") == "SESSION"
+                    r for r in by_date.get(d_iso, ())
+                    if r.get("Exercice") == "SESSION"
                     and "MANQUÉE" in (r.get("Remarque") or "")
                 )
                 if marked_missed:
@@ -512,10 +497,9 @@ def seance():
                     for e, is_extra in all_exos]
 
         # Volume
-        vol_curr = sum(r["Poids"] * r["Reps"] for r in hist
-                       if r["Séance"] == name and r["Semaine"] == s_act)
-        vol_prev = sum(r["Poids"] * r["Reps"] for r in hist
-                       if r["Séance"] == name and r["Semaine"] == s_act - 1)
+        by_week_seance = HistoryIndex.of(hist).by_week_seance
+        vol_curr = sum(r["Poids"] * r["Reps"] for r in by_week_seance.get((s_act, name), ()))
+        vol_prev = sum(r["Poids"] * r["Reps"] for r in by_week_seance.get((s_act - 1, name), ()))
         vol_ratio = min((vol_curr / vol_prev) if vol_prev > 0 else 0, 1.2)
 
         # Progression : exercices complétés / total
@@ -637,8 +621,8 @@ def _parse_cardio_remarque(remarque):
 def _build_cardio_done(hist, seance_name, date_iso):
     """Retourne la liste des blocs cardio déjà enregistrés pour cette séance/date."""
     out = []
-    for r in hist:
-        if r.get("Date") != date_iso or r.get("Séance") != seance_name:
+    for r in HistoryIndex.of(hist).by_date.get(date_iso, ()):
+        if r.get("Séance") != seance_name:
             continue
         exo = r.get("Exercice") or ""
         if not exo.startswith("CARDIO:"):
@@ -718,7 +702,6 @@ def save_exo():
 
     try:
         replace_exo_rows(semaine, seance, exo_final, new_rows)
-        clear_user_cache()
     except Exception as e:
         logger.error("save-exo FAILED seance=%s exo=%s: %s", seance, exo_final, e)
         return render_template(
@@ -743,7 +726,6 @@ def skip_exo():
         "Date": f["date"],
     }]
     replace_exo_rows(semaine, seance, exo_final, new_rows)
-    clear_user_cache()
     return _back_to_editor(f)
 
 
@@ -757,7 +739,6 @@ def reset_exo():
     exo_base = f["exo_base"]
     exo_final = f"{exo_base} ({variant})" if variant != "Standard" else exo_base
     delete_exo_rows(semaine, seance, exo_final)
-    clear_user_cache()
     return _back_to_editor(f)
 
 
@@ -766,7 +747,6 @@ def reset_exo():
 def reset_session():
     f = request.form
     delete_session_rows(int(f["semaine"]), f["seance_name"])
-    clear_user_cache()
     return _back_to_editor(f)
 
 
@@ -779,7 +759,6 @@ def mark_missed():
     semaine = _iso_week(target)
     seance_name = f.get("seance_name") or "Séance manquée"
     mark_session_missed(semaine, seance_name, date_str)
-    clear_user_cache()
     return redirect(url_for("accueil.index"))
 
 
@@ -902,7 +881,6 @@ def add_cardio():
     }]
     try:
         replace_exo_rows(semaine, seance_name, exo_final, rows)
-        clear_user_cache()
     except Exception as e:
         logger.error("add-cardio FAILED: %s", e)
     return _back_to_editor(f)
@@ -923,7 +901,6 @@ def delete_cardio():
         return _back_to_editor(f)
     try:
         delete_exo_rows(semaine, seance_name, f"CARDIO:{activite}")
-        clear_user_cache()
     except Exception as e:
         logger.error("delete-cardio FAILED: %s", e)
     return _back_to_editor(f)
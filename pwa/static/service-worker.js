@@ -1,7 +1,10 @@
 // Service worker — Network First avec mise à jour automatique.
-// IMPORTANT : incrémenter CACHE_VERSION à chaque déploiement pour forcer le refresh.
-const CACHE_VERSION = "v72-2026-04-28-glass-perf";
-const CACHE = "muscu-pwa-" + CACHE_VERSION;
+// ASSETS_VERSION et les URLs /static/ du shell (?v=<empreinte>) sont
+// injectés par la route /service-worker.js (core.assets) : le SW change dès
+// qu'un asset change. CACHE_VERSION ne se bumpe plus que pour la logique du SW.
+const CACHE_VERSION = "v73-2026-10-18-assets";
+const ASSETS_VERSION = "dev";
+const CACHE = "muscu-pwa-" + CACHE_VERSION + "-" + ASSETS_VERSION;
 
 const APP_SHELL = [
   "/accueil",
@@ -102,7 +105,21 @@ self.addEventListener("fetch", (event) => {
     return;
   }
 
-  // Assets statiques : Network First avec fallback cache.
+  // Assets versionnés (?v=<empreinte>) : contenu immuable → Cache First.
+  if (url.pathname.startsWith("/static/") && url.searchParams.has("v")) {
+    event.respondWith(
+      caches.match(req).then((cached) => cached || fetch(req).then((resp) => {
+        if (resp && resp.status === 200 && resp.type === "basic") {
+          const copy = resp.clone();
+          caches.open(CACHE).then((c) => c.put(req, copy));
+        }
+        return resp;
+      }))
+    );
+    return;
+  }
+
+  // Autres assets : Network First avec fallback cache.
   event.respondWith(
     fetch(req)
       .then((resp) => {
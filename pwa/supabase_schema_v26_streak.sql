@@ -0,0 +1,27 @@
+-- ============================================================================
+-- Muscu PRO — Migration v26 : record de streak en colonne
+-- ============================================================================
+-- Objectif : sortir le record de streak du document JSON `programs.data`
+-- (clé `_streak_record`). Le record est désormais mis à jour par un UPDATE
+-- ciblé de cette seule colonne (core.db._update_streak_record), au lieu d'un
+-- upsert complet du programme à chaque nouveau record.
+--
+-- L'écriture est monotone : UPDATE ... WHERE streak_record < nouveau_record.
+--
+-- Idempotent : peut être rejoué sans risque.
+-- ============================================================================
+
+-- 1) Colonne record
+ALTER TABLE public.programs
+    ADD COLUMN IF NOT EXISTS streak_record integer NOT NULL DEFAULT 0;
+
+-- 2) Reprise des records existants stockés dans le JSON
+UPDATE public.programs
+   SET streak_record = (data->>'_streak_record')::integer
+ WHERE data ? '_streak_record'
+   AND (data->>'_streak_record') ~ '^[0-9]+$'
+   AND (data->>'_streak_record')::integer > streak_record;
+
+-- ============================================================================
+-- Fin migration v26
+-- ============================================================================
@@ -0,0 +1,102 @@
+-- ============================================================================
+-- Muscu PRO — Migration v27 : tour de coach IA en un aller-retour
+-- ============================================================================
+-- Objectif : un message au coach coûtait ~6 allers-retours hors LLM
+-- (lecture profil → upsert quota → lecture des 10 derniers messages → LLM →
+-- 2 inserts, + relecture profil si l'appel échouait). Désormais :
+--   1) `coach_reserve_turn` réserve atomiquement un message du quota du jour
+--      et renvoie la fin de la conversation (core.db.reserve_coach_turn) ;
+--   2) les deux messages (user + assistant) partent en un seul INSERT.
+-- `coach_release_turn` rend le message réservé si l'appel LLM échoue.
+--
+-- La réservation est un INSERT ... ON CONFLICT DO UPDATE ... WHERE : deux
+-- onglets qui envoient en même temps ne peuvent pas dépasser la limite.
+--
+-- Les fonctions prennent un user_id explicite : réservées à service_role
+-- (le backend), jamais exposées à anon / authenticated.
+--
+-- Sans cette migration, core.db retombe sur l'ancien chemin (plus lent).
+--
+-- Idempotent : peut être rejoué sans risque.
+-- ============================================================================
+
+-- 1) Réservation d'un message + fin de conversation
+CREATE OR REPLACE FUNCTION public.coach_reserve_turn(
+    p_user_id uuid,
+    p_day     date,
+    p_limit   integer,
+    p_tail    integer DEFAULT 10
+)
+RETURNS jsonb
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_count   integer;
+    v_allowed boolean;
+    v_tail    jsonb := '[]'::jsonb;
+BEGIN
+    INSERT INTO public.profiles AS p (id, coach_quota_date, coach_quota_count)
+    VALUES (p_user_id, p_day, 1)
+    ON CONFLICT (id) DO UPDATE
+       SET coach_quota_count = CASE WHEN p.coach_quota_date = p_day
+                                    THEN p.coach_quota_count + 1 ELSE 1 END,
+           coach_quota_date  = p_day
+     WHERE p.coach_quota_date IS DISTINCT FROM p_day
+        OR p.coach_quota_count < p_limit
+    RETURNING p.coach_quota_count INTO v_count;
+    v_allowed := FOUND;
+
+    IF NOT v_allowed THEN
+        SELECT coach_quota_count INTO v_count
+          FROM public.profiles
+         WHERE id = p_user_id;
+    ELSE
+        SELECT coalesce(jsonb_agg(jsonb_build_object(
+                   'role', t.role, 'content', t.content, 'created_at', t.created_at)
+                   ORDER BY t.created_at), '[]'::jsonb)
+          INTO v_tail
+          FROM (SELECT role, content, created_at
+                  FROM public.coach_messages
+                 WHERE user_id = p_user_id
+                 ORDER BY created_at DESC
+                 LIMIT greatest(p_tail, 0)) t;
+    END IF;
+
+    RETURN jsonb_build_object('allowed', v_allowed, 'count', coalesce(v_count, 0), 'tail', v_tail);
+END;
+$$;
+
+-- 2) Restitution d'un message réservé (échec de l'appel LLM)
+CREATE OR REPLACE FUNCTION public.coach_release_turn(
+    p_user_id uuid,
+    p_day     date
+)
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_count integer;
+BEGIN
+    UPDATE public.profiles
+       SET coach_quota_count = coach_quota_count - 1
+     WHERE id = p_user_id
+       AND coach_quota_date = p_day
+       AND coach_quota_count > 0
+    RETURNING coach_quota_count INTO v_count;
+    RETURN v_count;
+END;
+$$;
+
+-- 3) Droits : backend uniquement
+REVOKE ALL ON FUNCTION public.coach_reserve_turn(uuid, date, integer, integer) FROM PUBLIC, anon, authenticated;
+REVOKE ALL ON FUNCTION public.coach_release_turn(uuid, date) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.coach_reserve_turn(uuid, date, integer, integer) TO service_role;
+GRANT EXECUTE ON FUNCTION public.coach_release_turn(uuid, date) TO service_role;
+
+-- 4) Fin de conversation : lue par (user_id, created_at DESC)
+CREATE INDEX IF NOT EXISTS coach_messages_user_created_idx
+    ON public.coach_messages (user_id, created_at DESC);
+
+-- ============================================================================
+-- Fin migration v27
+-- ============================================================================
@@ -0,0 +1,53 @@
+-- ============================================================================
+-- Muscu PRO — Migration v28 : réécriture transactionnelle de l'historique
+-- ============================================================================
+-- Objectif : `core.db.save_hist` (import, reset) relisait tout l'historique
+-- comme copie de secours, le supprimait, le réinsérait par paquets de 500 et,
+-- en cas d'échec, réinsérait la copie depuis Python — une fenêtre où
+-- l'historique pouvait être vide ou partiel, et 3 + N/500 allers-retours.
+--
+-- `replace_history` fait DELETE + INSERT dans une seule transaction (un
+-- appel RPC = une transaction PostgREST) : soit tout passe, soit rien ne
+-- change. Le payload (tableau JSON des lignes, colonnes de la table
+-- `history`) n'est envoyé qu'une fois ; aucune relecture préalable.
+--
+-- Le user_id des lignes est ignoré : seul `p_user_id` fait foi.
+-- Réservée à service_role (le backend), jamais exposée à anon / authenticated.
+--
+-- Sans cette migration, core.db retombe sur l'ancien chemin.
+--
+-- Idempotent : peut être rejoué sans risque.
+-- ============================================================================
+
+CREATE OR REPLACE FUNCTION public.replace_history(
+    p_user_id uuid,
+    p_rows    jsonb
+)
+RETURNS integer
+LANGUAGE plpgsql
+SET statement_timeout = '120s'
+AS $$
+DECLARE
+    v_count integer;
+BEGIN
+    DELETE FROM public.history WHERE user_id = p_user_id;
+
+    INSERT INTO public.history
+           (user_id, semaine, seance, exercice, serie, reps, poids, remarque, muscle, date)
+    SELECT p_user_id, r.semaine, r.seance, r.exercice, r.serie, r.reps, r.poids,
+           r.remarque, r.muscle, r.date
+      FROM jsonb_populate_recordset(NULL::public.history, coalesce(p_rows, '[]'::jsonb))
+           WITH ORDINALITY AS r
+     ORDER BY ordinality;  -- ids dans l'ordre du payload
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+
+    RETURN v_count;
+END;
+$$;
+
+REVOKE ALL ON FUNCTION public.replace_history(uuid, jsonb) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.replace_history(uuid, jsonb) TO service_role;
+
+-- ============================================================================
+-- Fin migration v28
+-- ============================================================================
@@ -0,0 +1,88 @@
+-- ============================================================================
+-- Muscu PRO — Migration v29 : import fusionné de l'historique
+-- ============================================================================
+-- Objectif : l'import de /gestion ne savait que tout remplacer. En mode
+-- « fusionner », chaque paquet de lignes (500 max, cf. routes.gestion) est
+-- upserté sur la clé (semaine, séance, exercice, série) :
+--   - une série déjà présente est remplacée par celle du fichier ;
+--   - une série absente est ajoutée.
+-- Dans un même paquet, la dernière occurrence d'une clé l'emporte.
+--
+-- Remplacer = DELETE des lignes existantes + INSERT de tout le paquet
+-- (ids neufs, dans l'ordre du paquet), pas un UPDATE en place : les caches
+-- de core.db (sync delta par high-water mark + COUNT, empreinte du streak,
+-- agrégats des badges) ne voient que les nouveaux ids et les changements
+-- de nombre de lignes — une ligne modifiée en gardant son id leur serait
+-- invisible dans les autres workers.
+--
+-- Pas de contrainte UNIQUE sur la clé : un historique existant peut
+-- contenir des doublons (ils sont tous remplacés par la série du fichier).
+-- Les imports concurrents d'un même user sont sérialisés par un verrou
+-- consultatif.
+--
+-- Le user_id des lignes est ignoré : seul `p_user_id` fait foi.
+-- Réservée à service_role (le backend), jamais exposée à anon / authenticated.
+--
+-- Sans cette migration, core.db retombe sur un chemin Python (lecture des
+-- clés des semaines du paquet, insert, puis delete des lignes remplacées).
+--
+-- Idempotent : peut être rejoué sans risque.
+-- ============================================================================
+
+-- 1) Upsert d'un paquet
+CREATE OR REPLACE FUNCTION public.merge_history(
+    p_user_id uuid,
+    p_rows    jsonb
+)
+RETURNS jsonb
+LANGUAGE plpgsql
+SET statement_timeout = '120s'
+AS $$
+DECLARE
+    v_updated  integer;
+    v_inserted integer;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('merge_history:' || p_user_id::text));
+
+    WITH src AS (
+        SELECT DISTINCT ON (r.semaine, r.seance, r.exercice, r.serie)
+               r.semaine, r.seance, r.exercice, r.serie, r.reps, r.poids,
+               r.remarque, r.muscle, r.date, r.ordinality
+          FROM jsonb_populate_recordset(NULL::public.history, coalesce(p_rows, '[]'::jsonb))
+               WITH ORDINALITY AS r
+         ORDER BY r.semaine, r.seance, r.exercice, r.serie, r.ordinality DESC
+    ), del AS (
+        DELETE FROM public.history h
+         USING src s
+         WHERE h.user_id = p_user_id
+           AND h.semaine = s.semaine AND h.seance = s.seance
+           AND h.exercice = s.exercice AND h.serie = s.serie
+        RETURNING h.semaine, h.seance, h.exercice, h.serie
+    ), ins AS (
+        INSERT INTO public.history
+               (user_id, semaine, seance, exercice, serie, reps, poids, remarque, muscle, date)
+        SELECT p_user_id, s.semaine, s.seance, s.exercice, s.serie, s.reps, s.poids,
+               s.remarque, s.muscle, s.date
+          FROM src s
+         ORDER BY s.ordinality
+        RETURNING 1
+    )
+    SELECT (SELECT count(*) FROM (SELECT DISTINCT semaine, seance, exercice, serie FROM del) k),
+           (SELECT count(*) FROM ins)
+      INTO v_updated, v_inserted;
+    v_inserted := v_inserted - v_updated;  -- séries remplacées ≠ ajoutées
+
+    RETURN jsonb_build_object('inserted', v_inserted, 'updated', v_updated);
+END;
+$$;
+
+REVOKE ALL ON FUNCTION public.merge_history(uuid, jsonb) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.merge_history(uuid, jsonb) TO service_role;
+
+-- 2) Recherche des séries existantes par clé
+CREATE INDEX IF NOT EXISTS history_user_key_idx
+    ON public.history (user_id, semaine, seance, exercice, serie);
+
+-- ============================================================================
+-- Fin migration v29
+-- ============================================================================
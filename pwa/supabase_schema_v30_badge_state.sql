@@ -0,0 +1,24 @@
+-- ============================================================================
+-- Muscu PRO — Migration v30 : état des badges hors de programs.data
+-- ============================================================================
+-- Objectif : l'état incrémental des badges (clé `_badge_state`, une entrée
+-- par couple semaine × séance) était stocké dans le document JSON
+-- `programs.data`. Il grossissait sans fin et était relu / réécrit à chaque
+-- `get_prog` / `save_prog`. Il vit désormais seulement dans le cache
+-- (`agg:badges:{user_id}`, cf. core.badges) et se reconstruit en un passage
+-- sur l'historique s'il manque. La liste des badges obtenus (`_badges`)
+-- reste dans le programme.
+--
+-- Cette migration retire la clé des programmes existants. Sans elle, la
+-- clé est retirée au prochain déblocage de badge (routes.accueil).
+--
+-- Idempotent : peut être rejoué sans risque.
+-- ============================================================================
+
+UPDATE public.programs
+   SET data = data - '_badge_state'
+ WHERE data ? '_badge_state';
+
+-- ============================================================================
+-- Fin migration v30
+-- ============================================================================
@@ -0,0 +1,31 @@
+-- ============================================================================
+-- Muscu PRO — Migration v31 : job d'import persistant
+-- ============================================================================
+-- Objectif : le job d'import (progression + point de reprise, cf.
+-- routes.gestion.import_data) ne vivait que dans le cache (`import:{user_id}`).
+-- Un redémarrage, une éviction ou un autre worker avec le cache mémoire
+-- perdait le point de reprise : renvoyer le fichier recommençait l'import
+-- depuis le début alors que la page annonçait une reprise.
+--
+-- Le job est désormais écrit ici à chaque paquet (core.db.save_import_job,
+-- une ligne par user) ; le cache reste la source lue par
+-- /gestion/import/status pendant l'envoi.
+--
+-- Table réservée au backend (service_role) : RLS activé, aucune policy.
+--
+-- Sans cette migration, le job reste en cache seul (ancien comportement).
+--
+-- Idempotent : peut être rejoué sans risque.
+-- ============================================================================
+
+CREATE TABLE IF NOT EXISTS public.import_jobs (
+    user_id    uuid PRIMARY KEY REFERENCES auth.users(id) ON DELETE CASCADE,
+    job        jsonb NOT NULL,
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+ALTER TABLE public.import_jobs ENABLE ROW LEVEL SECURITY;
+
+-- ============================================================================
+-- Fin migration v31
+-- ============================================================================